@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from card_ocr import read_insurance_card
+from extraction_cache import make_cache_key
+from text_extraction import SUPPORTED_EXTENSIONS, extract_text_from_source, is_pdf
+from upload_spool import portable_source
+
+# -------------------- CONFIGURATION --------------------
+
+DEFAULT_TEXT_WORKERS = os.cpu_count() or 2
+DEFAULT_LLM_WORKERS = int(os.getenv("BATCH_LLM_WORKERS", 4))
+DEFAULT_GROUP_SIZE = int(os.getenv("BATCH_GROUP_SIZE", 8))
+
+# -------------------- RESULTS --------------------
+
+def _new_result(file_name):
+    return {
+        "file": file_name,
+        "status": "queued",
+        "text_seconds": 0.0,
+        "llm_seconds": 0.0,
+        "total_seconds": 0.0,
+        "fields_found": 0,
+        "error": "",
+        "document_text": None,
+        "extracted_data": None,
+    }
+
+def _finish(result, started, status, error=""):
+    result["status"] = status
+    result["error"] = error
+    result["total_seconds"] = round(time.perf_counter() - started, 3)
+    data = result["extracted_data"] or {}
+    result["fields_found"] = sum(1 for value in data.values() if value and value != "Not found")
+    return result
+
+def summary_row(result):
+    """Flattens a batch result into the columns shown in the results table."""
+    data = result["extracted_data"] or {}
+    return {
+        "File": result["file"],
+        "Status": result["status"],
+        "Text (s)": result["text_seconds"],
+        "LLM (s)": result["llm_seconds"],
+        "Total (s)": result["total_seconds"],
+        "Fields": result["fields_found"],
+        "Patient": data.get("patient_name", ""),
+        "Policy": data.get("policy_number", ""),
+        "Error": result["error"],
+    }
+
+# -------------------- PIPELINE --------------------
+
+def _timed_text(source, file_name, document_type, max_chars, smart_window):
+    """Returns ((text, local_fields), seconds); local_fields is set when a card was read without Gemini."""
+    started = time.perf_counter()
+    if document_type == "Insurance Card" and not is_pdf(file_name):
+        card = read_insurance_card(source)
+        local_fields = card["fields"] if card["confident"] else None
+        return (card["text"], local_fields), time.perf_counter() - started
+    text = extract_text_from_source(source, file_name, max_chars=max_chars, smart_window=smart_window,
+                                    document_type=document_type)
+    return (text, None), time.perf_counter() - started
+
+def _timed_fields(extract_fields, document_text, document_type):
+    started = time.perf_counter()
+    data = extract_fields(document_text, document_type)
+    return data, time.perf_counter() - started
+
+def _finish_llm(result, started, cache, cache_key, data, seconds):
+    result["llm_seconds"] = round(seconds, 3)
+    result["extracted_data"] = data
+    if cache is not None:
+        cache.put(cache_key, result["document_text"], data)
+    if data:
+        return _finish(result, started, "done")
+    return _finish(result, started, "failed", "no fields extracted")
+
+def run_batch(documents, document_type, extract_fields, cache=None, prompt_version=None,
+              max_chars=None, smart_window=False, extract_fields_many=None, group_size=DEFAULT_GROUP_SIZE,
+              text_workers=DEFAULT_TEXT_WORKERS, llm_workers=DEFAULT_LLM_WORKERS, cache_variant=None):
+    """Yields one result dict per (file_name, source) document as soon as it finishes.
+
+    A source is the file's bytes, a path or a SpooledUpload; worker processes get paths
+    rather than copies wherever there is one.
+
+    Text extraction is fanned out to a process pool and `extract_fields` calls to a
+    bounded thread pool, so documents move to the LLM stage as soon as their text is ready.
+    When `extract_fields_many` is given, ready documents are handed to it in groups of up
+    to `group_size` as (document_id, text) pairs so they can share Gemini requests.
+    `cache_variant` overrides the cache key variant, which otherwise follows `smart_window`.
+    """
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=text_workers) as text_pool, \
+            ThreadPoolExecutor(max_workers=llm_workers) as llm_pool:
+        pending = {}
+        ready = []
+        for position, (file_name, source) in enumerate(documents):
+            result = _new_result(file_name)
+            result["document_id"] = str(position)
+            cache_key = None
+            if cache is not None:
+                variant = cache_variant if cache_variant is not None else "smart" if smart_window else ""
+                cache_key = make_cache_key(source, document_type, prompt_version, variant)
+                cached = cache.get(cache_key)
+                if cached and cached[1]:
+                    result["document_text"], result["extracted_data"] = cached
+                    yield _finish(result, started, "cached")
+                    continue
+            future = text_pool.submit(_timed_text, portable_source(source), file_name, document_type, max_chars,
+                                      smart_window)
+            pending[future] = ("text", result, cache_key)
+
+        while pending or ready:
+            done = set()
+            if pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, payload, cache_key = pending.pop(future)
+                try:
+                    value, seconds = future.result()
+                except Exception as e:
+                    group = payload if stage == "group" else [(payload, cache_key)]
+                    for result, result_cache_key in group:
+                        yield _finish(result, started, "failed", f"{stage}: {e}")
+                    continue
+                if stage == "text":
+                    result = payload
+                    document_text, local_fields = value
+                    result["text_seconds"] = round(seconds, 3)
+                    result["document_text"] = document_text
+                    if not document_text or not document_text.strip():
+                        yield _finish(result, started, "failed", "no text found")
+                        continue
+                    if local_fields:
+                        result["extracted_data"] = local_fields
+                        if cache is not None:
+                            cache.put(cache_key, document_text, local_fields)
+                        yield _finish(result, started, "local")
+                        continue
+                    if extract_fields_many is not None:
+                        ready.append((result, cache_key))
+                        continue
+                    llm_future = llm_pool.submit(_timed_fields, extract_fields, document_text, document_type)
+                    pending[llm_future] = ("llm", result, cache_key)
+                elif stage == "llm":
+                    yield _finish_llm(payload, started, cache, cache_key, value, seconds)
+                else:
+                    for result, result_cache_key in payload:
+                        data = value.get(result["document_id"])
+                        yield _finish_llm(result, started, cache, result_cache_key, data, seconds)
+
+            # Flush a full group, or whatever is ready once no more text is on its way
+            text_pending = any(stage == "text" for stage, _, _ in pending.values())
+            while ready and (len(ready) >= group_size or not text_pending):
+                group, ready = ready[:group_size], ready[group_size:]
+                pairs = [(result["document_id"], result["document_text"]) for result, _ in group]
+                group_future = llm_pool.submit(_timed_fields, extract_fields_many, pairs, document_type)
+                pending[group_future] = ("group", group, None)
+
+# -------------------- HEADLESS ENTRY POINT --------------------
+
+def iter_directory(directory):
+    for entry in sorted(os.listdir(directory)):
+        path = os.path.join(directory, entry)
+        if os.path.isfile(path) and entry.lower().endswith(SUPPORTED_EXTENSIONS):
+            yield entry, path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract form fields from a directory of documents.")
+    parser.add_argument("directory", help="Directory containing PDF and image documents")
+    parser.add_argument("--document-type", default="Other",
+                        help="Medical Record, Insurance Card, Previous Claim, Medical Bill or Other")
+    parser.add_argument("--text-workers", type=int, default=DEFAULT_TEXT_WORKERS)
+    parser.add_argument("--llm-workers", type=int, default=DEFAULT_LLM_WORKERS)
+    parser.add_argument("--smart-window", action="store_true",
+                        help="Send the pages densest in field keywords instead of the first pages")
+    parser.add_argument("--pack", action="store_true",
+                        help="Send several documents per Gemini request to amortize the prompt overhead")
+    parser.add_argument("--group-size", type=int, default=DEFAULT_GROUP_SIZE)
+    parser.add_argument("--offline", action="store_true", help="Use local extraction rules only, no Gemini calls")
+    parser.add_argument("--no-cache", action="store_true", help="Skip the on-disk extraction cache")
+    args = parser.parse_args(argv)
+
+    # Imported lazily: the core module imports this one
+    import docgen_core
+    from extraction_cache import ExtractionCache
+
+    def extract_fields(document_text, document_type):
+        return docgen_core.extract_fields(document_text, document_type, args.offline)
+
+    def extract_fields_many(documents, document_type):
+        return docgen_core.extract_fields_many(documents, document_type, args.offline)
+
+    cache = None if args.no_cache or args.offline else ExtractionCache()
+    started = time.perf_counter()
+    count = 0
+    for result in run_batch(iter_directory(args.directory), args.document_type, extract_fields,
+                            cache=cache, prompt_version=docgen_core.EXTRACTION_PROMPT_VERSION,
+                            max_chars=docgen_core.EXTRACTION_TEXT_LIMIT, smart_window=args.smart_window,
+                            extract_fields_many=extract_fields_many if args.pack else None,
+                            group_size=args.group_size,
+                            text_workers=args.text_workers, llm_workers=args.llm_workers):
+        count += 1
+        row = summary_row(result)
+        row["extracted_data"] = result["extracted_data"]
+        print(json.dumps(row, ensure_ascii=False), flush=True)
+    print(f"Processed {count} documents in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
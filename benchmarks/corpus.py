@@ -0,0 +1,197 @@
+"""Synthetic documents for benchmarks: text and scanned PDFs, insurance card images,
+claim records and model responses, all reproducible from a seed.
+
+Usage: python benchmarks/corpus.py OUTPUT_DIR [--documents 20] [--seed 0]
+"""
+import argparse
+import io
+import json
+import os
+import random
+from datetime import date, timedelta
+from PIL import Image, ImageDraw, ImageFont
+
+FIRST_NAMES = ["Aarav", "Priya", "Rohan", "Ananya", "Vikram", "Meera", "Arjun", "Kavya", "Sanjay", "Divya"]
+LAST_NAMES = ["Sharma", "Iyer", "Patel", "Reddy", "Gupta", "Nair", "Singh", "Menon", "Das", "Joshi"]
+INSURERS = ["Star Health", "HDFC ERGO", "ICICI Lombard", "Niva Bupa", "Care Health"]
+DIAGNOSES = ["Type 2 diabetes mellitus", "Acute appendicitis", "Fracture of left radius",
+             "Hypertension", "Community acquired pneumonia", "Cataract, right eye"]
+TREATMENTS = ["Laparoscopic appendectomy", "Open reduction and internal fixation",
+              "Phacoemulsification with IOL implant", "Inpatient IV antibiotics for 5 days",
+              "Outpatient consultation and HbA1c test"]
+FILLER = ("The patient was examined and the findings were recorded in the case sheet. Vitals were stable "
+          "throughout the stay and the patient was advised to continue medication and follow up in two weeks. ")
+
+# -------------------- RECORDS --------------------
+
+def patient_record(rng):
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    birth = date(1950, 1, 1) + timedelta(days=rng.randrange(365 * 55))
+    service = date(2024, 1, 1) + timedelta(days=rng.randrange(300))
+    return {
+        "patient_name": name,
+        "policy_number": f"{rng.choice(['SH', 'HE', 'IL', 'NB', 'CH'])}{rng.randrange(10 ** 9, 10 ** 10)}",
+        "date_of_birth": birth.isoformat(),
+        "phone": f"+91 9{rng.randrange(10 ** 8, 10 ** 9)}",
+        "email": name.lower().replace(" ", ".") + "@example.com",
+        "address": f"{rng.randrange(1, 400)} MG Road, Pune, Maharashtra 4110{rng.randrange(10, 99)}",
+        "diagnosis": rng.choice(DIAGNOSES),
+        "treatment": rng.choice(TREATMENTS),
+        "service_date": service.isoformat(),
+        "provider_name": f"{rng.choice(LAST_NAMES)} Multispeciality Hospital",
+        "claim_amount": str(rng.randrange(2000, 400000)),
+        "insurance_company": rng.choice(INSURERS),
+    }
+
+def document_lines(record, pages, rng):
+    """Lines of a discharge summary whose first page carries the record, padded with clinical filler."""
+    lines = [
+        "DISCHARGE SUMMARY",
+        f"Patient Name: {record['patient_name']}",
+        f"Policy No: {record['policy_number']}",
+        f"Date of Birth: {record['date_of_birth']}",
+        f"Phone: {record['phone']}",
+        f"Email: {record['email']}",
+        f"Address: {record['address']}",
+        f"Insurance Company: {record['insurance_company']}",
+        f"Diagnosis: {record['diagnosis']}",
+        f"Treatment: {record['treatment']}",
+        f"Date of Service: {record['service_date']}",
+        f"Hospital: {record['provider_name']}",
+        f"Total Amount: Rs. {record['claim_amount']}",
+    ]
+    page_lines = [lines]
+    for page in range(1, pages):
+        words = (FILLER * 6).split()
+        rng.shuffle(words)
+        page_lines.append([f"Progress notes, day {page}"] + [" ".join(words[i:i + 12]) for i in range(0, 72, 12)])
+    return page_lines
+
+def claim_record(rng, reason_sentences=3):
+    """(patient_data, claim_details) as the letter generator receives them."""
+    record = patient_record(rng)
+    patient_data = {
+        "name": record["patient_name"],
+        "policy_number": record["policy_number"],
+        "dob": record["date_of_birth"],
+        "contact": f"Phone: {record['phone']}\nEmail: {record['email']}\nAddress: {record['address']}",
+    }
+    claim_details = {
+        "service_date": record["service_date"],
+        "diagnosis": record["diagnosis"],
+        "treatment": record["treatment"],
+        "amount": f"₹{float(record['claim_amount']):,.2f}",
+        "reason": " ".join([FILLER.strip()] * reason_sentences),
+    }
+    return patient_data, claim_details
+
+# -------------------- PDFS --------------------
+
+def _pdf_string(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def text_pdf(page_lines):
+    """A minimal PDF with one Helvetica text stream per page, readable by PyPDF2 without OCR."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in page_lines:
+        content = "BT /F1 10 Tf 50 800 Td 14 TL " + " ".join(f"({_pdf_string(line)}) Tj T*" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents {len(objects)} 0 R "
+                       f"/Resources << /Font << /F1 3 0 R >> >> >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+def _render_lines(lines, size, font_size, origin, fill="white"):
+    image = Image.new("RGB", size, fill)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=font_size)
+    x, y = origin
+    for line in lines:
+        draw.text((x, y), line, fill="black", font=font)
+        y += int(font_size * 1.5)
+    return image
+
+def scanned_pdf(page_lines):
+    """Image-only pages at roughly 150 DPI, so text has to come from OCR."""
+    images = [_render_lines(lines, (1240, 1754), 22, (90, 120)) for lines in page_lines]
+    out = io.BytesIO()
+    images[0].save(out, "PDF", resolution=150, save_all=True, append_images=images[1:])
+    return out.getvalue()
+
+def card_image(record):
+    lines = [
+        record["insurance_company"].upper(),
+        "HEALTH INSURANCE CARD",
+        f"Name: {record['patient_name']}",
+        f"Member ID: {record['policy_number']}",
+        f"DOB: {record['date_of_birth']}",
+    ]
+    image = _render_lines(lines, (1012, 638), 34, (60, 70), fill=(235, 244, 250))
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=85)
+    return out.getvalue()
+
+# -------------------- MODEL RESPONSES --------------------
+
+def model_responses(record):
+    """The same extraction answer in the shapes models actually return, from clean to broken."""
+    clean = json.dumps(record)
+    return {
+        "clean": clean,
+        "fenced": f"Here is the extracted data:\n```json\n{json.dumps(record, indent=2)}\n```",
+        "single_quoted": str(record),
+        "trailing_comma": clean[:-1] + ",}",
+        "truncated": clean[:len(clean) * 2 // 3],
+        "lines": "\n".join(f"{key.replace('_', ' ').title()}: {value}" for key, value in record.items()),
+    }
+
+# -------------------- CORPUS --------------------
+
+PAGE_SIZES = {"small": 1, "medium": 10, "large": 60}
+
+def build_corpus(documents=20, seed=0, sizes=PAGE_SIZES, scanned_pages=3):
+    """Yields (kind, size, file_name, file_bytes, record) for text PDFs of each size, scanned PDFs and cards."""
+    rng = random.Random(seed)
+    for index in range(documents):
+        for size, pages in sizes.items():
+            record = patient_record(rng)
+            yield "text_pdf", size, f"text_{size}_{index:03d}.pdf", text_pdf(document_lines(record, pages, rng)), record
+        record = patient_record(rng)
+        yield "scanned_pdf", "small", f"scanned_{index:03d}.pdf", \
+            scanned_pdf(document_lines(record, scanned_pages, rng)), record
+        record = patient_record(rng)
+        yield "card", "small", f"card_{index:03d}.jpg", card_image(record), record
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic document corpus with ground-truth records.")
+    parser.add_argument("directory")
+    parser.add_argument("--documents", type=int, default=20, help="Documents of each kind and size")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.directory, exist_ok=True)
+    truth = {}
+    for kind, size, file_name, file_bytes, record in build_corpus(args.documents, args.seed):
+        with open(os.path.join(args.directory, file_name), "wb") as f:
+            f.write(file_bytes)
+        truth[file_name] = record
+    with open(os.path.join(args.directory, "ground_truth.json"), "w", encoding="utf-8") as f:
+        json.dump(truth, f, indent=2)
+    print(f"Wrote {len(truth)} documents to {args.directory}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Compares the tuned OCR path with the original full-resolution pytesseract call.
+
+Usage: python benchmarks/ocr_benchmark.py SAMPLE_DIR [--document-type "Insurance Card"]
+
+SAMPLE_DIR holds card or page images. An optional `<image stem>.txt` next to an image
+is used as ground truth for character accuracy.
+"""
+import argparse
+import difflib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytesseract
+from PIL import Image
+from ocr_engine import ocr_image, ocr_many
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+def load_samples(directory):
+    samples = []
+    for entry in sorted(os.listdir(directory)):
+        if not entry.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        path = os.path.join(directory, entry)
+        truth_path = os.path.splitext(path)[0] + ".txt"
+        truth = None
+        if os.path.exists(truth_path):
+            with open(truth_path, encoding="utf-8") as f:
+                truth = f.read()
+        with open(path, "rb") as f:
+            samples.append((entry, f.read(), truth))
+    return samples
+
+def character_accuracy(text, truth):
+    normalize = lambda value: " ".join(value.split()).lower()
+    return difflib.SequenceMatcher(None, normalize(text), normalize(truth)).ratio()
+
+def legacy_ocr(image_bytes, document_type):
+    return pytesseract.image_to_string(Image.open(io.BytesIO(image_bytes)))
+
+def tuned_ocr(image_bytes, document_type):
+    return ocr_image(io.BytesIO(image_bytes), document_type)
+
+def run_serial(name, ocr, samples, document_type):
+    started = time.perf_counter()
+    texts = [ocr(image_bytes, document_type) for _, image_bytes, _ in samples]
+    return report(name, texts, samples, time.perf_counter() - started)
+
+def run_pool(samples, document_type):
+    ocr_many([samples[0][1]], document_type)  # start the workers before timing
+    started = time.perf_counter()
+    texts = ocr_many([image_bytes for _, image_bytes, _ in samples], document_type)
+    return report("tuned (pool)", texts, samples, time.perf_counter() - started)
+
+def report(name, texts, samples, elapsed):
+    scores = [character_accuracy(text, truth) for text, (_, _, truth) in zip(texts, samples) if truth]
+    accuracy = sum(scores) / len(scores) if scores else None
+    return {
+        "path": name,
+        "images": len(samples),
+        "seconds": round(elapsed, 3),
+        "images_per_second": round(len(samples) / elapsed, 2) if elapsed else None,
+        "char_accuracy": round(accuracy, 4) if accuracy is not None else None,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark OCR throughput and character accuracy.")
+    parser.add_argument("directory")
+    parser.add_argument("--document-type", default="Insurance Card")
+    args = parser.parse_args(argv)
+
+    samples = load_samples(args.directory)
+    if not samples:
+        parser.error(f"no images found in {args.directory}")
+    results = [
+        run_serial("legacy", legacy_ocr, samples, args.document_type),
+        run_serial("tuned", tuned_ocr, samples, args.document_type),
+        run_pool(samples, args.document_type),
+    ]
+    print(f"{'path':<14}{'images':>8}{'seconds':>10}{'img/s':>8}{'accuracy':>10}")
+    for result in results:
+        accuracy = "n/a" if result["char_accuracy"] is None else f"{result['char_accuracy']:.3f}"
+        print(f"{result['path']:<14}{result['images']:>8}{result['seconds']:>10}"
+              f"{result['images_per_second']:>8}{accuracy:>10}")
+
+if __name__ == "__main__":
+    main()
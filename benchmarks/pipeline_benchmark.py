@@ -0,0 +1,302 @@
+"""Per-stage latency, throughput and memory growth for the document pipeline against the mock LLM backend.
+
+Usage: python benchmarks/pipeline_benchmark.py [--documents 10] [--llm-latency 0.2]
+                                               [--output results.json] [--compare baseline.json]
+
+Results are written as JSON (by default to benchmarks/results/) so runs from different
+commits can be compared with --compare. OCR stages are skipped when the tesseract binary
+is not installed.
+
+Memory is reported per stage as the peak resident set size reached during the stage minus
+the size at its start, for this process and for its worker processes. On Linux it is
+sampled from /proc while the stage runs; elsewhere only this process's high-water mark is
+available, so a stage shows growth only when it raises that mark.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# -------------------- MEASUREMENT --------------------
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+RSS_SAMPLE_SECONDS = 0.01
+PROC_RSS = os.path.exists("/proc/self/statm")
+
+def _statm_rss_mb(pid="self"):
+    with open(f"/proc/{pid}/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+def current_rss_mb():
+    """(own, children) resident set size in MB right now. Children are this process's direct
+    child processes, which covers the OCR and text extraction pools."""
+    if not PROC_RSS:
+        # ru_maxrss is in KiB on Linux and bytes on macOS; without /proc only the high-water mark is known
+        scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 0.0
+    children = 0.0
+    for task in os.listdir("/proc/self/task"):
+        try:
+            with open(f"/proc/self/task/{task}/children") as f:
+                pids = f.read().split()
+        except OSError:
+            continue
+        for pid in pids:
+            try:
+                children += _statm_rss_mb(pid)
+            except OSError:
+                pass  # exited between listing and reading
+    return _statm_rss_mb(), children
+
+class RssSampler:
+    """Samples resident set size in a background thread while a stage runs."""
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.start = self.peak = (0.0, 0.0)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        own, children = current_rss_mb()
+        self.peak = (max(self.peak[0], own), max(self.peak[1], children))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self.start = self.peak = current_rss_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def result(self):
+        return {
+            "rss_start_mb": round(self.start[0], 1),
+            "rss_growth_mb": round(self.peak[0] - self.start[0], 1),
+            "children_rss_start_mb": round(self.start[1], 1),
+            "children_rss_growth_mb": round(self.peak[1] - self.start[1], 1),
+        }
+
+def summarize(latencies, elapsed, items, memory):
+    latencies = sorted(latencies)
+    return dict({
+        "count": len(latencies),
+        "items": items,
+        "seconds": round(elapsed, 4),
+        "throughput_per_second": round(items / elapsed, 2) if elapsed else None,
+        "mean_ms": round(1000 * sum(latencies) / len(latencies), 3) if latencies else None,
+        "p50_ms": round(1000 * percentile(latencies, 0.50), 3) if latencies else None,
+        "p90_ms": round(1000 * percentile(latencies, 0.90), 3) if latencies else None,
+        "p99_ms": round(1000 * percentile(latencies, 0.99), 3) if latencies else None,
+        "max_ms": round(1000 * latencies[-1], 3) if latencies else None,
+    }, **memory.result())
+
+def measure(function, inputs, repeat=1):
+    """Calls function once per input, `repeat` times over, timing each call."""
+    latencies = []
+    with RssSampler() as memory:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for item in inputs:
+                call_started = time.perf_counter()
+                function(item)
+                latencies.append(time.perf_counter() - call_started)
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, elapsed, len(latencies), memory)
+
+def tesseract_available():
+    import pytesseract
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# -------------------- STAGES --------------------
+
+def run_stages(args):
+    # Imported after the environment is set so the core picks up the mock backend and temp caches
+    import docgen_core as core
+    from batch_intake import run_batch
+    from corpus import PAGE_SIZES, build_corpus, claim_record, model_responses
+    from json_repair import repair_json
+    from local_extractor import pre_extract_fields
+    from text_extraction import read_pdf_text
+
+    corpus = list(build_corpus(args.documents, args.seed))
+    by_kind = {}
+    for kind, size, file_name, file_bytes, record in corpus:
+        by_kind.setdefault((kind, size), []).append((file_name, file_bytes, record))
+
+    stages = {}
+    skipped = []
+
+    def stage(name, function, inputs, repeat=1):
+        print(f"  {name} ({len(inputs) * repeat} calls)", file=sys.stderr, flush=True)
+        stages[name] = measure(function, inputs, repeat)
+
+    for size in PAGE_SIZES:
+        documents = by_kind[("text_pdf", size)]
+        stage(f"pdf_text[{size}]", lambda doc: core.extract_text(doc[1], doc[0]), documents)
+    stage("pdf_text_full[large]", lambda doc: read_pdf_text(io.BytesIO(doc[1])), by_kind[("text_pdf", "large")])
+
+    if tesseract_available():
+        stage("scanned_pdf_text", lambda doc: core.extract_text(doc[1], doc[0]), by_kind[("scanned_pdf", "small")])
+        stage("image_text", lambda doc: core.extract_text(doc[1], doc[0], "Insurance Card"),
+              by_kind[("card", "small")])
+        stage("card_fields", lambda doc: core.read_card(doc[1]), by_kind[("card", "small")])
+    else:
+        skipped += ["scanned_pdf_text", "image_text", "card_fields"]
+
+    texts = [core.extract_text(file_bytes, file_name) for file_name, file_bytes, _ in by_kind[("text_pdf", "small")]]
+    stage("local_fields", pre_extract_fields, texts, repeat=args.repeat)
+
+    responses = [model_responses(record) for _, _, record in by_kind[("text_pdf", "small")]]
+    for variant in responses[0]:
+        stage(f"repair_json[{variant}]", repair_json, [response[variant] for response in responses], args.repeat)
+    for variant in responses[0]:
+        stage(f"parse_response[{variant}]", core.parse_extraction_response,
+              [response[variant] for response in responses], args.repeat)
+
+    stage("llm_fields", lambda text: core.extract_fields(text, "Medical Record"), texts)
+
+    rng = random.Random(args.seed)
+    claims = [claim_record(rng) for _ in range(args.documents)]
+    long_claims = [claim_record(rng, reason_sentences=40) for _ in range(args.documents)]
+    letter_type = core.LETTER_TYPES[0]
+    stage("letter[template]", lambda claim: core.generate_letter(letter_type, *claim, force=True), claims)
+    stage("letter[full]", lambda claim: core.generate_letter(letter_type, *claim, templated=False, force=True), claims)
+
+    letters = [(core.generate_letter(letter_type, *claim), claim[0]["name"]) for claim in claims]
+    long_letters = [(content + "\n\n" + claim[1]["reason"], claim[0]["name"])
+                    for (content, _), claim in zip(letters, long_claims)]
+    stage("render_docx[short]", lambda letter: core.render_docx(letter[0], letter_type, letter[1]), letters, args.repeat)
+    stage("render_docx[long]", lambda letter: core.render_docx(letter[0], letter_type, letter[1]), long_letters,
+          args.repeat)
+    bundle = [(content, letter_type, name) for content, name in letters]
+    stage("render_docx_bundle[zip]", core.render_docx_bundle, [bundle], args.repeat)
+    stage("render_docx_bundle[merged]", lambda bundle: core.render_docx_bundle(bundle, merged=True), [bundle],
+          args.repeat)
+
+    documents = [(file_name, file_bytes) for kind, size, file_name, file_bytes, _ in corpus if kind == "text_pdf"]
+    print(f"  batch_end_to_end ({len(documents)} documents)", file=sys.stderr, flush=True)
+    with RssSampler() as memory:
+        started = time.perf_counter()
+        results = list(run_batch(documents, "Medical Record",
+                                 lambda text, doc_type: core.extract_fields(text, doc_type),
+                                 max_chars=core.EXTRACTION_TEXT_LIMIT, llm_workers=args.llm_workers))
+        elapsed = time.perf_counter() - started
+    stages["batch_end_to_end"] = summarize([result["total_seconds"] for result in results], elapsed, len(results),
+                                           memory)
+    stages["batch_end_to_end"]["failed"] = sum(1 for result in results if result["status"] == "failed")
+    return stages, skipped
+
+# -------------------- REPORTING --------------------
+
+def print_table(stages):
+    print(f"{'stage':<32}{'n':>6}{'p50 ms':>11}{'p90 ms':>11}{'p99 ms':>11}{'per s':>10}{'+rss MB':>9}"
+          f"{'+workers MB':>13}")
+    for name, result in stages.items():
+        print(f"{name:<32}{result['count']:>6}{result['p50_ms']:>11}{result['p90_ms']:>11}{result['p99_ms']:>11}"
+              f"{result['throughput_per_second']:>10}{result['rss_growth_mb']:>9}{result['children_rss_growth_mb']:>13}")
+
+def print_comparison(baseline, current):
+    print(f"\nCompared with {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')}):")
+    print(f"{'stage':<32}{'p50 ms':>11}{'was':>11}{'change':>9}{'per s':>10}{'was':>10}")
+    for name, result in current["stages"].items():
+        before = baseline["stages"].get(name)
+        if not before or not before["p50_ms"]:
+            print(f"{name:<32}{result['p50_ms']:>11}{'-':>11}")
+            continue
+        change = (result["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100
+        print(f"{name:<32}{result['p50_ms']:>11}{before['p50_ms']:>11}{change:>+8.1f}%"
+              f"{result['throughput_per_second']:>10}{before['throughput_per_second']:>10}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the document pipeline.")
+    parser.add_argument("--documents", type=int, default=10, help="Synthetic documents of each kind and size")
+    parser.add_argument("--repeat", type=int, default=20, help="Repetitions for the fast, CPU-only stages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Mock backend latency in seconds")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-workers", type=int, default=4)
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/pipeline_<commit>_<time>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    args = parser.parse_args(argv)
+
+    cache_dir = tempfile.mkdtemp(prefix="docgen-bench-")
+    os.environ.update({
+        "LLM_BACKEND": "mock",
+        "MOCK_LLM_LATENCY_SECONDS": str(args.llm_latency),
+        "MOCK_LLM_JITTER_SECONDS": str(args.llm_latency / 10),
+        "MOCK_LLM_ERROR_RATE": str(args.llm_error_rate),
+        "MOCK_LLM_SEED": str(args.seed),
+        "EXTRACTION_CACHE_PATH": os.path.join(cache_dir, "extraction.sqlite3"),
+        "GENERATION_CACHE_PATH": os.path.join(cache_dir, "generation.sqlite3"),
+    })
+
+    started = datetime.now()
+    stages, skipped = run_stages(args)
+    commit = git_commit()
+    result = {
+        "meta": {
+            "commit": commit,
+            "timestamp": started.isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": vars(args),
+            "skipped": skipped,
+        },
+        "stages": stages,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"pipeline_{commit or 'unknown'}_{started.strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    print_table(stages)
+    if skipped:
+        print(f"\nSkipped (tesseract not installed): {', '.join(skipped)}")
+    print(f"\nResults written to {output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(json.load(f), result)
+
+if __name__ == "__main__":
+    main()
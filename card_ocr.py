@@ -0,0 +1,196 @@
+import json
+import os
+import re
+from local_extractor import SCHEMA_FIELDS, normalize_date
+from ocr_engine import OCR_LANGUAGES, get_profile, open_image, preprocess_image, tesseract_config
+from upload_spool import open_source
+
+# Local fast path for insurance cards: word boxes from Tesseract plus per-insurer
+# layout templates are enough to read the few fields a card carries without Gemini.
+
+# -------------------- CONFIGURATION --------------------
+
+CARD_CONFIDENCE_THRESHOLD = float(os.getenv("CARD_CONFIDENCE_THRESHOLD", 0.8))
+CARD_TEMPLATES_PATH = os.getenv("CARD_TEMPLATES_PATH")
+REQUIRED_CARD_FIELDS = ("patient_name", "policy_number", "date_of_birth", "insurance_company")
+
+FIELD_PATTERNS = {
+    "policy_number": r"[A-Z0-9][A-Z0-9/\-]{5,24}",
+    "patient_name": r"[A-Za-z][A-Za-z .']{2,60}",
+    "date_of_birth": r"\d{1,2}[/\-.]\d{1,2}[/\-.]\d{2,4}|\d{1,2} [A-Za-z]{3,9} \d{4}|\d{4}-\d{2}-\d{2}",
+}
+
+DEFAULT_LABELS = {
+    "policy_number": ["member id", "policy no", "policy number", "card no", "id no", "member no"],
+    "patient_name": ["name of insured", "insured name", "member name", "name"],
+    "date_of_birth": ["date of birth", "dob", "d.o.b", "birth date"],
+}
+
+# Region values are (left, top, right, bottom) as fractions of the card, used to
+# discard candidate lines that fall outside where the insurer prints a field.
+CARD_TEMPLATES = {
+    "generic": {
+        "insurer": None,
+        "keywords": [],
+        "fields": {},
+    },
+    "star_health": {
+        "insurer": "Star Health and Allied Insurance",
+        "keywords": ["star health"],
+        "fields": {"policy_number": {"labels": ["id card no", "member id"], "region": (0.0, 0.25, 1.0, 0.85)}},
+    },
+    "hdfc_ergo": {
+        "insurer": "HDFC ERGO General Insurance",
+        "keywords": ["hdfc ergo"],
+        "fields": {"policy_number": {"labels": ["policy no", "member id"]}},
+    },
+    "icici_lombard": {
+        "insurer": "ICICI Lombard General Insurance",
+        "keywords": ["icici lombard"],
+        # ICICI Lombard prints the member's health ID as UHID; on hospital documents a UHID is the
+        # hospital's own patient number, so it is not a default label
+        "fields": {"policy_number": {"labels": ["uhid", "policy no"]}},
+    },
+    "niva_bupa": {
+        "insurer": "Niva Bupa Health Insurance",
+        "keywords": ["niva bupa", "max bupa"],
+        "fields": {"policy_number": {"labels": ["member id", "policy no"]}},
+    },
+    "care_health": {
+        "insurer": "Care Health Insurance",
+        "keywords": ["care health", "religare"],
+        "fields": {"policy_number": {"labels": ["customer id", "policy no"]}},
+    },
+}
+
+def load_card_templates():
+    """Built-in templates, extended or overridden by the JSON file at CARD_TEMPLATES_PATH."""
+    templates = dict(CARD_TEMPLATES)
+    if CARD_TEMPLATES_PATH and os.path.exists(CARD_TEMPLATES_PATH):
+        with open(CARD_TEMPLATES_PATH, encoding="utf-8") as f:
+            templates.update(json.load(f))
+    return templates
+
+# -------------------- WORD BOXES --------------------
+
+def read_card_lines(image):
+    """OCRs a card and groups Tesseract's word boxes into lines with bounding boxes and confidence."""
+    import pytesseract
+
+    data = pytesseract.image_to_data(
+        image, lang=OCR_LANGUAGES, config=tesseract_config(get_profile("Insurance Card")),
+        output_type=pytesseract.Output.DICT
+    )
+    width, height = image.size
+    lines = {}
+    for index, word in enumerate(data["text"]):
+        confidence = float(data["conf"][index])
+        if not word.strip() or confidence < 0:
+            continue
+        key = (data["block_num"][index], data["par_num"][index], data["line_num"][index])
+        line = lines.setdefault(key, {"words": [], "confidences": [], "left": width, "top": height,
+                                      "right": 0, "bottom": 0})
+        line["words"].append(word)
+        line["confidences"].append(confidence)
+        line["left"] = min(line["left"], data["left"][index])
+        line["top"] = min(line["top"], data["top"][index])
+        line["right"] = max(line["right"], data["left"][index] + data["width"][index])
+        line["bottom"] = max(line["bottom"], data["top"][index] + data["height"][index])
+    result = []
+    for line in sorted(lines.values(), key=lambda line: (line["top"], line["left"])):
+        result.append({
+            "text": " ".join(line["words"]),
+            "confidence": sum(line["confidences"]) / len(line["confidences"]) / 100,
+            "box": (line["left"] / width, line["top"] / height, line["right"] / width, line["bottom"] / height),
+        })
+    return result
+
+# -------------------- FIELD HEURISTICS --------------------
+
+def _in_region(box, region):
+    if not region:
+        return True
+    center_x = (box[0] + box[2]) / 2
+    center_y = (box[1] + box[3]) / 2
+    return region[0] <= center_x <= region[2] and region[1] <= center_y <= region[3]
+
+def _line_below(lines, line):
+    """Closest line under `line` that overlaps it horizontally: labels are often printed above values."""
+    candidates = [
+        other for other in lines
+        if other["box"][1] >= line["box"][3] - 0.01
+        and other["box"][0] < line["box"][2] and other["box"][2] > line["box"][0]
+    ]
+    return min(candidates, key=lambda other: other["box"][1], default=None)
+
+def _find_field(lines, field, labels, region):
+    pattern = re.compile(FIELD_PATTERNS[field])
+    for line in lines:
+        if not _in_region(line["box"], region):
+            continue
+        lowered = line["text"].lower()
+        for label in labels:
+            # Labels start a word, so "id no" does not match inside "uhid no"
+            found = re.search(r"(?<![a-z0-9])" + re.escape(label), lowered)
+            if not found:
+                continue
+            remainder = line["text"][found.end():].lstrip(" :.-")
+            candidates = [(remainder, line)]
+            below = _line_below(lines, line)
+            if below is not None:
+                candidates.append((below["text"], below))
+            for candidate, source in candidates:
+                match = pattern.search(candidate)
+                if match:
+                    return match.group(0).strip(), source["confidence"]
+    return None, 0.0
+
+def detect_template(text, templates):
+    lowered = text.lower()
+    for name, template in templates.items():
+        if any(keyword in lowered for keyword in template["keywords"]):
+            return name, template
+    return "generic", templates["generic"]
+
+def extract_card_fields(lines, templates=None):
+    """Fills the extraction schema from card lines and returns (fields, confidences, template_name)."""
+    templates = templates or load_card_templates()
+    text = "\n".join(line["text"] for line in lines)
+    template_name, template = detect_template(text, templates)
+    fields = {field: "Not found" for field in SCHEMA_FIELDS}
+    confidences = {}
+    for field, default_labels in DEFAULT_LABELS.items():
+        override = template["fields"].get(field, {})
+        labels = override.get("labels", []) + default_labels
+        value, confidence = _find_field(lines, field, labels, override.get("region"))
+        if value and field == "date_of_birth":
+            value = normalize_date(value)
+            confidence = confidence if value else 0.0
+        if value:
+            fields[field] = value.upper() if field == "policy_number" else value.title()
+            confidences[field] = round(confidence, 3)
+    if template["insurer"]:
+        fields["insurance_company"] = template["insurer"]
+        confidences["insurance_company"] = 1.0
+    return fields, confidences, template_name
+
+def is_confident(confidences, threshold=CARD_CONFIDENCE_THRESHOLD):
+    return all(confidences.get(field, 0.0) >= threshold for field in REQUIRED_CARD_FIELDS)
+
+# -------------------- ENTRY POINT --------------------
+
+def read_insurance_card(image_source):
+    """OCRs a card image (bytes or a path) once and returns its text, schema fields, confidences and whether
+    Gemini can be skipped."""
+    profile = get_profile("Insurance Card")
+    with open_source(image_source) as image_file:
+        image = preprocess_image(open_image(image_file, profile), profile)
+    lines = read_card_lines(image)
+    fields, confidences, template_name = extract_card_fields(lines)
+    return {
+        "text": "\n".join(line["text"] for line in lines),
+        "fields": fields,
+        "confidences": confidences,
+        "template": template_name,
+        "confident": is_confident(confidences),
+    }
@@ -0,0 +1,99 @@
+import os
+import re
+from local_extractor import AMOUNT_PATTERN, normalize_date
+
+# Map-reduce extraction for long documents: the full text is split into token-budgeted
+# chunks on line boundaries, each chunk is extracted on its own, and the per-chunk
+# answers are reduced to one value per field by voting.
+
+# -------------------- CONFIGURATION --------------------
+
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", 4000))
+# Lines repeated at the start of the next chunk so a label and a value split across the boundary stay together
+CHUNK_OVERLAP_LINES = 2
+CHARS_PER_TOKEN = 4
+
+# -------------------- SPLITTING --------------------
+
+def split_into_chunks(text, max_tokens=CHUNK_MAX_TOKENS, overlap_lines=CHUNK_OVERLAP_LINES):
+    """Packs whole lines into chunks of roughly `max_tokens`; lines longer than a chunk are cut."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    lines = []
+    for line in text.splitlines():
+        lines.extend(line[start:start + max_chars] for start in range(0, len(line), max_chars))
+    chunks = []
+    current = []
+    size = 0
+    for line in lines:
+        if current and size + len(line) + 1 > max_chars:
+            chunks.append("\n".join(current))
+            current = current[-overlap_lines:] if overlap_lines else []
+            size = sum(len(kept) + 1 for kept in current)
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+# -------------------- MERGING --------------------
+
+def _amount(value):
+    try:
+        return float(re.sub(r"[^\d.]", "", value.replace(",", "")).strip("."))
+    except ValueError:
+        return None
+
+def _totals(chunk_text):
+    """Amounts printed on grand total / net payable / total lines of a chunk."""
+    return {_amount(match.group(1)) for match in AMOUNT_PATTERN.finditer(chunk_text)}
+
+def _vote_key(field, value):
+    """Spelling-insensitive form of a value, so "sh-123 456" and "SH123456" count as one answer."""
+    if field == "policy_number":
+        return re.sub(r"[\s\-/]", "", value).upper()
+    if field in ("date_of_birth", "service_date"):
+        return normalize_date(value) or value.strip().casefold()
+    if field == "claim_amount":
+        return _amount(value)
+    return " ".join(value.casefold().split())
+
+def merge_chunk_fields(chunk_results, fields):
+    """Reduces [(chunk_text, fields or None)] to one value per field.
+
+    The value most chunks agree on wins, the earliest chunk breaking ties. For claim_amount
+    a value printed on a totals line takes precedence, and later chunks win since totals
+    come last. Returns (fields, agreement), agreement being the share of answers behind
+    each chosen value.
+    """
+    merged = {}
+    agreement = {}
+    totals = [_totals(chunk_text) for chunk_text, _ in chunk_results] if "claim_amount" in fields else None
+    for field in fields:
+        votes = {}
+        for index, (_, data) in enumerate(chunk_results):
+            value = (data or {}).get(field)
+            if value is None or value == "Not found":
+                continue
+            # Repaired JSON and schema-less backends can answer with numbers; votes compare text
+            value = str(value).strip()
+            if not value:
+                continue
+            key = _vote_key(field, value)
+            if key is None:
+                continue
+            vote = votes.setdefault(key, {"value": value, "count": 0, "first": index, "last": index, "total": False})
+            vote["count"] += 1
+            vote["last"] = index
+            if field == "claim_amount" and key in totals[index]:
+                vote["total"] = True
+        if not votes:
+            merged[field] = "Not found"
+            agreement[field] = 0.0
+            continue
+        if field == "claim_amount":
+            best = max(votes.values(), key=lambda vote: (vote["total"], vote["last"], vote["count"]))
+        else:
+            best = max(votes.values(), key=lambda vote: (vote["count"], -vote["first"]))
+        merged[field] = best["value"]
+        agreement[field] = round(best["count"] / sum(vote["count"] for vote in votes.values()), 3)
+    return merged, agreement
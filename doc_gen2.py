@@ -1,13 +1,20 @@
 import streamlit as st
-import google.generativeai as genai
 import os
-from docx import Document
-import io
 from datetime import datetime
-import PyPDF2
-import pytesseract
-from PIL import Image
 import json
+import threading
+from contextlib import ExitStack
+from batch_intake import run_batch, summary_row
+from docgen_core import (
+    DOCUMENT_TYPES, EXTRACTION_PROMPT_VERSION, EXTRACTION_TEXT_LIMIT, LETTER_TYPES, DocGenError, docx_file_name,
+    extract_document, extract_fields, extract_fields_many, format_amount, generate_document_content,
+    generate_templated_content, get_duplicate_index, get_extraction_cache, get_gemini_client, get_generation_cache,
+    get_parse_metrics, get_record_store, remember_extraction, remember_letter, render_docx, stream_document_content
+)
+from job_queue import ACTIVE_STATUSES, JOB_WORKERS, ensure_workers, get_job_queue, job_summary
+from telemetry import METRICS_PORT, start_metrics_server, start_trace
+from upload_spool import UploadTooLarge, spool_upload
+from warmup import WARM_UP, warm_up
 
 # -------------------- CUSTOM CSS STYLING --------------------
 
@@ -150,240 +157,42 @@ st.set_page_config(
 # Apply custom CSS
 apply_custom_css()
 
-@st.cache_resource
-def init_gemini_client():
-    try:
-        api_key = st.secrets.get("GEMINI_API_KEY") or os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            st.error("Gemini API key not found. Please set it in Streamlit secrets or environment variables.")
-            st.stop()
-        genai.configure(api_key=api_key)
-        return genai.GenerativeModel('gemini-1.5-flash')  # Changed to more stable model
-    except Exception as e:
-        st.error(f"Error initializing Gemini client: {str(e)}")
-        return None
-
-# -------------------- DOCUMENT TEXT EXTRACTION --------------------
-
-def extract_text_from_pdf(pdf_file):
-    try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
-        return text
-    except Exception as e:
-        st.error(f"Error extracting text from PDF: {str(e)}")
-        return None
-
-def extract_text_from_image(image_file):
+def gemini_api_key():
+    """The key from Streamlit secrets, falling back to the environment."""
     try:
-        image = Image.open(image_file)
-        text = pytesseract.image_to_string(image)
-        return text
-    except Exception as e:
-        st.error(f"Error extracting text from image: {str(e)}")
-        return None
-
-# -------------------- AI INFORMATION EXTRACTION --------------------
-
-def clean_json_response(response_text):
-    """Removes markdown and extracts JSON object from Gemini response."""
-    response_text = response_text.strip()
-    # Remove markdown code block markers if present
-    if response_text.startswith("```json"):
-        response_text = response_text[7:]
-    if response_text.startswith("```"):
-        response_text = response_text[3:]
-    if response_text.endswith("```"):
-        response_text = response_text[:-3]
-    response_text = response_text.strip()
-    # Extract JSON object
-    start = response_text.find('{')
-    end = response_text.rfind('}') + 1
-    if start == -1 or end == 0:
-        return None
-    return response_text[start:end]
-
-def extract_information_from_document(document_text, document_type):
-    model = init_gemini_client()
-    if not model:
-        return None
-
-    prompt = f"""
-    Extract relevant information from the following {document_type} document text for administrative form filling.
-
-    Document Text:
-    {document_text[:2000]}
-
-    IMPORTANT: You must return ONLY valid JSON format. Do not include any explanatory text before or after the JSON.
-
-    Extract and return this exact JSON structure:
-    {{
-        "patient_name": "Full name of the patient or Not found",
-        "policy_number": "Insurance policy or member ID or Not found",
-        "date_of_birth": "Date of birth in YYYY-MM-DD format or Not found",
-        "phone": "Phone number or Not found",
-        "email": "Email address or Not found", 
-        "address": "Full address or Not found",
-        "diagnosis": "Medical diagnosis or condition or Not found",
-        "treatment": "Treatment or procedure details or Not found",
-        "service_date": "Date of service in YYYY-MM-DD format or Not found",
-        "provider_name": "Healthcare provider name or Not found",
-        "claim_amount": "Claim amount numbers only or Not found",
-        "insurance_company": "Insurance company name or Not found"
-    }}
-
-    Return only the JSON object, nothing else.
-    """
+        api_key = st.secrets.get("GEMINI_API_KEY")
+    except FileNotFoundError:
+        # No secrets.toml; the key comes from the environment instead
+        api_key = None
+    return api_key or os.getenv("GEMINI_API_KEY")
 
+def init_gemini_client():
+    """Configures the shared core client, preferring the key from Streamlit secrets."""
     try:
-        # Updated safety settings to be more permissive for administrative content
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_ONLY_HIGH"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_ONLY_HIGH"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_ONLY_HIGH"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_ONLY_HIGH"
-            }
-        ]
-        
-        generation_config = genai.types.GenerationConfig(
-            temperature=0.1,
-            max_output_tokens=800,
-            top_p=0.8,
-            top_k=40
-        )
-        
-        response = model.generate_content(
-            prompt,
-            generation_config=generation_config,
-            safety_settings=safety_settings
-        )
-        
-        # Better error handling for blocked responses
-        if not response.candidates:
-            st.error("Response was blocked by safety filters. Please try with different content.")
-            return None
-            
-        if response.candidates[0].finish_reason == 2:  # SAFETY
-            st.error("Content was filtered for safety. Please try with different document content.")
-            return None
-            
-        if not response.text:
-            st.error("Empty response from Gemini API")
-            return None
-
-        response_text = clean_json_response(response.text)
-        if not response_text:
-            st.error("No valid JSON found in response")
-            return None
-        extracted_data = json.loads(response_text)
-        return extracted_data
-
-    except json.JSONDecodeError as e:
-        st.error(f"JSON parsing error: {str(e)}")
-        return None
+        return get_gemini_client(gemini_api_key())
+    except DocGenError as e:
+        st.error(str(e))
+        st.stop()
     except Exception as e:
-        st.error(f"Error extracting information: {str(e)}")
-        return None
-
-def extract_information_simple(document_text, document_type):
-    model = init_gemini_client()
-    if not model:
+        st.error(f"Error initializing Gemini client: {str(e)}")
         return None
 
-    prompt = f"""
-    Extract basic information from this {document_type} document and provide simple answers:
+@st.cache_resource(show_spinner=False)
+def start_warm_up():
+    """Warms OCR, PDF, .docx and Gemini resources once per server process, off the script thread."""
+    thread = threading.Thread(target=warm_up, args=(gemini_api_key(),), daemon=True, name="docgen-warm-up")
+    thread.start()
+    return thread
 
-    Document Text:
-    {document_text[:1500]}
+@st.cache_resource
+def get_metrics_server():
+    """Prometheus /metrics on METRICS_PORT, started once per process when the port is set."""
+    return start_metrics_server(METRICS_PORT) if METRICS_PORT else None
 
-    Please answer these questions based on the document:
-    1. Patient name:
-    2. Policy number:
-    3. Date of birth:
-    4. Phone number:
-    5. Email:
-    6. Address:
-    7. Diagnosis:
-    8. Treatment:
-    9. Service date:
-    10. Claim amount:
+# -------------------- BATCH INTAKE --------------------
 
-    Answer "Not found" if information is not available.
-    """
-
-    try:
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_ONLY_HIGH"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_ONLY_HIGH"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_ONLY_HIGH"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_ONLY_HIGH"
-            }
-        ]
-        
-        response = model.generate_content(prompt, safety_settings=safety_settings)
-        
-        if not response.candidates or response.candidates[0].finish_reason == 2:
-            st.error("Content was filtered for safety. Please try with different document content.")
-            return None
-            
-        if response and response.text:
-            lines = response.text.strip().split('\n')
-            extracted_data = {}
-            for line in lines:
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    key = key.strip().lower().replace(' ', '_')
-                    value = value.strip()
-                    if 'name' in key:
-                        extracted_data['patient_name'] = value
-                    elif 'policy' in key:
-                        extracted_data['policy_number'] = value
-                    elif 'birth' in key:
-                        extracted_data['date_of_birth'] = value
-                    elif 'phone' in key:
-                        extracted_data['phone'] = value
-                    elif 'email' in key:
-                        extracted_data['email'] = value
-                    elif 'address' in key:
-                        extracted_data['address'] = value
-                    elif 'diagnosis' in key:
-                        extracted_data['diagnosis'] = value
-                    elif 'treatment' in key:
-                        extracted_data['treatment'] = value
-                    elif 'service' in key:
-                        extracted_data['service_date'] = value
-                    elif 'amount' in key:
-                        extracted_data['claim_amount'] = value
-            return extracted_data
-    except Exception as e:
-        st.error(f"Error in simple extraction: {str(e)}")
-        return None
+JOBS_SHOWN = 20
+JOB_REFRESH_SECONDS = 2
 
 def auto_fill_form(extracted_data):
     if not extracted_data:
@@ -391,121 +200,193 @@ def auto_fill_form(extracted_data):
     st.session_state.extracted_data = extracted_data
     st.success("✅ Document processed! Form fields will be auto-filled below.")
 
-# -------------------- DOCUMENT GENERATION --------------------
+def process_batch(uploaded_files, document_type, llm_workers, smart_window=False, offline=False, pack=True):
+    # Initialize the client on the script thread before fanning out to workers
+    if not offline and not init_gemini_client():
+        return
 
-def generate_document_content(document_type, patient_data, claim_details):
-    model = init_gemini_client()
-    if not model:
-        return None
+    def extract_one(document_text, doc_type):
+        return extract_fields(document_text, doc_type, offline)
 
-    # More neutral prompt to avoid safety filters
-    prompt = f"""
-    Generate a professional administrative {document_type} document based on the following information:
-
-    Patient Information:
-    - Name: {patient_data.get('name', '')}
-    - Policy Number: {patient_data.get('policy_number', '')}
-    - Date of Birth: {patient_data.get('dob', '')}
-    - Contact Information: {patient_data.get('contact', '')}
-
-    Administrative Details:
-    - Service Date: {claim_details.get('service_date', '')}
-    - Condition: {claim_details.get('diagnosis', '')}
-    - Service Description: {claim_details.get('treatment', '')}
-    - Amount: {claim_details.get('amount', '')}
-    - Justification: {claim_details.get('reason', '')}
-
-    Please generate a formal, professional business document that includes:
-    1. Proper business letter formatting with recipient address placeholder
-    2. Clear statement of the request or claim
-    3. Supporting information and justification
-    4. Specific requested action
-    5. Professional closing with signature line
-
-    Make it professional and factual, following standard business letter format.
-    The tone should be professional and respectful.
-    Use Indian Rupees (₹) for all monetary amounts.
-    Format should be suitable for Indian administrative system.
-    
-    Focus on administrative and procedural aspects rather than detailed medical information.
-    """
+    def extract_many(documents, doc_type):
+        return extract_fields_many(documents, doc_type, offline)
 
-    try:
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_ONLY_HIGH"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_ONLY_HIGH"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_ONLY_HIGH"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_ONLY_HIGH"
-            }
-        ]
-        
-        generation_config = genai.types.GenerationConfig(
-            temperature=0.3,
-            max_output_tokens=1500,
-            top_p=0.8,
-            top_k=40
+    with ExitStack() as uploads:
+        # Big files are spilled to temp files so text workers get a path instead of a pickled copy
+        documents = []
+        for uploaded_file in uploaded_files:
+            uploaded_file.seek(0)
+            try:
+                upload = uploads.enter_context(spool_upload(uploaded_file, uploaded_file.name))
+            except UploadTooLarge as e:
+                st.error(str(e))
+                return
+            documents.append((uploaded_file.name, upload))
+        st.session_state.batch_results = []
+        progress = st.progress(0.0, text=f"0/{len(documents)} documents processed")
+        table = st.empty()
+        rows = []
+        for result in run_batch(documents, document_type, extract_one,
+                                cache=None if offline else get_extraction_cache(),
+                                prompt_version=EXTRACTION_PROMPT_VERSION,
+                                max_chars=EXTRACTION_TEXT_LIMIT, smart_window=smart_window,
+                                extract_fields_many=extract_many if pack else None,
+                                llm_workers=llm_workers):
+            st.session_state.batch_results.append(result)
+            remember_extraction(result["extracted_data"], result["file"])
+            rows.append(summary_row(result))
+            table.dataframe(rows, use_container_width=True)
+            progress.progress(len(rows) / len(documents), text=f"{len(rows)}/{len(documents)} documents processed")
+    table.empty()
+    progress.empty()
+
+def submit_batch_jobs(uploaded_files, document_type, smart_window=False, offline=False, letter_type=None,
+                      reason=""):
+    """Queues the batch for the background workers instead of processing it in this session."""
+    queue = get_job_queue()
+    params = {"document_type": document_type, "offline": offline, "smart_window": smart_window}
+    if letter_type:
+        params.update(letter_type=letter_type, reason=reason)
+    for uploaded_file in uploaded_files:
+        queue.submit("letter" if letter_type else "extract", uploaded_file, uploaded_file.name, params)
+    ensure_workers(JOB_WORKERS, gemini_api_key())
+    st.success(f"✅ Queued {len(uploaded_files)} documents; they keep processing if this page is closed or refreshed")
+
+def display_job_table(jobs):
+    st.subheader("🗂️ Background Jobs")
+    st.dataframe([job_summary(job) for job in jobs], use_container_width=True)
+
+@st.fragment(run_every=JOB_REFRESH_SECONDS)
+def poll_jobs():
+    """Refreshes only the jobs table while jobs are unfinished."""
+    jobs = get_job_queue().recent(JOBS_SHOWN)
+    if not any(job["status"] in ACTIVE_STATUSES for job in jobs):
+        # One full run shows the finished jobs with their actions and stops the polling
+        st.rerun()
+    display_job_table(jobs)
+
+def display_jobs():
+    jobs = get_job_queue().recent(JOBS_SHOWN)
+    if not jobs:
+        return
+    if any(job["status"] in ACTIVE_STATUSES for job in jobs):
+        # Also resumes jobs left unfinished when the app last stopped
+        ensure_workers(JOB_WORKERS, gemini_api_key())
+        poll_jobs()
+        st.markdown("---")
+        return
+    display_job_table(jobs)
+    completed = [job for job in jobs if job["status"] == "done"]
+    if completed:
+        labels = {f"#{job['id']} {job['file_name']}": job for job in completed}
+        job = labels[st.selectbox("Finished job", list(labels))]
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("📋 Use for Auto-Fill", key="job_autofill"):
+                auto_fill_form(job["results"]["extract"]["fields"])
+                st.rerun()
+        with col2:
+            rendered = job["results"].get("render")
+            if rendered and os.path.exists(rendered["path"]):
+                with open(rendered["path"], "rb") as f:
+                    st.download_button(
+                        label="📥 Download Letter",
+                        data=f.read(),
+                        file_name=docx_file_name(job["params"]["letter_type"],
+                                                 job["results"]["generate"]["patient_name"]),
+                        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                        on_click="ignore"
+                    )
+    st.markdown("---")
+
+def display_batch_results(results):
+    st.subheader("📦 Batch Results")
+    rows = [summary_row(result) for result in results]
+    st.dataframe(rows, use_container_width=True)
+    completed = [result for result in results if result["extracted_data"]]
+    col1, col2 = st.columns(2)
+    with col1:
+        if completed:
+            selected = st.selectbox("Auto-fill form from", [result["file"] for result in completed])
+            if st.button("📋 Use for Auto-Fill"):
+                auto_fill_form(next(r for r in completed if r["file"] == selected)["extracted_data"])
+                st.rerun()
+    with col2:
+        export = [dict(summary_row(result), **(result["extracted_data"] or {})) for result in results]
+        st.download_button(
+            label="📥 Download Results (JSON)",
+            data=json.dumps(export, ensure_ascii=False, indent=2),
+            file_name=f"batch_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+            mime="application/json"
         )
-        
-        response = model.generate_content(
-            prompt,
-            generation_config=generation_config,
-            safety_settings=safety_settings
+    st.markdown("---")
+
+def display_extraction(extraction):
+    if extraction["source"] == "cache":
+        st.caption("⚡ Loaded from extraction cache")
+    elif extraction["source"] == "card":
+        st.caption("⚡ Card fields read locally, Gemini call skipped")
+    elif extraction["source"] == "near_duplicate":
+        duplicate = extraction["duplicate_of"]
+        st.info(
+            f"This looks like a rescan of {duplicate['file_name'] or 'an earlier document'} "
+            f"({duplicate['similarity']:.0%} similar), so its fields were reused."
         )
-        
-        # Handle safety filtering
-        if not response.candidates:
-            return "Unable to generate content due to safety filters. Please try with different input."
-            
-        if response.candidates[0].finish_reason == 2:  # SAFETY
-            return "Content generation was blocked by safety filters. Please modify your input and try again."
-            
-        if not response.text:
-            return "Unable to generate content. Please try again with different parameters."
-            
-        return response.text
-        
-    except Exception as e:
-        st.error(f"Error generating content: {str(e)}")
-        return f"Error generating content. Please try again. Technical details: {str(e)}"
-
-def create_word_document(content, doc_type, patient_name):
-    doc = Document()
-    # Add header
-    sections = doc.sections
-    header = sections[0].header
-    header_para = header.paragraphs[0]
-    header_para.text = f"{doc_type} - {patient_name}"
-    # Add title
-    title = doc.add_heading(doc_type, 0)
-    title.alignment = 1  # Center alignment
-    # Add date
-    date_para = doc.add_paragraph(f"Date: {datetime.now().strftime('%B %d, %Y')}")
-    date_para.alignment = 2  # Right alignment
-    # Add content
-    doc.add_paragraph(content)
-    # Add footer
-    footer = sections[0].footer
-    footer_para = footer.paragraphs[0]
-    footer_para.text = "Generated by AI Healthcare Document Generator"
-    # Save to bytes
-    doc_io = io.BytesIO()
-    doc.save(doc_io)
-    doc_io.seek(0)
-    return doc_io.getvalue()
+        st.button("🔁 Extract anyway", on_click=st.session_state.update, kwargs={"force_extraction": True})
+    extracted_info = extraction["fields"]
+    if not extracted_info:
+        st.error("Could not extract information from the document")
+        return
+    st.subheader("📋 Extracted Information")
+    for key, value in extracted_info.items():
+        if value and value != "Not found":
+            st.write(f"**{key.replace('_', ' ').title()}:** {value}")
+
+# -------------------- DOCUMENT GENERATION --------------------
+
+def show_stream(chunks):
+    """Passes streamed text through, showing a failure as an error instead of raising mid-page."""
+    try:
+        yield from chunks
+    except DocGenError as e:
+        st.error(str(e))
+
+@st.cache_data(max_entries=32, ttl=3600, show_spinner=False)
+def docx_bytes(content, doc_type, name):
+    """Rendered once per distinct letter text, so reruns and repeated downloads reuse the bytes."""
+    return render_docx(content, doc_type, name)
+
+def store_generated_document(content, doc_type, name, notes):
+    """Keeps the letter across reruns; the editable text area is seeded with it."""
+    st.session_state.generated_document = {"doc_type": doc_type, "name": name, "notes": notes}
+    st.session_state.generated_content = content
+
+@st.fragment
+def display_generated_document():
+    """Editing the letter text or downloading it reruns only this panel, not the whole page."""
+    document = st.session_state.generated_document
+    st.subheader("📄 Generated Document")
+    for note in document["notes"]:
+        st.caption(note)
+    content = st.text_area("Document Content", height=400, key="generated_content")
+    st.download_button(
+        label="📥 Download as Word Document",
+        data=docx_bytes(content, document["doc_type"], document["name"]),
+        file_name=docx_file_name(document["doc_type"], document["name"]),
+        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        on_click="ignore"
+    )
+    st.subheader("✏️ Edit and Regenerate")
+    if st.button("🔄 Generate New Version"):
+        # Regenerate on the next run with the same form values, bypassing the generation cache
+        st.session_state.regenerate_requested = True
+        st.rerun()
 
 def generate_and_display_document(doc_type, name, policy, dob, contact, 
-                                service_date, diagnosis, treatment, amount, reason):
+                                service_date, diagnosis, treatment, amount, reason, stream=True, templated=True,
+                                force=False):
+    if not init_gemini_client():
+        return
     patient_data = {
         'name': name,
         'policy_number': policy,
@@ -516,25 +397,135 @@ def generate_and_display_document(doc_type, name, policy, dob, contact,
         'service_date': str(service_date),
         'diagnosis': diagnosis,
         'treatment': treatment,
-        'amount': f"₹{amount:,.2f}" if amount > 0 else "Not specified",
+        'amount': format_amount(amount),
         'reason': reason
     }
-    with st.spinner("🤖 Generating document with Gemini AI..."):
-        content = generate_document_content(doc_type, patient_data, claim_details)
-        if content:
-            st.success("✅ Document generated successfully!")
+    metrics = {}
+    content = None
+    if templated:
+        with st.spinner("🤖 Writing letter sections with Gemini AI..."):
+            try:
+                content = generate_templated_content(doc_type, patient_data, claim_details, force, metrics)
+            except DocGenError as e:
+                st.warning(f"{str(e)}; writing the full letter instead")
+
+    if not content and stream:
+        document_area = st.empty()
+        with document_area.container():
             st.subheader("📄 Generated Document")
-            st.text_area("Document Content", content, height=400, key="generated_content")
-            doc_file = create_word_document(content, doc_type, name)
-            st.download_button(
-                label="📥 Download as Word Document",
-                data=doc_file,
-                file_name=f"{doc_type.replace(' ', '_')}_{name.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.docx",
-                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-            )
-            st.subheader("✏️ Edit and Regenerate")
-            if st.button("🔄 Generate New Version"):
-                st.rerun()
+            content = st.write_stream(show_stream(
+                stream_document_content(doc_type, patient_data, claim_details, metrics, force)
+            ))
+        if content:
+            # The stored letter is shown below in an editable text area instead of the streamed preview
+            document_area.empty()
+    elif not content:
+        with st.spinner("🤖 Generating document with Gemini AI..."):
+            try:
+                content = generate_document_content(doc_type, patient_data, claim_details, force, metrics)
+            except DocGenError as e:
+                st.error(str(e))
+    if not content:
+        return
+
+    notes = []
+    if metrics.get("cached"):
+        notes.append("⚡ Loaded from generation cache")
+    elif "first_token_seconds" in metrics:
+        notes.append(
+            f"⏱️ First text after {metrics['first_token_seconds']:.2f}s, "
+            f"complete after {metrics['total_seconds']:.2f}s"
+        )
+    st.success("✅ Document generated successfully!")
+    store_generated_document(content, doc_type, name, notes)
+    remember_letter({
+        "patient_name": name, "policy_number": policy, "date_of_birth": str(dob),
+        "service_date": str(service_date), "diagnosis": diagnosis, "treatment": treatment,
+    }, doc_type, content)
+
+# -------------------- PATIENT RECORDS --------------------
+
+def display_patient_lookup():
+    """Fills the form from a stored patient instead of a new upload."""
+    query = st.text_input(
+        "Find a returning patient",
+        key="patient_query",
+        placeholder="Name, policy number or date of birth"
+    )
+    if len(query.strip()) < 2:
+        return
+    store = get_record_store()
+    matches = store.search(query)
+    if not matches:
+        st.caption("No stored patient matches")
+        return
+    labels = {
+        f"{match['patient_name'] or 'Unnamed'} · {match['policy_number'] or 'no policy'} · "
+        f"{match['date_of_birth'] or 'birth date unknown'}": match["id"]
+        for match in matches
+    }
+    record = store.get(labels[st.selectbox("Matching patients", list(labels), key="patient_match")])
+    if record is None:
+        return
+    if st.button("📋 Fill Form", key="patient_fill"):
+        st.session_state.extracted_data = record["fields"]
+        st.rerun()
+    if record["letters"]:
+        letter = record["letters"][0]
+        written = datetime.fromtimestamp(letter["created_at"]).strftime("%d %b %Y")
+        if st.button(f"📄 Open {letter['letter_type']} of {written}", key="patient_letter"):
+            store_generated_document(letter["content"], letter["letter_type"], record["fields"].get("patient_name", ""),
+                                     [f"🗄️ Stored letter from {written}"])
+            st.rerun()
+
+def display_record_admin():
+    store = get_record_store()
+    stats = store.stats()
+    with st.expander(f"🗄️ Patient records ({stats['patients']})"):
+        st.caption(f"{stats['letters']} letters stored; records unused for {stats['retention_days']} days are removed")
+        st.download_button(
+            label="📥 Export Records",
+            data=lambda: "".join(store.export_lines()),
+            file_name=f"patient_records_{datetime.now().strftime('%Y%m%d')}.jsonl",
+            mime="application/jsonl",
+            on_click="ignore"
+        )
+        records_file = st.file_uploader("Import records", type=["jsonl"], key="records_import")
+        if records_file is not None and st.button("📤 Import", key="records_import_btn"):
+            try:
+                count = store.import_lines(records_file)
+            except (ValueError, KeyError) as e:
+                st.error(f"Could not import {records_file.name}: {str(e)}")
+            else:
+                st.success(f"✅ Imported {count} patient records")
+
+def display_trace(trace):
+    """Timing waterfall for the spans of the last extraction, batch or generation."""
+    total_ms = 1000 * (trace.duration or 0)
+    with st.expander(f"⏱️ Last {trace.name}: {total_ms:.0f} ms", expanded=True):
+        spans = sorted(trace.spans, key=lambda span: (span["start_ms"], span["depth"]))
+        rows = [
+            {
+                "span": f"{index + 1:02d} {'· ' * span['depth']}{span['span']}",
+                "start_ms": span["start_ms"],
+                "end_ms": span["start_ms"] + span["duration_ms"],
+                "duration_ms": span["duration_ms"],
+                "status": span["error"] or "ok",
+            }
+            for index, span in enumerate(spans)
+        ]
+        st.vega_lite_chart(rows, {
+            "mark": "bar",
+            "encoding": {
+                "y": {"field": "span", "type": "nominal", "sort": None, "title": None},
+                "x": {"field": "start_ms", "type": "quantitative", "title": "ms"},
+                "x2": {"field": "end_ms"},
+                "color": {"field": "status", "type": "nominal", "legend": None},
+                "tooltip": [{"field": "span"}, {"field": "duration_ms"}, {"field": "status"}],
+            },
+        }, use_container_width=True)
+        if trace.tokens:
+            st.caption("Gemini tokens: " + ", ".join(f"{stage} {count}" for stage, count in trace.tokens.items()))
 
 # -------------------- MAIN APP --------------------
 
@@ -545,52 +536,113 @@ def main():
 
     if 'extracted_data' not in st.session_state:
         st.session_state.extracted_data = {}
+    if 'batch_results' not in st.session_state:
+        st.session_state.batch_results = []
+
+    batch_clicked = False
+    get_metrics_server()
+    if WARM_UP:
+        start_warm_up()
 
     # Sidebar for settings and document upload
     with st.sidebar:
         st.markdown('<h2 style="color: #e6edf3;">📁 Document Upload & Auto-Fill</h2>', unsafe_allow_html=True)
-        uploaded_file = st.file_uploader(
-            "Upload Document for Auto-Fill",
-            type=['pdf', 'png', 'jpg', 'jpeg'],
-            help="Upload medical records, insurance cards, or other relevant documents"
+        display_patient_lookup()
+        upload_mode = st.radio("Upload Mode", ["Single Document", "Batch"], horizontal=True)
+        offline_mode = st.toggle(
+            "Offline extraction",
+            help="Fill fields with local rules only, without calling Gemini"
         )
-        if uploaded_file is not None:
-            document_type = st.selectbox(
-                "Document Type",
-                ["Medical Record", "Insurance Card", "Previous Claim", "Medical Bill", "Other"]
+        uploaded_file = None
+        if upload_mode == "Single Document":
+            uploaded_file = st.file_uploader(
+                "Upload Document for Auto-Fill",
+                type=['pdf', 'png', 'jpg', 'jpeg'],
+                help="Upload medical records, insurance cards, or other relevant documents"
+            )
+        else:
+            batch_files = st.file_uploader(
+                "Upload Claim Packet",
+                type=['pdf', 'png', 'jpg', 'jpeg'],
+                accept_multiple_files=True,
+                help="Upload many documents at once; they are processed concurrently"
             )
-            if st.button("🔍 Extract Information", type="primary"):
-                with st.spinner("Processing document..."):
-                    if uploaded_file.type == "application/pdf":
-                        document_text = extract_text_from_pdf(uploaded_file)
-                    else:
-                        document_text = extract_text_from_image(uploaded_file)
-                    if document_text:
-                        extracted_info = extract_information_from_document(document_text, document_type)
-                        if not extracted_info:
-                            st.warning("JSON extraction failed, trying simple extraction...")
-                            extracted_info = extract_information_simple(document_text, document_type)
-                        if extracted_info:
-                            auto_fill_form(extracted_info)
-                            st.subheader("📋 Extracted Information")
-                            for key, value in extracted_info.items():
-                                if value and value != "Not found":
-                                    st.write(f"**{key.replace('_', ' ').title()}:** {value}")
-                        else:
-                            st.error("Could not extract information from the document")
+            batch_document_type = st.selectbox("Document Type", DOCUMENT_TYPES, key="batch_document_type")
+            batch_llm_workers = st.slider("Concurrent Gemini Requests", 1, 16, 4)
+            batch_smart_window = st.checkbox(
+                "Smart page selection",
+                key="batch_smart_window",
+                help="For PDFs, send the pages most likely to contain the requested fields"
+            )
+            batch_pack = st.checkbox(
+                "Pack documents into shared requests",
+                value=True,
+                key="batch_pack",
+                help="Extract several documents per Gemini request to save prompt tokens and quota"
+            )
+            batch_background = st.checkbox(
+                "Run in background",
+                key="batch_background",
+                help="Queue the documents for background workers; the work survives a refresh and frees this page"
+            )
+            batch_letters = False
+            batch_reason = ""
+            if batch_background:
+                batch_letters = st.checkbox(
+                    "Write letters too",
+                    key="batch_letters",
+                    help="Write a letter of the type chosen in Document Settings for every document"
+                )
+                if batch_letters:
+                    batch_reason = st.text_input("Reason for the letters", key="batch_reason")
+            batch_clicked = st.button("🚀 Process Batch", type="primary", disabled=not batch_files)
+        if uploaded_file is not None:
+            document_type = st.selectbox("Document Type", DOCUMENT_TYPES)
+            smart_window = False
+            chunked = False
+            if uploaded_file.type == "application/pdf":
+                chunked = st.checkbox(
+                    "Read the whole document",
+                    help="Extract every page in parallel chunks and merge the answers; best for long bills whose totals are on the last page"
+                )
+                smart_window = st.checkbox(
+                    "Smart page selection",
+                    disabled=chunked,
+                    help="Send the pages most likely to contain policy, diagnosis and billing details instead of just the first pages"
+                )
+            force_extraction = st.session_state.pop("force_extraction", False)
+            if st.button("🔍 Extract Information", type="primary") or force_extraction:
+                with st.spinner("Processing document..."), start_trace("extraction") as trace:
+                    st.session_state.last_trace = trace
+                    try:
+                        if not offline_mode:
+                            init_gemini_client()
+                        extraction = extract_document(uploaded_file, uploaded_file.name, document_type,
+                                                      offline_mode, smart_window, chunked,
+                                                      reuse_duplicates=not force_extraction)
+                    except (DocGenError, UploadTooLarge) as e:
+                        st.error(str(e))
+                        extraction = None
+                    if extraction:
+                        st.session_state.extraction = dict(extraction, file_id=uploaded_file.file_id)
+                        auto_fill_form(extraction["fields"])
+            # Shown on every rerun until another file is uploaded, not just right after the click
+            extraction = st.session_state.get("extraction")
+            if extraction and extraction["file_id"] == uploaded_file.file_id:
+                display_extraction(extraction)
         
         st.markdown("---")
         st.markdown('<h2 style="color: #e6edf3;">⚙️ Document Settings</h2>', unsafe_allow_html=True)
-        document_type = st.selectbox(
-            "Select Document Type",
-            [
-                "Insurance Claim Letter", 
-                "Appeal Letter", 
-                "Prior Authorization Request", 
-                "Reimbursement Claim",
-                "Medical Necessity Letter",
-                "Coverage Determination Appeal"
-            ]
+        document_type = st.selectbox("Select Document Type", LETTER_TYPES)
+        generation_mode = st.radio(
+            "Generation Mode",
+            ["Template + AI sections", "Full AI letter"],
+            help="Template mode asks Gemini only for the narrative paragraphs and fills the rest from a letter template"
+        )
+        stream_output = st.toggle(
+            "Stream generated text",
+            value=True,
+            help="In Full AI letter mode, show the letter as Gemini writes it instead of waiting for the full response"
         )
         
         st.markdown("---")
@@ -606,100 +658,151 @@ def main():
         """, unsafe_allow_html=True)
         
         st.markdown("---")
+        cache_stats = get_extraction_cache().stats()
+        st.caption(
+            f"Extraction cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, "
+            f"{cache_stats['entries']} entries"
+        )
+        duplicate_stats = get_duplicate_index().stats()
+        st.caption(
+            f"Rescans recognised: {duplicate_stats['hits']} of {duplicate_stats['hits'] + duplicate_stats['misses']}, "
+            f"{duplicate_stats['entries']} documents indexed"
+        )
+        generation_stats = get_generation_cache().stats()
+        st.caption(
+            f"Generation cache: {generation_stats['memory_hits'] + generation_stats['disk_hits']} hits / "
+            f"{generation_stats['misses']} misses"
+        )
+        parse_metrics = get_parse_metrics()
+        if parse_metrics:
+            st.caption("Extraction responses: " + ", ".join(
+                f"{count} {outcome.replace('_', ' ')}" for outcome, count in sorted(parse_metrics.items())
+            ))
+        display_record_admin()
+        show_timings = st.toggle(
+            "Show timing panel",
+            help="Show where the time went in the last extraction, batch or generation"
+        )
         if st.button("🔄 Reset All Fields", key="reset_btn"):
             st.session_state.extracted_data = {}
+            for key in ("extraction", "generated_document", "generated_content"):
+                st.session_state.pop(key, None)
             st.rerun()
 
-    # Main form with auto-fill capability
-    col1, col2 = st.columns(2)
-    extracted = st.session_state.extracted_data
-
-    with col1:
-        st.markdown('<h3 class="section-header-patient">👤 Patient Information</h3>', unsafe_allow_html=True)
-        patient_name = st.text_input(
-            "Patient Full Name*", 
-            value=extracted.get('patient_name', '') if extracted.get('patient_name') != 'Not found' else '',
-            placeholder="Rajesh Kumar"
-        )
-        policy_number = st.text_input(
-            "Policy/Member ID*", 
-            value=extracted.get('policy_number', '') if extracted.get('policy_number') != 'Not found' else '',
-            placeholder="HDFC123456789"
-        )
-        dob_value = datetime(1990, 1, 1)
-        if extracted.get('date_of_birth') and extracted.get('date_of_birth') != 'Not found':
-            try:
-                dob_value = datetime.strptime(extracted.get('date_of_birth'), '%Y-%m-%d')
-            except ValueError:
-                pass
-        dob = st.date_input("Date of Birth", value=dob_value)
-        contact_value = ""
-        if extracted.get('phone') and extracted.get('phone') != 'Not found':
-            contact_value += f"Phone: {extracted.get('phone')}\n"
-        if extracted.get('email') and extracted.get('email') != 'Not found':
-            contact_value += f"Email: {extracted.get('email')}\n"
-        if extracted.get('address') and extracted.get('address') != 'Not found':
-            contact_value += f"Address: {extracted.get('address')}"
-        contact_info = st.text_area(
-            "Contact Information", 
-            value=contact_value,
-            placeholder="Phone: +91 98765 43210\nEmail: patient@email.com\nAddress: 123 MG Road, Mumbai, Maharashtra 400001"
-        )
+    if batch_clicked and batch_background:
+        submit_batch_jobs(batch_files, batch_document_type, batch_smart_window, offline_mode,
+                          document_type if batch_letters else None, batch_reason)
+    elif batch_clicked:
+        with start_trace("batch") as trace:
+            st.session_state.last_trace = trace
+            process_batch(batch_files, batch_document_type, batch_llm_workers, batch_smart_window, offline_mode,
+                          batch_pack)
+    if st.session_state.batch_results:
+        display_batch_results(st.session_state.batch_results)
+    display_jobs()
+
+    # Main form with auto-fill capability; edits are batched until the letter is generated
+    with st.form("letter_form", border=False):
+        col1, col2 = st.columns(2)
+        extracted = st.session_state.extracted_data
+
+        with col1:
+            st.markdown('<h3 class="section-header-patient">👤 Patient Information</h3>', unsafe_allow_html=True)
+            patient_name = st.text_input(
+                "Patient Full Name*", 
+                value=extracted.get('patient_name', '') if extracted.get('patient_name') != 'Not found' else '',
+                placeholder="Rajesh Kumar"
+            )
+            policy_number = st.text_input(
+                "Policy/Member ID*", 
+                value=extracted.get('policy_number', '') if extracted.get('policy_number') != 'Not found' else '',
+                placeholder="HDFC123456789"
+            )
+            dob_value = datetime(1990, 1, 1)
+            if extracted.get('date_of_birth') and extracted.get('date_of_birth') != 'Not found':
+                try:
+                    dob_value = datetime.strptime(extracted.get('date_of_birth'), '%Y-%m-%d')
+                except ValueError:
+                    pass
+            dob = st.date_input("Date of Birth", value=dob_value)
+            contact_value = ""
+            if extracted.get('phone') and extracted.get('phone') != 'Not found':
+                contact_value += f"Phone: {extracted.get('phone')}\n"
+            if extracted.get('email') and extracted.get('email') != 'Not found':
+                contact_value += f"Email: {extracted.get('email')}\n"
+            if extracted.get('address') and extracted.get('address') != 'Not found':
+                contact_value += f"Address: {extracted.get('address')}"
+            contact_info = st.text_area(
+                "Contact Information", 
+                value=contact_value,
+                placeholder="Phone: +91 98765 43210\nEmail: patient@email.com\nAddress: 123 MG Road, Mumbai, Maharashtra 400001"
+            )
 
-    with col2:
-        st.markdown('<h3 class="section-header-claim">🏥 Claim Details</h3>', unsafe_allow_html=True)
-        service_date_value = datetime.now()
-        if extracted.get('service_date') and extracted.get('service_date') != 'Not found':
-            try:
-                service_date_value = datetime.strptime(extracted.get('service_date'), '%Y-%m-%d')
-            except ValueError:
-                pass
-        service_date = st.date_input("Service Date", value=service_date_value)
-        diagnosis = st.text_area(
-            "Diagnosis/Condition*", 
-            value=extracted.get('diagnosis', '') if extracted.get('diagnosis') != 'Not found' else '',
-            placeholder="Primary diagnosis code and description"
-        )
-        treatment = st.text_area(
-            "Treatment/Service*", 
-            value=extracted.get('treatment', '') if extracted.get('treatment') != 'Not found' else '',
-            placeholder="Detailed description of treatment or service provided"
-        )
-        claim_amount_value = 0.0
-        if extracted.get('claim_amount') and extracted.get('claim_amount') != 'Not found':
-            try:
-                amount_str = ''.join(filter(str.isdigit, str(extracted.get('claim_amount'))))
-                if amount_str:
-                    claim_amount_value = float(amount_str)
-            except ValueError:
-                pass
-        claim_amount = st.number_input(
-            "Claim Amount (₹)", 
-            min_value=0.0, 
-            format="%.2f",
-            value=claim_amount_value,
-            help="Enter 0 if amount is not applicable"
-        )
-        reason = st.text_area(
-            "Reason for Claim/Appeal*", 
-            placeholder="Detailed explanation of why this claim should be approved or why the appeal should be considered"
-        )
+        with col2:
+            st.markdown('<h3 class="section-header-claim">🏥 Claim Details</h3>', unsafe_allow_html=True)
+            service_date_value = datetime.now()
+            if extracted.get('service_date') and extracted.get('service_date') != 'Not found':
+                try:
+                    service_date_value = datetime.strptime(extracted.get('service_date'), '%Y-%m-%d')
+                except ValueError:
+                    pass
+            service_date = st.date_input("Service Date", value=service_date_value)
+            diagnosis = st.text_area(
+                "Diagnosis/Condition*", 
+                value=extracted.get('diagnosis', '') if extracted.get('diagnosis') != 'Not found' else '',
+                placeholder="Primary diagnosis code and description"
+            )
+            treatment = st.text_area(
+                "Treatment/Service*", 
+                value=extracted.get('treatment', '') if extracted.get('treatment') != 'Not found' else '',
+                placeholder="Detailed description of treatment or service provided"
+            )
+            claim_amount_value = 0.0
+            if extracted.get('claim_amount') and extracted.get('claim_amount') != 'Not found':
+                try:
+                    amount_str = ''.join(filter(str.isdigit, str(extracted.get('claim_amount'))))
+                    if amount_str:
+                        claim_amount_value = float(amount_str)
+                except ValueError:
+                    pass
+            claim_amount = st.number_input(
+                "Claim Amount (₹)", 
+                min_value=0.0, 
+                format="%.2f",
+                value=claim_amount_value,
+                help="Enter 0 if amount is not applicable"
+            )
+            reason = st.text_area(
+                "Reason for Claim/Appeal*", 
+                placeholder="Detailed explanation of why this claim should be approved or why the appeal should be considered"
+            )
 
-    st.markdown("---")
+        st.markdown("---")
     
-    # Custom styled generate button
-    generate_clicked = st.button("📄 Generate Document", type="primary", use_container_width=True)
+        # Custom styled generate button
+        generate_clicked = st.form_submit_button("📄 Generate Document", type="primary", use_container_width=True)
     
-    if generate_clicked:
+    regenerate_requested = st.session_state.pop("regenerate_requested", False)
+    if generate_clicked or regenerate_requested:
         required_fields = [patient_name, policy_number, diagnosis, treatment, reason]
         if not all(field.strip() for field in required_fields):
             st.error("❌ Please fill in all required fields marked with *")
         else:
-            generate_and_display_document(
-                document_type, patient_name, policy_number, 
-                dob, contact_info, service_date, diagnosis, 
-                treatment, claim_amount, reason
-            )
+            with start_trace("generation") as trace:
+                st.session_state.last_trace = trace
+                generate_and_display_document(
+                    document_type, patient_name, policy_number, 
+                    dob, contact_info, service_date, diagnosis, 
+                    treatment, claim_amount, reason, stream=stream_output,
+                    templated=generation_mode == "Template + AI sections",
+                    force=regenerate_requested
+                )
+
+    if st.session_state.get("generated_document"):
+        display_generated_document()
+
+    if show_timings and st.session_state.get("last_trace"):
+        display_trace(st.session_state.last_trace)
 
     st.markdown("---")
     st.markdown(
@@ -0,0 +1,965 @@
+import argparse
+import contextvars
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from batch_intake import DEFAULT_LLM_WORKERS, DEFAULT_TEXT_WORKERS, iter_directory, run_batch
+from card_ocr import read_insurance_card
+from chunked_extraction import merge_chunk_fields, split_into_chunks
+from docx_renderer import docx_file_name, render_letter_docx, render_merged_docx, render_zip
+from extraction_cache import ExtractionCache, make_cache_key
+from gemini_client import GEMINI_REQUESTS_PER_MINUTE, GeminiClient
+from generation_cache import GenerationCache, make_generation_key
+from json_repair import repair_json, repair_json_array
+from llm_backends import BACKEND_REQUESTS_PER_MINUTE, LLM_BACKEND, make_backend
+from letter_templates import has_template, render_letter, slot_descriptions
+from local_extractor import SCHEMA_FIELDS, merge_fields, missing_fields, pre_extract_fields
+from near_duplicates import NearDuplicateIndex
+from ocr_engine import submit, submit_ocr
+from record_store import RECORD_STORE_ENABLED, RecordStore
+from telemetry import observe, record_usage, register_collector, span, traced
+from text_extraction import is_pdf, read_pdf_text
+from upload_spool import MAX_UPLOAD_BYTES, UploadTooLarge, portable_source, source_size
+
+# The document pipeline without any UI: text extraction, field extraction, letter
+# generation and .docx rendering. The Streamlit app, the HTTP service and the CLI
+# below are all thin clients of these functions.
+
+# -------------------- CONFIGURATION --------------------
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+# Point the client at another host, e.g. a local fake Gemini server in tests
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+
+# Bump whenever the extraction prompt, schema or local_extractor rules change so cached results are not reused
+EXTRACTION_PROMPT_VERSION = "4"
+# Characters of document text sent to Gemini; PDF reading stops once this much text is collected
+EXTRACTION_TEXT_LIMIT = 2000
+# Budgets for packing several documents into one extraction request
+OUTPUT_TOKENS_PER_FIELD = 60
+BATCH_MAX_INPUT_TOKENS = 12000
+BATCH_MAX_OUTPUT_TOKENS = 6000
+# Chunked extraction reads up to this much text and extracts its chunks on this many threads
+CHUNKED_TEXT_LIMIT = int(os.getenv("CHUNKED_TEXT_LIMIT", 1_000_000))
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", 16))
+
+# Bump whenever a generation prompt or letter template changes
+GENERATION_PROMPT_VERSION = "2"
+
+DOCUMENT_TYPES = ["Medical Record", "Insurance Card", "Previous Claim", "Medical Bill", "Other"]
+LETTER_TYPES = [
+    "Insurance Claim Letter",
+    "Appeal Letter",
+    "Prior Authorization Request",
+    "Reimbursement Claim",
+    "Medical Necessity Letter",
+    "Coverage Determination Appeal"
+]
+
+class DocGenError(Exception):
+    """A document could not be read, extracted or written; the message is fit to show to users."""
+
+# -------------------- SHARED RESOURCES --------------------
+
+_resources = {}
+_resources_lock = threading.Lock()
+
+def _shared(name, factory):
+    with _resources_lock:
+        if name not in _resources:
+            _resources[name] = factory()
+        return _resources[name]
+
+# Processes splitting the LLM requests-per-minute limit; the job queue sets it when it starts workers
+_rate_limit_shares = 1
+
+def _requests_per_minute():
+    return BACKEND_REQUESTS_PER_MINUTE.get(LLM_BACKEND, GEMINI_REQUESTS_PER_MINUTE) / _rate_limit_shares
+
+def share_rate_limit(processes):
+    """Gives this process an even share of the limit between `processes` processes, including
+    a client it already created."""
+    global _rate_limit_shares
+    with _resources_lock:
+        _rate_limit_shares = max(1, processes)
+        client = _resources.get("gemini_client")
+    if client is not None:
+        client.set_rate_limit(_requests_per_minute())
+
+def get_gemini_client(api_key=None):
+    """Rate-limited, retrying client over the LLM_BACKEND backend, shared by every caller.
+
+    The Gemini backend is configured from `api_key` or GEMINI_API_KEY on first use.
+    """
+    def create():
+        if LLM_BACKEND != "gemini":
+            return GeminiClient(make_backend(LLM_BACKEND), requests_per_minute=_requests_per_minute())
+        key = api_key or os.getenv("GEMINI_API_KEY")
+        if not key:
+            raise DocGenError("Gemini API key not found. Please set it in Streamlit secrets or environment variables.")
+        return GeminiClient(make_backend("gemini", key, GEMINI_MODEL, GEMINI_API_ENDPOINT),
+                            requests_per_minute=_requests_per_minute())
+    return _shared("gemini_client", create)
+
+def get_extraction_cache():
+    return _shared("extraction_cache", ExtractionCache)
+
+def get_generation_cache():
+    return _shared("generation_cache", GenerationCache)
+
+def get_duplicate_index():
+    return _shared("duplicate_index", NearDuplicateIndex)
+
+def get_record_store():
+    return _shared("record_store", RecordStore)
+
+def get_chunk_pool():
+    return _shared("chunk_pool", lambda: ThreadPoolExecutor(max_workers=CHUNK_WORKERS, thread_name_prefix="chunk"))
+
+def get_parse_metrics():
+    """How extraction responses were parsed: parsed, repaired, line_fallback or failed, and for packed
+    requests batch_parsed, batch_repaired, batch_fallback and batch_retried."""
+    return _shared("parse_metrics", Counter)
+
+def _pipeline_metrics():
+    """Cache, client and parse counters for the metrics endpoint; resources that were never created are skipped."""
+    samples = []
+    client = _resources.get("gemini_client")
+    if client is not None:
+        for stat, value in client.stats.items():
+            name = "docgen_llm_throttled_seconds_total" if stat == "throttled_seconds" else f"docgen_llm_{stat}_total"
+            samples.append((name, {}, value))
+    if "extraction_cache" in _resources:
+        stats = _resources["extraction_cache"].stats()
+        samples += [
+            ("docgen_cache_hits_total", {"cache": "extraction"}, stats["hits"]),
+            ("docgen_cache_misses_total", {"cache": "extraction"}, stats["misses"]),
+            ("docgen_cache_hit_rate", {"cache": "extraction"}, round(stats["hit_rate"], 4)),
+            ("docgen_cache_entries", {"cache": "extraction"}, stats["entries"]),
+        ]
+    if "generation_cache" in _resources:
+        stats = _resources["generation_cache"].stats()
+        samples += [
+            ("docgen_cache_hits_total", {"cache": "generation"}, stats["memory_hits"] + stats["disk_hits"]),
+            ("docgen_cache_misses_total", {"cache": "generation"}, stats["misses"]),
+            ("docgen_cache_hit_rate", {"cache": "generation"}, round(stats["hit_rate"], 4)),
+            ("docgen_cache_entries", {"cache": "generation"}, stats["disk_entries"]),
+        ]
+    if "duplicate_index" in _resources:
+        stats = _resources["duplicate_index"].stats()
+        samples += [
+            ("docgen_cache_hits_total", {"cache": "near_duplicate"}, stats["hits"]),
+            ("docgen_cache_misses_total", {"cache": "near_duplicate"}, stats["misses"]),
+            ("docgen_cache_hit_rate", {"cache": "near_duplicate"}, round(stats["hit_rate"], 4)),
+            ("docgen_cache_entries", {"cache": "near_duplicate"}, stats["entries"]),
+            ("docgen_near_duplicate_rejected_total", {}, stats["rejected"]),
+        ]
+    for outcome, count in _resources.get("parse_metrics", {}).items():
+        samples.append(("docgen_parse_outcomes_total", {"outcome": outcome}, count))
+    return samples
+
+register_collector(_pipeline_metrics)
+
+# -------------------- DOCUMENT TEXT EXTRACTION --------------------
+
+@traced("extract_text")
+def extract_text(source, file_name, document_type="Other", max_chars=EXTRACTION_TEXT_LIMIT, smart_window=False):
+    """Text of a PDF or image upload source; images are OCRed on the persistent OCR pool."""
+    try:
+        if is_pdf(file_name):
+            return read_pdf_text(source, max_chars=max_chars, smart_window=smart_window, document_type=document_type)
+        return submit_ocr(portable_source(source), document_type).result()
+    except Exception as e:
+        raise DocGenError(f"Error extracting text from {'PDF' if is_pdf(file_name) else 'image'}: {str(e)}") from e
+
+@traced("read_card")
+def read_card(source):
+    try:
+        return submit(read_insurance_card, portable_source(source)).result()
+    except Exception as e:
+        raise DocGenError(f"Error reading insurance card: {str(e)}") from e
+
+# -------------------- AI INFORMATION EXTRACTION --------------------
+
+EXTRACTION_FIELD_DESCRIPTIONS = {
+    "patient_name": "Full name of the patient or Not found",
+    "policy_number": "Insurance policy or member ID or Not found",
+    "date_of_birth": "Date of birth in YYYY-MM-DD format or Not found",
+    "phone": "Phone number or Not found",
+    "email": "Email address or Not found",
+    "address": "Full address or Not found",
+    "diagnosis": "Medical diagnosis or condition or Not found",
+    "treatment": "Treatment or procedure details or Not found",
+    "service_date": "Date of service in YYYY-MM-DD format or Not found",
+    "provider_name": "Healthcare provider name or Not found",
+    "claim_amount": "Claim amount numbers only or Not found",
+    "insurance_company": "Insurance company name or Not found"
+}
+
+# Permissive safety settings for administrative content
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_ONLY_HIGH"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_ONLY_HIGH"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_ONLY_HIGH"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_ONLY_HIGH"
+    }
+]
+
+def extract_information_from_document(document_text, document_type, fields=SCHEMA_FIELDS,
+                                      max_chars=EXTRACTION_TEXT_LIMIT):
+    client = get_gemini_client()
+
+    json_structure = ",\n".join(
+        f'        "{field}": "{EXTRACTION_FIELD_DESCRIPTIONS[field]}"' for field in fields
+    )
+    prompt = f"""
+    Extract relevant information from the following {document_type} document text for administrative form filling.
+
+    Document Text:
+    {document_text[:max_chars]}
+
+    IMPORTANT: You must return ONLY valid JSON format. Do not include any explanatory text before or after the JSON.
+
+    Extract and return this exact JSON structure:
+    {{
+{json_structure}
+    }}
+
+    Return only the JSON object, nothing else.
+    """
+
+    generation_config = dict(
+        temperature=0.1,
+        # Roughly 60 tokens per requested field keeps partial requests short
+        max_output_tokens=min(800, 40 + OUTPUT_TOKENS_PER_FIELD * len(fields)),
+        top_p=0.8,
+        top_k=40,
+        # Constrain the model to the schema so responses parse without a second request
+        response_mime_type="application/json",
+        response_schema=extraction_schema(fields)
+    )
+    try:
+        with span("gemini.extract"):
+            response = client.generate_content(
+                prompt,
+                generation_config=generation_config,
+                safety_settings=SAFETY_SETTINGS
+            )
+    except Exception as e:
+        raise DocGenError(f"Error extracting information: {str(e)}") from e
+    record_usage(response, "extract")
+
+    if not response.candidates:
+        raise DocGenError("Response was blocked by safety filters. Please try with different content.")
+    if response.candidates[0].finish_reason == 2:  # SAFETY
+        raise DocGenError("Content was filtered for safety. Please try with different document content.")
+    if not response.text:
+        raise DocGenError("Empty response from Gemini API")
+    return parse_extraction_response(response.text)
+
+def extraction_schema(fields):
+    return {
+        "type": "object",
+        "properties": {field: {"type": "string"} for field in fields},
+        "required": list(fields)
+    }
+
+def parse_answer_lines(response_text):
+    """Maps "Label: value" lines onto schema fields for responses that are not JSON at all."""
+    extracted_data = {}
+    for line in response_text.strip().split('\n'):
+        if ':' in line:
+            key, value = line.split(':', 1)
+            key = key.strip().strip('"').lower().replace(' ', '_')
+            value = value.strip().strip('",')
+            if 'name' in key and 'provider' not in key:
+                extracted_data['patient_name'] = value
+            elif 'policy' in key:
+                extracted_data['policy_number'] = value
+            elif 'birth' in key:
+                extracted_data['date_of_birth'] = value
+            elif 'phone' in key:
+                extracted_data['phone'] = value
+            elif 'email' in key:
+                extracted_data['email'] = value
+            elif 'address' in key:
+                extracted_data['address'] = value
+            elif 'diagnosis' in key:
+                extracted_data['diagnosis'] = value
+            elif 'treatment' in key:
+                extracted_data['treatment'] = value
+            elif 'service' in key:
+                extracted_data['service_date'] = value
+            elif 'provider' in key:
+                extracted_data['provider_name'] = value
+            elif 'amount' in key:
+                extracted_data['claim_amount'] = value
+            elif 'insurance' in key:
+                extracted_data['insurance_company'] = value
+    return extracted_data
+
+@traced("parse_response")
+def parse_extraction_response(response_text):
+    """Parses, repairs or line-parses a response locally instead of asking Gemini again."""
+    metrics = get_parse_metrics()
+    extracted_data, repaired = repair_json(response_text)
+    # An object whose only field was cut off repairs to {}; line-parsing it would bring the cut value back
+    if extracted_data is not None:
+        metrics["repaired" if repaired else "parsed"] += 1
+        return extracted_data
+    extracted_data = parse_answer_lines(response_text)
+    if extracted_data:
+        metrics["line_fallback"] += 1
+        return extracted_data
+    metrics["failed"] += 1
+    raise DocGenError("No valid JSON found in response")
+
+# -------------------- MULTI-DOCUMENT EXTRACTION --------------------
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+def plan_extraction_batches(documents, fields, max_input_tokens=BATCH_MAX_INPUT_TOKENS,
+                            max_output_tokens=BATCH_MAX_OUTPUT_TOKENS):
+    """Greedily groups (document_id, text) pairs so each request stays within both token budgets."""
+    output_per_document = 20 + OUTPUT_TOKENS_PER_FIELD * len(fields)
+    batches = []
+    current = []
+    input_tokens = output_tokens = 0
+    for document_id, document_text in documents:
+        document_tokens = estimate_tokens(document_text[:EXTRACTION_TEXT_LIMIT]) + 20
+        if current and (input_tokens + document_tokens > max_input_tokens
+                        or output_tokens + output_per_document > max_output_tokens):
+            batches.append(current)
+            current = []
+            input_tokens = output_tokens = 0
+        current.append((document_id, document_text))
+        input_tokens += document_tokens
+        output_tokens += output_per_document
+    if current:
+        batches.append(current)
+    return batches
+
+def _extract_group(group, document_type, fields):
+    client = get_gemini_client()
+
+    json_structure = ",\n".join(
+        f'            "{field}": "{EXTRACTION_FIELD_DESCRIPTIONS[field]}"' for field in fields
+    )
+    document_blocks = "\n\n".join(
+        f"    === Document {document_id} ===\n    {document_text[:EXTRACTION_TEXT_LIMIT]}"
+        for document_id, document_text in group
+    )
+    prompt = f"""
+    Extract relevant information from each of the following {document_type} documents for administrative form filling.
+
+{document_blocks}
+
+    IMPORTANT: You must return ONLY valid JSON format. Do not include any explanatory text before or after the JSON.
+
+    Return a JSON array with one object per document, in this exact structure:
+    [
+        {{
+            "document_id": "The id from the document's === Document <id> === header",
+{json_structure}
+        }}
+    ]
+    """
+    item_schema = extraction_schema(fields)
+    item_schema["properties"]["document_id"] = {"type": "string"}
+    item_schema["required"].append("document_id")
+
+    try:
+        with span("gemini.extract_batch", documents=len(group)):
+            response = client.generate_content(
+                prompt,
+                generation_config=dict(
+                    temperature=0.1,
+                    max_output_tokens=len(group) * (20 + OUTPUT_TOKENS_PER_FIELD * len(fields)),
+                    top_p=0.8,
+                    top_k=40,
+                    response_mime_type="application/json",
+                    response_schema={"type": "array", "items": item_schema}
+                ),
+                safety_settings=SAFETY_SETTINGS
+            )
+    except Exception as e:
+        # The client has already retried; asking again per document would only multiply failing calls
+        raise DocGenError(f"Error extracting information: {str(e)}") from e
+    record_usage(response, "extract_batch")
+    metrics = get_parse_metrics()
+    # Blocked or unparseable responses fall back to one request per document
+    if not response.candidates or response.candidates[0].finish_reason == 2:  # SAFETY
+        metrics["batch_fallback"] += 1
+        return {}
+    items, repaired = repair_json_array(response.text)
+    if not items:
+        metrics["batch_fallback"] += 1
+        return {}
+    metrics["batch_repaired" if repaired else "batch_parsed"] += 1
+    wanted = {str(document_id) for document_id, _ in group}
+    return {
+        str(item["document_id"]): item for item in items
+        if str(item.get("document_id")) in wanted
+    }
+
+def extract_information_batch(documents, document_type, fields=SCHEMA_FIELDS):
+    """Extracts fields for many (document_id, text) pairs with as few requests as the token budgets allow.
+
+    Documents missing from a packed response, or all of them when it cannot be parsed, are retried
+    individually. API errors raise DocGenError. Returns {document_id: fields or None}.
+    """
+    results = {}
+    for group in plan_extraction_batches(documents, fields):
+        extracted = _extract_group(group, document_type, fields) if len(group) > 1 else {}
+        for document_id, document_text in group:
+            data = extracted.get(str(document_id))
+            if data is None:
+                if len(group) > 1:
+                    get_parse_metrics()["batch_retried"] += 1
+                try:
+                    data = extract_information_from_document(document_text, document_type, fields)
+                except DocGenError:
+                    data = None
+            else:
+                data.pop("document_id", None)
+            results[document_id] = data
+    return results
+
+# -------------------- CHUNKED EXTRACTION --------------------
+
+@traced("extract_chunked")
+def extract_information_chunked(document_text, document_type, fields=SCHEMA_FIELDS):
+    """Map-reduce extraction over the whole text: chunks are extracted concurrently and their answers merged.
+
+    A chunk that fails is left out of the vote; only a document where every chunk fails raises.
+    """
+    chunks = split_into_chunks(document_text)
+    if len(chunks) <= 1:
+        return extract_information_from_document(document_text, document_type, fields, max_chars=None)
+
+    def extract_chunk(chunk):
+        try:
+            return extract_information_from_document(chunk, document_type, fields, max_chars=None)
+        except DocGenError:
+            return None
+
+    # Each task runs in a copy of this context so its spans land in the caller's trace
+    futures = [get_chunk_pool().submit(contextvars.copy_context().run, extract_chunk, chunk) for chunk in chunks]
+    results = [future.result() for future in futures]
+    metrics = get_parse_metrics()
+    metrics["chunk_failed"] += sum(1 for data in results if data is None)
+    if not any(results):
+        raise DocGenError("Could not extract information from any part of the document")
+    merged, agreement = merge_chunk_fields(list(zip(chunks, results)), fields)
+    metrics["chunk_conflicts"] += sum(1 for share in agreement.values() if 0 < share < 1)
+    return merged
+
+# -------------------- FIELD EXTRACTION --------------------
+
+@traced("extract_fields")
+def extract_fields(document_text, document_type, offline=False, chunked=False):
+    """Local rules fill what they can; Gemini is only asked for the fields still missing.
+
+    With `chunked`, Gemini reads the whole text in chunks instead of its first EXTRACTION_TEXT_LIMIT characters.
+    """
+    with span("local_rules"):
+        local_fields, confidences = pre_extract_fields(document_text)
+    requested = missing_fields(confidences)
+    if offline or not requested:
+        return local_fields
+    if chunked:
+        llm_fields = extract_information_chunked(document_text, document_type, requested)
+    else:
+        llm_fields = extract_information_from_document(document_text, document_type, requested)
+    return merge_fields(local_fields, llm_fields, requested)
+
+@traced("extract_fields_many")
+def extract_fields_many(documents, document_type, offline=False):
+    """extract_fields for many (document_id, text) pairs, sharing Gemini requests between them."""
+    local = {document_id: pre_extract_fields(document_text) for document_id, document_text in documents}
+    requested = {document_id: missing_fields(confidences) for document_id, (_, confidences) in local.items()}
+    pending = [(document_id, document_text) for document_id, document_text in documents if requested[document_id]]
+    llm_fields = {}
+    if pending and not offline:
+        fields = [field for field in SCHEMA_FIELDS if any(field in requested[document_id] for document_id, _ in pending)]
+        llm_fields = extract_information_batch(pending, document_type, fields)
+    return {
+        document_id: merge_fields(local[document_id][0], llm_fields.get(document_id), requested[document_id])
+        for document_id, _ in documents
+    }
+
+# A near-duplicate is only reused when one of these is read on both scans and none of them differ
+IDENTITY_FIELDS = ("policy_number", "patient_name", "date_of_birth")
+
+def _same_value(value, other):
+    return re.sub(r"[^a-z0-9]", "", value.lower()) == re.sub(r"[^a-z0-9]", "", other.lower())
+
+@traced("find_near_duplicate")
+def find_near_duplicate(document_text, document_type, variant=""):
+    """A previously extracted rescan of this document, or None.
+
+    Fails closed: the match is only reused when local rules read at least one of the policy number,
+    name or birth date in the new text, it equals the stored value, and no other one differs. Two
+    patients' bills on the same template look alike, so similar text alone is never enough.
+    """
+    index = get_duplicate_index()
+    duplicate = index.find(document_text, f"{document_type}|{variant}")
+    if duplicate is None:
+        return None
+    local_fields, _ = pre_extract_fields(document_text)
+    confirmed = False
+    for field in IDENTITY_FIELDS:
+        new, old = _found(local_fields.get(field)), _found(duplicate["fields"].get(field))
+        if new and old:
+            if not _same_value(new, old):
+                confirmed = False
+                break
+            confirmed = True
+    if not confirmed:
+        index.record_rejection()
+        return None
+    index.record_hit()
+    return duplicate
+
+def index_extraction(document_text, document_type, fields, variant="", file_name=None):
+    """Makes a finished extraction available to find_near_duplicate."""
+    get_duplicate_index().add(document_text, f"{document_type}|{variant}", fields, file_name)
+
+def extraction_variant(smart_window=False, chunked=False):
+    """Cache key variant for how the document text was read."""
+    return "chunked" if chunked else "smart" if smart_window else ""
+
+def _read_document(upload, file_name, document_type="Other", offline=False, smart_window=False, chunked=False,
+                   reuse_duplicates=False):
+    """extract_document without recording the result."""
+    if MAX_UPLOAD_BYTES and source_size(upload) > MAX_UPLOAD_BYTES:
+        raise UploadTooLarge(f"{file_name} is larger than the {MAX_UPLOAD_BYTES / (1024 * 1024):.3g} MB upload limit")
+    cache = get_extraction_cache()
+    variant = extraction_variant(smart_window, chunked)
+    cache_key = make_cache_key(upload, document_type, EXTRACTION_PROMPT_VERSION, variant)
+    cached = cache.get(cache_key)
+    if cached and cached[1]:
+        return {"text": cached[0], "fields": cached[1], "source": "cache"}
+
+    document_text = cached[0] if cached else None
+    if not document_text and not is_pdf(file_name) and document_type == "Insurance Card":
+        card = read_card(upload)
+        document_text = card["text"]
+        if card["confident"]:
+            cache.put(cache_key, document_text, card["fields"])
+            return {"text": document_text, "fields": card["fields"], "source": "card"}
+    if not document_text:
+        if chunked:
+            document_text = extract_text(upload, file_name, document_type, max_chars=CHUNKED_TEXT_LIMIT)
+        else:
+            document_text = extract_text(upload, file_name, document_type, smart_window=smart_window)
+        if not document_text or not document_text.strip():
+            raise DocGenError("No text found in the document")
+        # Kept before the Gemini call, so a retry after a failed or interrupted call skips OCR
+        cache.put(cache_key, document_text, None)
+
+    if reuse_duplicates and not offline:
+        duplicate = find_near_duplicate(document_text, document_type, variant)
+        if duplicate:
+            duplicate_of = {"file_name": duplicate["file_name"], "similarity": duplicate["similarity"]}
+            return {"text": document_text, "fields": duplicate["fields"], "source": "near_duplicate",
+                    "duplicate_of": duplicate_of}
+
+    fields = extract_fields(document_text, document_type, offline, chunked)
+    # Offline results are partial, so only the text is kept for them
+    cache.put(cache_key, document_text, None if offline else fields)
+    if not offline:
+        index_extraction(document_text, document_type, fields, variant, file_name)
+    return {"text": document_text, "fields": fields, "source": "extraction"}
+
+@traced("extract_document")
+def extract_document(upload, file_name, document_type="Other", offline=False, smart_window=False, chunked=False,
+                     reuse_duplicates=False):
+    """Text and fields for one uploaded document, using the extraction cache, the insurance-card fast path
+    and, with `reuse_duplicates`, the fields of an earlier scan of the same document.
+
+    `upload` is the file's bytes, path, SpooledUpload or file object. `chunked` reads the whole document
+    instead of its first pages and extracts it in chunks. Returns {"text", "fields", "source"} where source
+    is cache, card, near_duplicate or extraction; near-duplicates also carry "duplicate_of". Reuse is
+    opt-in, for front ends that show the user which document was reused. Fields that name a patient
+    are kept in the record store. Raises UploadTooLarge past MAX_UPLOAD_BYTES.
+    """
+    extraction = _read_document(upload, file_name, document_type, offline, smart_window, chunked, reuse_duplicates)
+    remember_extraction(extraction["fields"], file_name)
+    return extraction
+
+def remember_extraction(fields, file_name=None):
+    """Keeps fields that name a patient in the record store; returns the patient id or None."""
+    if RECORD_STORE_ENABLED and fields:
+        return get_record_store().save_extraction(fields, file_name)
+    return None
+
+def remember_letter(fields, letter_type, content):
+    """Keeps a generated letter with the patient `fields` name (schema field names)."""
+    if RECORD_STORE_ENABLED and content:
+        return get_record_store().save_letter(fields, letter_type, content)
+    return None
+
+# -------------------- LETTER INPUTS --------------------
+
+def format_amount(amount):
+    return f"₹{amount:,.2f}" if amount > 0 else "Not specified"
+
+def _found(value):
+    return value if value and value != "Not found" else ""
+
+def letter_inputs(fields, reason=""):
+    """Maps extracted schema fields onto the (patient_data, claim_details) a letter is written from."""
+    contact = "\n".join(
+        f"{label}: {_found(fields.get(field))}"
+        for field, label in (("phone", "Phone"), ("email", "Email"), ("address", "Address"))
+        if _found(fields.get(field))
+    )
+    amount_digits = "".join(filter(str.isdigit, str(_found(fields.get("claim_amount")))))
+    patient_data = {
+        'name': _found(fields.get('patient_name')),
+        'policy_number': _found(fields.get('policy_number')),
+        'dob': _found(fields.get('date_of_birth')),
+        'contact': contact
+    }
+    claim_details = {
+        'service_date': _found(fields.get('service_date')),
+        'diagnosis': _found(fields.get('diagnosis')),
+        'treatment': _found(fields.get('treatment')),
+        'amount': format_amount(float(amount_digits) if amount_digits else 0.0),
+        'reason': reason
+    }
+    return patient_data, claim_details
+
+# -------------------- DOCUMENT GENERATION --------------------
+
+def build_generation_prompt(document_type, patient_data, claim_details):
+    # More neutral prompt to avoid safety filters
+    return f"""
+    Generate a professional administrative {document_type} document based on the following information:
+
+    Patient Information:
+    - Name: {patient_data.get('name', '')}
+    - Policy Number: {patient_data.get('policy_number', '')}
+    - Date of Birth: {patient_data.get('dob', '')}
+    - Contact Information: {patient_data.get('contact', '')}
+
+    Administrative Details:
+    - Service Date: {claim_details.get('service_date', '')}
+    - Condition: {claim_details.get('diagnosis', '')}
+    - Service Description: {claim_details.get('treatment', '')}
+    - Amount: {claim_details.get('amount', '')}
+    - Justification: {claim_details.get('reason', '')}
+
+    Please generate a formal, professional business document that includes:
+    1. Proper business letter formatting with recipient address placeholder
+    2. Clear statement of the request or claim
+    3. Supporting information and justification
+    4. Specific requested action
+    5. Professional closing with signature line
+
+    Make it professional and factual, following standard business letter format.
+    The tone should be professional and respectful.
+    Use Indian Rupees (₹) for all monetary amounts.
+    Format should be suitable for Indian administrative system.
+
+    Focus on administrative and procedural aspects rather than detailed medical information.
+    """
+
+GENERATION_PARAMS = {
+    "temperature": 0.3,
+    "max_output_tokens": 1500,
+    "top_p": 0.8,
+    "top_k": 40
+}
+
+SLOT_GENERATION_PARAMS = dict(GENERATION_PARAMS, max_output_tokens=400)
+
+def generation_config(params=GENERATION_PARAMS):
+    # genai takes plain dicts, so the SDK is only imported once a Gemini backend is built
+    return dict(params)
+
+def generation_cache_key(mode, document_type, patient_data, claim_details, params):
+    # Letters are dated, so a cached letter is only reused on the day it was written
+    config = dict(params, prompt_version=GENERATION_PROMPT_VERSION, date=datetime.now().strftime('%Y-%m-%d'))
+    return make_generation_key(mode, document_type, patient_data, claim_details, config)
+
+def generate_document_content(document_type, patient_data, claim_details, force=False, metrics=None):
+    metrics = {} if metrics is None else metrics
+    cache = get_generation_cache()
+    cache_key = generation_cache_key("full", document_type, patient_data, claim_details, GENERATION_PARAMS)
+    cached = None if force else cache.get(cache_key)
+    if cached:
+        metrics["cached"] = True
+        return cached
+
+    client = get_gemini_client()
+    prompt = build_generation_prompt(document_type, patient_data, claim_details)
+    try:
+        with span("gemini.generate"):
+            response = client.generate_content(
+                prompt,
+                generation_config=generation_config(),
+                safety_settings=SAFETY_SETTINGS
+            )
+    except Exception as e:
+        raise DocGenError(f"Error generating content: {str(e)}") from e
+    record_usage(response, "generate")
+
+    if not response.candidates:
+        raise DocGenError("Unable to generate content due to safety filters. Please try with different input.")
+    if response.candidates[0].finish_reason == 2:  # SAFETY
+        raise DocGenError("Content generation was blocked by safety filters. Please modify your input and try again.")
+    if not response.text:
+        raise DocGenError("Unable to generate content. Please try again with different parameters.")
+    cache.put(cache_key, response.text)
+    return response.text
+
+def stream_document_content(document_type, patient_data, claim_details, metrics, force=False):
+    """Yields generated text as Gemini streams it, recording time to first token and total latency in `metrics`."""
+    cache = get_generation_cache()
+    cache_key = generation_cache_key("full", document_type, patient_data, claim_details, GENERATION_PARAMS)
+    cached = None if force else cache.get(cache_key)
+    if cached:
+        metrics["cached"] = True
+        yield cached
+        return
+
+    client = get_gemini_client()
+    prompt = build_generation_prompt(document_type, patient_data, claim_details)
+    started = time.perf_counter()
+    try:
+        with span("gemini.stream"):
+            try:
+                response = client.generate_content(
+                    prompt,
+                    generation_config=generation_config(),
+                    safety_settings=SAFETY_SETTINGS,
+                    stream=True
+                )
+                chunks = []
+                for chunk in response:
+                    try:
+                        chunk_text = chunk.text
+                    except ValueError:
+                        # Chunks without text parts, e.g. the final one when a safety filter stops generation
+                        continue
+                    if chunk_text:
+                        if "first_token_seconds" not in metrics:
+                            metrics["first_token_seconds"] = time.perf_counter() - started
+                            observe("docgen_first_token_seconds", metrics["first_token_seconds"])
+                        chunks.append(chunk_text)
+                        yield chunk_text
+            except Exception as e:
+                raise DocGenError(f"Error generating content: {str(e)}") from e
+            record_usage(response, "generate")
+
+        if not response.candidates:
+            raise DocGenError("Unable to generate content due to safety filters. Please try with different input.")
+        if response.candidates[0].finish_reason == 2:  # SAFETY
+            raise DocGenError("Content generation was blocked by safety filters. Please modify your input and try again.")
+        if "first_token_seconds" not in metrics:
+            raise DocGenError("Unable to generate content. Please try again with different parameters.")
+        cache.put(cache_key, "".join(chunks))
+    finally:
+        metrics["total_seconds"] = time.perf_counter() - started
+
+def build_slot_prompt(document_type, patient_data, claim_details):
+    json_structure = ",\n".join(
+        f'        "{slot}": "{description}"' for slot, description in slot_descriptions(document_type).items()
+    )
+    return f"""
+    Write the narrative sections of a professional administrative {document_type}.
+    The letterhead, patient and service details, salutation and closing are already provided, so write only the sections below.
+
+    Patient Name: {patient_data.get('name', '')}
+    Service Date: {claim_details.get('service_date', '')}
+    Condition: {claim_details.get('diagnosis', '')}
+    Service Description: {claim_details.get('treatment', '')}
+    Amount: {claim_details.get('amount', '')}
+    Justification: {claim_details.get('reason', '')}
+
+    IMPORTANT: You must return ONLY valid JSON format. Do not include any explanatory text before or after the JSON.
+
+    Return this exact JSON structure:
+    {{
+{json_structure}
+    }}
+
+    The tone should be professional and respectful. Use Indian Rupees (₹) for all monetary amounts.
+    Focus on administrative and procedural aspects rather than detailed medical information.
+    """
+
+def generate_templated_content(document_type, patient_data, claim_details, force=False, metrics=None):
+    """Renders the document type's template around model-written slots; returns None so callers can fall back."""
+    metrics = {} if metrics is None else metrics
+    cache = get_generation_cache()
+    cache_key = generation_cache_key("template", document_type, patient_data, claim_details, SLOT_GENERATION_PARAMS)
+    cached = None if force else cache.get(cache_key)
+    if cached:
+        metrics["cached"] = True
+        return cached
+
+    if not has_template(document_type):
+        return None
+    client = get_gemini_client()
+    prompt = build_slot_prompt(document_type, patient_data, claim_details)
+    try:
+        with span("gemini.slots"):
+            response = client.generate_content(
+                prompt,
+                generation_config=generation_config(SLOT_GENERATION_PARAMS),
+                safety_settings=SAFETY_SETTINGS
+            )
+        record_usage(response, "slots")
+        if not response.candidates or response.candidates[0].finish_reason == 2:  # SAFETY
+            return None
+        slots, _ = repair_json(response.text)
+        if not slots or not all(slots.get(slot) for slot in slot_descriptions(document_type)):
+            return None
+        with span("render_template"):
+            content = render_letter(document_type, patient_data, claim_details, slots)
+    except Exception as e:
+        raise DocGenError(f"Template generation failed: {str(e)}") from e
+    cache.put(cache_key, content)
+    return content
+
+@traced("generate_letter")
+def generate_letter(document_type, patient_data, claim_details, templated=True, force=False, metrics=None):
+    """Template letter with AI-written sections when possible, otherwise a full AI letter."""
+    metrics = {} if metrics is None else metrics
+    if templated:
+        try:
+            content = generate_templated_content(document_type, patient_data, claim_details, force, metrics)
+        except DocGenError as e:
+            metrics["template_error"] = str(e)
+            content = None
+        if content:
+            metrics["mode"] = "template"
+            return content
+    metrics["mode"] = "full"
+    return generate_document_content(document_type, patient_data, claim_details, force, metrics)
+
+@traced("render_docx")
+def render_docx(content, doc_type, patient_name):
+    with span("docx.save"):
+        return render_letter_docx(content, doc_type, patient_name)
+
+@traced("render_docx_bundle")
+def render_docx_bundle(letters, merged=False):
+    """Many (content, doc_type, patient_name) letters as a zip of .docx files, or one merged .docx."""
+    letters = list(letters)
+    with span("docx.save"):
+        return render_merged_docx(letters) if merged else render_zip(letters)
+
+# -------------------- HEADLESS ENTRY POINT --------------------
+
+def _write_letter(result, args):
+    """Returns the output row and, with --merged, the letter to add to the merged document."""
+    row = {"file": result["file"], "status": result["status"], "output": None, "error": result["error"]}
+    if not result["extracted_data"]:
+        return row, None
+    patient_data, claim_details = letter_inputs(result["extracted_data"], args.reason)
+    try:
+        content = generate_letter(args.letter_type, patient_data, claim_details, templated=not args.full_letter)
+    except DocGenError as e:
+        row.update(status="failed", error=str(e))
+        return row, None
+    letter = (content, args.letter_type, patient_data["name"])
+    if args.merged:
+        row.update(status="merged", output=args.merged)
+        return row, letter
+    # The source extension stays in the name, so a.pdf and a.png do not overwrite each other's letter
+    output = os.path.join(args.output, result["file"] + ".docx")
+    with open(output, "wb") as f:
+        f.write(render_docx(*letter))
+    row.update(status="written", output=output)
+    return row, None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a letter (.docx) for every document in a directory.")
+    parser.add_argument("directory", help="Directory containing PDF and image documents")
+    parser.add_argument("output", help="Directory the .docx letters are written to")
+    parser.add_argument("--document-type", default="Other", choices=DOCUMENT_TYPES)
+    parser.add_argument("--letter-type", default=LETTER_TYPES[0], choices=LETTER_TYPES)
+    parser.add_argument("--reason", default="", help="Reason for the claim or appeal, used in every letter")
+    parser.add_argument("--full-letter", action="store_true", help="Have Gemini write the whole letter")
+    parser.add_argument("--offline", action="store_true", help="Extract fields with local rules only")
+    parser.add_argument("--chunked", action="store_true",
+                        help="Read whole documents and extract them in chunks instead of the first pages")
+    parser.add_argument("--reuse", action="store_true",
+                        help="Reuse the fields of an earlier scan of the same patient's document instead of "
+                             "extracting it again")
+    parser.add_argument("--text-workers", type=int, default=DEFAULT_TEXT_WORKERS)
+    parser.add_argument("--llm-workers", type=int, default=DEFAULT_LLM_WORKERS)
+    parser.add_argument("--merged", action="store_true", help="Write every letter into one .docx, a page each")
+    args = parser.parse_args(argv)
+    os.makedirs(args.output, exist_ok=True)
+    if args.merged:
+        args.merged = os.path.join(args.output, docx_file_name(args.letter_type, "merged"))
+
+    variant = extraction_variant(chunked=args.chunked)
+
+    def extract(document_text, document_type):
+        if args.offline:
+            return extract_fields(document_text, document_type, offline=True, chunked=args.chunked)
+        duplicate = find_near_duplicate(document_text, document_type, variant) if args.reuse else None
+        if duplicate:
+            return duplicate["fields"]
+        fields = extract_fields(document_text, document_type, chunked=args.chunked)
+        index_extraction(document_text, document_type, fields, variant)
+        return fields
+
+    started = time.perf_counter()
+    count = 0
+    merged = {}
+    # Letter futures still running, mapped to their document's position for the merged document
+    pending = {}
+
+    def report(future):
+        row, letter = future.result()
+        position = pending.pop(future)
+        if letter:
+            merged[position] = letter
+        print(json.dumps(row, ensure_ascii=False), flush=True)
+
+    with ThreadPoolExecutor(max_workers=args.llm_workers) as letter_pool:
+        results = run_batch(iter_directory(args.directory), args.document_type, extract,
+                            cache=None if args.offline else get_extraction_cache(),
+                            prompt_version=EXTRACTION_PROMPT_VERSION,
+                            max_chars=CHUNKED_TEXT_LIMIT if args.chunked else EXTRACTION_TEXT_LIMIT,
+                            text_workers=args.text_workers, llm_workers=args.llm_workers,
+                            cache_variant=variant)
+        # Letters are written while later documents are still being extracted, and rows print as they finish
+        for result in results:
+            pending[letter_pool.submit(_write_letter, result, args)] = count
+            count += 1
+            for future in [future for future in pending if future.done()]:
+                report(future)
+        for future in as_completed(list(pending)):
+            report(future)
+    if merged:
+        with open(args.merged, "wb") as f:
+            f.write(render_docx_bundle([merged[position] for position in sorted(merged)], merged=True))
+    print(f"Processed {count} documents in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
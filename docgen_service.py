@@ -0,0 +1,272 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel
+from docgen_core import (
+    DOCUMENT_TYPES, LETTER_TYPES, DocGenError, docx_file_name, extract_document, format_amount, generate_letter,
+    get_duplicate_index, get_extraction_cache, get_generation_cache, get_parse_metrics, get_record_store, letter_inputs,
+    render_docx, render_docx_bundle
+)
+from job_queue import JOB_WORKERS, ensure_workers, get_job_queue
+from telemetry import render_prometheus
+from upload_spool import MAX_UPLOAD_BYTES, UploadTooLarge, spool_upload
+from warmup import WARM_UP, warm_up
+
+# HTTP front for the core pipeline. Requests are handled on the event loop and the
+# blocking pipeline work runs on a bounded thread pool, so one instance can sit behind
+# a load balancer next to others sharing nothing but the Gemini quota.
+#
+#     uvicorn docgen_service:app --host 0.0.0.0 --port 8000
+
+# -------------------- CONFIGURATION --------------------
+
+SERVICE_WORKERS = int(os.getenv("DOCGEN_SERVICE_WORKERS", 8))
+
+_pool = ThreadPoolExecutor(max_workers=SERVICE_WORKERS, thread_name_prefix="docgen")
+_warm_up_timings = {}
+
+@asynccontextmanager
+async def lifespan(app):
+    if WARM_UP:
+        # uvicorn only starts accepting requests once this returns, so the replica is ready warm
+        _warm_up_timings.update(await asyncio.get_running_loop().run_in_executor(_pool, warm_up))
+    yield
+
+app = FastAPI(title="AI Healthcare Document Generator", lifespan=lifespan)
+
+async def run_in_pool(function, *args):
+    """Runs a blocking core call on the worker pool, turning DocGenError into a 422 response
+    and UploadTooLarge into a 413."""
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_pool, function, *args)
+    except DocGenError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+# -------------------- MODELS --------------------
+
+class LetterRequest(BaseModel):
+    document_type: str = LETTER_TYPES[0]
+    patient: dict = {}
+    claim: dict = {}
+    templated: bool = True
+    force: bool = False
+
+class FieldsLetterRequest(BaseModel):
+    document_type: str = LETTER_TYPES[0]
+    fields: dict
+    reason: str = ""
+    templated: bool = True
+
+class BundleRequest(BaseModel):
+    letters: list[LetterRequest]
+    merged: bool = False
+
+def _check_letter_type(document_type):
+    if document_type not in LETTER_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown letter type: {document_type}")
+
+def _patient_and_claim(request):
+    claim = dict(request.claim)
+    if isinstance(claim.get("amount"), (int, float)):
+        claim["amount"] = format_amount(claim["amount"])
+    return request.patient, claim
+
+def _letter(document_type, patient_data, claim_details, templated, force):
+    metrics = {}
+    content = generate_letter(document_type, patient_data, claim_details, templated, force, metrics)
+    return {"content": content, "mode": metrics["mode"], "cached": metrics.get("cached", False)}
+
+# -------------------- ROUTES --------------------
+
+@app.get("/health")
+def health():
+    return {
+        "status": "ok",
+        "extraction_cache": get_extraction_cache().stats(),
+        "generation_cache": get_generation_cache().stats(),
+        "near_duplicates": get_duplicate_index().stats(),
+        "jobs": get_job_queue().counts(),
+        "records": get_record_store().stats(),
+        "warm_up": _warm_up_timings,
+        "parse_metrics": dict(get_parse_metrics()),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Span latencies, token counts, cache and retry counters in the Prometheus text format."""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.post("/extract")
+async def extract(file: UploadFile = File(...), document_type: str = Form("Other"),
+                  offline: bool = Form(False), smart_window: bool = Form(False), chunked: bool = Form(False),
+                  reuse_duplicates: bool = Form(False)):
+    """Text and form fields for one PDF or image upload.
+
+    With reuse_duplicates=true, a rescan of an earlier document of the same patient comes back with
+    source "near_duplicate" and that document's fields instead of being extracted again.
+    """
+    if document_type not in DOCUMENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown document type: {document_type}")
+    file_name = file.filename or "upload"
+    # Large uploads end up in a temp file that PDF parsing memory-maps, never in one bytes object
+    upload = await run_in_pool(spool_upload, file.file, file_name, MAX_UPLOAD_BYTES)
+    with upload:
+        return await run_in_pool(extract_document, upload, file_name, document_type, offline, smart_window,
+                                 chunked, reuse_duplicates)
+
+@app.post("/letters")
+async def letters(request: LetterRequest):
+    """Letter text from form data."""
+    _check_letter_type(request.document_type)
+    patient_data, claim_details = _patient_and_claim(request)
+    return await run_in_pool(_letter, request.document_type, patient_data, claim_details,
+                             request.templated, request.force)
+
+@app.post("/letters/from-fields")
+async def letters_from_fields(request: FieldsLetterRequest):
+    """Letter text straight from the fields returned by /extract."""
+    _check_letter_type(request.document_type)
+    patient_data, claim_details = letter_inputs(request.fields, request.reason)
+    return await run_in_pool(_letter, request.document_type, patient_data, claim_details, request.templated, False)
+
+@app.post("/letters/docx")
+async def letters_docx(request: LetterRequest):
+    """The same letter as /letters, rendered as a Word document."""
+    _check_letter_type(request.document_type)
+    patient_data, claim_details = _patient_and_claim(request)
+    letter = await run_in_pool(_letter, request.document_type, patient_data, claim_details,
+                               request.templated, request.force)
+    name = patient_data.get("name", "")
+    file_name = docx_file_name(request.document_type, name).encode("ascii", "ignore").decode()
+    document = await run_in_pool(render_docx, letter["content"], request.document_type, name)
+    return Response(
+        content=document,
+        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        headers={"Content-Disposition": f'attachment; filename="{file_name}"'}
+    )
+
+@app.post("/letters/bundle")
+async def letters_bundle(request: BundleRequest):
+    """Several letters as a zip of Word documents, or as one merged document with `merged`."""
+    for letter_request in request.letters:
+        _check_letter_type(letter_request.document_type)
+    inputs = [(letter_request, *_patient_and_claim(letter_request)) for letter_request in request.letters]
+    generated = await asyncio.gather(*(
+        run_in_pool(_letter, letter_request.document_type, patient_data, claim_details,
+                    letter_request.templated, letter_request.force)
+        for letter_request, patient_data, claim_details in inputs
+    ))
+    letters = [(letter["content"], letter_request.document_type, patient_data.get("name", ""))
+               for letter, (letter_request, patient_data, _) in zip(generated, inputs)]
+    bundle = await run_in_pool(render_docx_bundle, letters, request.merged)
+    if request.merged:
+        media_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        file_name = f"letters_{datetime.now().strftime('%Y%m%d')}.docx"
+    else:
+        media_type = "application/zip"
+        file_name = f"letters_{datetime.now().strftime('%Y%m%d')}.zip"
+    return Response(content=bundle, media_type=media_type,
+                    headers={"Content-Disposition": f'attachment; filename="{file_name}"'})
+
+def _queue_job(kind, upload, file_name, params, priority):
+    """Opening the queue, copying the upload and starting workers all block, so this runs on the pool."""
+    job_id = get_job_queue().submit(kind, upload, file_name, params, priority)
+    ensure_workers(JOB_WORKERS)
+    return job_id
+
+@app.post("/jobs", status_code=202)
+async def submit_job(file: UploadFile = File(...), document_type: str = Form("Other"),
+                     letter_type: str = Form(""), reason: str = Form(""), templated: bool = Form(True),
+                     offline: bool = Form(False), smart_window: bool = Form(False), chunked: bool = Form(False),
+                     priority: int = Form(0)):
+    """Queues an upload for the background workers: extraction only, or a whole letter with `letter_type`.
+
+    Poll GET /jobs/{id}; a finished letter job's document is at /jobs/{id}/docx.
+    """
+    if document_type not in DOCUMENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown document type: {document_type}")
+    params = {"document_type": document_type, "offline": offline, "smart_window": smart_window, "chunked": chunked}
+    if letter_type:
+        _check_letter_type(letter_type)
+        params.update(letter_type=letter_type, reason=reason, templated=templated)
+    file_name = file.filename or "upload"
+    upload = await run_in_pool(spool_upload, file.file, file_name, MAX_UPLOAD_BYTES)
+    with upload:
+        job_id = await run_in_pool(_queue_job, "letter" if letter_type else "extract", upload, file_name, params,
+                                   priority)
+    return {"id": job_id, "status": "queued"}
+
+def _get_job(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job {job_id}")
+    return job
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: int):
+    job = _get_job(job_id)
+    return {key: job[key] for key in ("id", "kind", "status", "stage", "priority", "file_name", "results", "error",
+                                      "created_at", "updated_at")}
+
+@app.get("/jobs/{job_id}/docx")
+def job_docx(job_id: int):
+    job = _get_job(job_id)
+    rendered = job["results"].get("render")
+    if rendered is None:
+        raise HTTPException(status_code=409, detail=f"Job {job_id} has no document yet ({job['status']})")
+    file_name = docx_file_name(job["params"]["letter_type"], job["results"]["generate"]["patient_name"])
+    with open(rendered["path"], "rb") as f:
+        document = f.read()
+    return Response(
+        content=document,
+        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        headers={"Content-Disposition": f'attachment; filename="{file_name.encode("ascii", "ignore").decode()}"'}
+    )
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: int):
+    _get_job(job_id)
+    return {"id": job_id, "cancelled": get_job_queue().cancel(job_id)}
+
+@app.get("/records/search")
+def search_records(q: str, limit: int = 10):
+    """Stored patients matching a name, policy number, birth date or insurer, best first."""
+    return {"matches": get_record_store().search(q, min(limit, 50))}
+
+@app.get("/records/export")
+def export_records():
+    """Every stored patient with their letters, as JSON lines."""
+    return StreamingResponse(
+        get_record_store().export_lines(),
+        media_type="application/jsonl",
+        headers={"Content-Disposition": f'attachment; filename="patient_records_{datetime.now().strftime("%Y%m%d")}.jsonl"'}
+    )
+
+@app.post("/records/import")
+async def import_records(file: UploadFile = File(...)):
+    """Loads a /records/export file; records merge into the patients already stored."""
+    try:
+        count = await run_in_pool(get_record_store().import_lines, file.file)
+    except (ValueError, KeyError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid records file: {str(e)}")
+    return {"imported": count}
+
+@app.get("/records/{patient_id}")
+def get_record(patient_id: int):
+    """A stored patient's fields, ready to post to /letters/from-fields, and their letters."""
+    record = get_record_store().get(patient_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"No patient record {patient_id}")
+    return record
+
+@app.delete("/records/{patient_id}")
+def delete_record(patient_id: int):
+    if not get_record_store().delete(patient_id):
+        raise HTTPException(status_code=404, detail=f"No patient record {patient_id}")
+    return {"id": patient_id, "deleted": True}
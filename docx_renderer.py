@@ -0,0 +1,189 @@
+import io
+import os
+import re
+import threading
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+# Letters are rendered into a base .docx that is built (or loaded) once. Its static parts
+# (styles, numbering, settings, footer...) are compressed into a zip a single time, and
+# each letter appends only its own document and header XML to a copy of that zip. Model
+# output is parsed into headings, list items, paragraphs with line breaks, and bold or
+# italic runs instead of one big paragraph.
+
+# -------------------- CONFIGURATION --------------------
+
+# A branded template must contain {{header}} in its page header and a paragraph that is
+# exactly {{body}}, each typed in one go so Word keeps it in a single run.
+DOCX_TEMPLATE_PATH = os.getenv("DOCX_TEMPLATE_PATH")
+HEADER_SENTINEL = "{{header}}"
+BODY_SENTINEL = "{{body}}"
+FOOTER_TEXT = "Generated by AI Healthcare Document Generator"
+
+_BODY_PARAGRAPH = re.compile(r"<w:p\b(?:(?!</w:p>).)*?" + re.escape(BODY_SENTINEL) + r".*?</w:p>", re.S)
+_HEADING = re.compile(r"^(#{1,3})\s+(.*)$")
+_BULLET = re.compile(r"^[-*•]\s+(.*)$")
+_NUMBERED = re.compile(r"^\d{1,2}[.)]\s+(.*)$")
+_RULE = re.compile(r"^(-{3,}|\*{3,}|_{3,})$")
+_INLINE = re.compile(r"(\*\*[^*]+\*\*|\*[^*\s][^*]*\*)")
+_INVALID_XML = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+PAGE_BREAK = '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+
+# -------------------- BASE TEMPLATE --------------------
+
+_base = None
+_base_lock = threading.Lock()
+
+def build_base_template():
+    """The default letterhead: header and footer with the standard python-docx styles."""
+    from docx import Document
+
+    doc = Document()
+    section = doc.sections[0]
+    section.header.paragraphs[0].text = HEADER_SENTINEL
+    section.footer.paragraphs[0].text = FOOTER_TEXT
+    doc.add_paragraph(BODY_SENTINEL)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+def _is_dynamic(name):
+    return name == "word/document.xml" or name.startswith("word/header")
+
+def get_base():
+    """The base template, loaded once per process: the compressed static parts plus the
+    document and header XML that are filled in per letter."""
+    global _base
+    with _base_lock:
+        if _base is None:
+            if DOCX_TEMPLATE_PATH:
+                with open(DOCX_TEMPLATE_PATH, "rb") as f:
+                    template = f.read()
+            else:
+                template = build_base_template()
+            with zipfile.ZipFile(io.BytesIO(template)) as archive:
+                parts = {info.filename: archive.read(info) for info in archive.infolist()}
+            document = parts["word/document.xml"].decode("utf-8")
+            if BODY_SENTINEL not in document:
+                raise ValueError(f"The .docx template has no {BODY_SENTINEL} paragraph")
+            static = io.BytesIO()
+            with zipfile.ZipFile(static, "w", zipfile.ZIP_DEFLATED) as archive:
+                for name, data in parts.items():
+                    if not _is_dynamic(name):
+                        archive.writestr(name, data)
+            _base = {
+                "static": static.getvalue(),
+                "document": document,
+                "headers": {name: data for name, data in parts.items() if name.startswith("word/header")},
+            }
+        return _base
+
+# -------------------- MARKDOWN-ISH PARSING --------------------
+
+def parse_blocks(content):
+    """Splits model output into (style, lines) blocks; style is None for plain paragraphs."""
+    blocks = []
+    paragraph = []
+
+    def flush():
+        if paragraph:
+            blocks.append((None, list(paragraph)))
+            paragraph.clear()
+
+    for raw_line in content.splitlines():
+        line = raw_line.strip()
+        if not line or _RULE.match(line):
+            flush()
+            continue
+        heading = _HEADING.match(line)
+        bullet = _BULLET.match(line)
+        numbered = _NUMBERED.match(line)
+        if heading:
+            flush()
+            blocks.append((f"Heading{len(heading.group(1))}", [heading.group(2)]))
+        elif bullet:
+            flush()
+            blocks.append(("ListBullet", [bullet.group(1)]))
+        elif numbered:
+            flush()
+            blocks.append(("ListNumber", [numbered.group(1)]))
+        else:
+            paragraph.append(line)
+    flush()
+    return blocks
+
+def _run(text, bold=False, italic=False):
+    properties = ("<w:b/>" if bold else "") + ("<w:i/>" if italic else "")
+    properties = f"<w:rPr>{properties}</w:rPr>" if properties else ""
+    return f'<w:r>{properties}<w:t xml:space="preserve">{escape(_INVALID_XML.sub("", text))}</w:t></w:r>'
+
+def _runs(line):
+    runs = []
+    for part in _INLINE.split(line):
+        if not part:
+            continue
+        if part.startswith("**") and part.endswith("**"):
+            runs.append(_run(part[2:-2], bold=True))
+        elif part.startswith("*") and part.endswith("*") and len(part) > 2:
+            runs.append(_run(part[1:-1], italic=True))
+        else:
+            runs.append(_run(part))
+    return "".join(runs)
+
+def _paragraph(lines, style=None, align=None):
+    properties = (f'<w:pStyle w:val="{style}"/>' if style else "") + (f'<w:jc w:val="{align}"/>' if align else "")
+    properties = f"<w:pPr>{properties}</w:pPr>" if properties else ""
+    return f"<w:p>{properties}{'<w:r><w:br/></w:r>'.join(_runs(line) for line in lines)}</w:p>"
+
+def letter_body_xml(content, doc_type):
+    """Body paragraphs for one letter: centered title, right-aligned date, then the parsed content."""
+    paragraphs = [
+        _paragraph([doc_type], "Title", "center"),
+        _paragraph([f"Date: {datetime.now().strftime('%B %d, %Y')}"], align="right"),
+    ]
+    paragraphs += [_paragraph(lines, style) for style, lines in parse_blocks(content)]
+    return "".join(paragraphs)
+
+# -------------------- PACKAGING --------------------
+
+def _package(body_xml, header_text):
+    base = get_base()
+    header = escape(_INVALID_XML.sub("", header_text)).encode("utf-8")
+    # A function replacement so backslashes in letter text are not read as group references
+    document = _BODY_PARAGRAPH.sub(lambda _: body_xml, base["document"], count=1)
+    buffer = io.BytesIO(base["static"])
+    buffer.seek(0, io.SEEK_END)
+    with zipfile.ZipFile(buffer, "a", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("word/document.xml", document.encode("utf-8"))
+        for name, data in base["headers"].items():
+            archive.writestr(name, data.replace(HEADER_SENTINEL.encode(), header))
+    return buffer.getvalue()
+
+def render_letter_docx(content, doc_type, patient_name):
+    return _package(letter_body_xml(content, doc_type), f"{doc_type} - {patient_name}")
+
+def docx_file_name(doc_type, name):
+    return f"{doc_type.replace(' ', '_')}_{name.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.docx"
+
+def render_merged_docx(letters, title="Letters"):
+    """One document holding every (content, doc_type, patient_name) letter, each starting on a new page."""
+    body = PAGE_BREAK.join(letter_body_xml(content, doc_type) for content, doc_type, _ in letters)
+    return _package(body, title)
+
+def render_zip(letters):
+    """A zip of one .docx per (content, doc_type, patient_name) letter."""
+    buffer = io.BytesIO()
+    used = set()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        for content, doc_type, patient_name in letters:
+            name = docx_file_name(doc_type, patient_name)
+            stem, suffix = os.path.splitext(name)
+            number = 2
+            while name in used:
+                name = f"{stem}_{number}{suffix}"
+                number += 1
+            used.add(name)
+            # The .docx files are already deflated, so storing them is as small and much faster
+            archive.writestr(name, render_letter_docx(content, doc_type, patient_name))
+    return buffer.getvalue()
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from upload_spool import iter_chunks
+
+# -------------------- CONFIGURATION --------------------
+
+DEFAULT_CACHE_PATH = os.getenv(
+    "EXTRACTION_CACHE_PATH",
+    os.path.join(".cache", "extraction_cache.sqlite3")
+)
+DEFAULT_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+DEFAULT_TTL_SECONDS = int(os.getenv("EXTRACTION_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+
+# -------------------- CACHE KEYS --------------------
+
+def make_cache_key(source, document_type, prompt_version, variant=""):
+    """Content-addressed key: the same upload for the same document type and prompt maps to one entry.
+
+    `source` is the upload's bytes, path, SpooledUpload or file object; large files are hashed in chunks.
+    `variant` separates entries whose text was read differently, e.g. with smart page selection.
+    """
+    digest = hashlib.sha256()
+    for chunk in iter_chunks(source):
+        digest.update(chunk)
+    digest.update(b"\0")
+    digest.update(document_type.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(str(prompt_version).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(variant.encode("utf-8"))
+    return digest.hexdigest()
+
+# -------------------- SQLITE STORE --------------------
+
+class ExtractionCache:
+    """On-disk store of extracted document text and parsed fields with TTL and LRU size eviction."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS extractions (
+                key TEXT PRIMARY KEY,
+                document_text TEXT,
+                extracted_json TEXT,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_extractions_accessed ON extractions (accessed_at)")
+        self._conn.commit()
+
+    def get(self, key):
+        """Returns (document_text, extracted_data) for a live entry, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT document_text, extracted_json, created_at FROM extractions WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None or now - row[2] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM extractions WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE extractions SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        document_text, extracted_json = row[0], row[1]
+        extracted_data = json.loads(extracted_json) if extracted_json else None
+        return document_text, extracted_data
+
+    def put(self, key, document_text, extracted_data=None):
+        """Stores the raw text and, when available, the parsed fields for a key."""
+        extracted_json = json.dumps(extracted_data) if extracted_data else None
+        size = len(document_text or "") + len(extracted_json or "")
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO extractions
+                    (key, document_text, extracted_json, size, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (key, document_text, extracted_json, size, now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM extractions WHERE created_at < ?", (now - self.ttl_seconds,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM extractions ORDER BY accessed_at ASC").fetchall()
+        stale_keys = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            stale_keys.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM extractions WHERE key = ?", stale_keys)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM extractions")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extractions"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "size_bytes": total,
+        }
@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+
+# Shared wrapper around a genai.GenerativeModel: every call goes through one token
+# bucket, retries transient failures with jittered backoff, honours a deadline and
+# coalesces identical in-flight prompts into a single request.
+
+# -------------------- CONFIGURATION --------------------
+
+# The bucket lives in one process: the job queue divides this limit between the app and its
+# workers, but separately started apps and `job_queue.py` runs each get their own
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", 15))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", 5))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", 4))
+GEMINI_DEADLINE_SECONDS = float(os.getenv("GEMINI_DEADLINE_SECONDS", 90))
+GEMINI_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("GEMINI_ATTEMPT_TIMEOUT_SECONDS", 45))
+
+_retryable_errors = None
+
+def retryable_errors():
+    """Errors worth another attempt. Only called from except clauses, so google.api_core is
+    imported on the first failure rather than at startup."""
+    global _retryable_errors
+    if _retryable_errors is None:
+        from google.api_core import exceptions as google_exceptions
+
+        _retryable_errors = (
+            google_exceptions.ResourceExhausted,
+            google_exceptions.TooManyRequests,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.InternalServerError,
+            google_exceptions.DeadlineExceeded,
+            asyncio.TimeoutError,
+            ConnectionError,
+        )
+    return _retryable_errors
+
+# -------------------- RATE LIMITING --------------------
+
+class TokenBucket:
+    """Allows `rate` requests per second on average with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Waits for a token and returns the seconds spent waiting."""
+        waited = 0.0
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                delay = (1 - self.tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+                self._refill()
+            self.tokens -= 1
+        return waited
+
+# -------------------- CLIENT --------------------
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def _coalesce_key(prompt, generation_config, safety_settings):
+    payload = repr((prompt, generation_config, safety_settings)).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+class GeminiClient:
+    """Rate-limited, retrying front for a GenerativeModel with async and blocking entry points."""
+
+    def __init__(self, model, requests_per_minute=GEMINI_REQUESTS_PER_MINUTE, burst=GEMINI_BURST,
+                 max_retries=GEMINI_MAX_RETRIES, deadline_seconds=GEMINI_DEADLINE_SECONDS,
+                 attempt_timeout_seconds=GEMINI_ATTEMPT_TIMEOUT_SECONDS):
+        self.model = model
+        self.max_retries = max_retries
+        self.deadline_seconds = deadline_seconds
+        self.attempt_timeout_seconds = attempt_timeout_seconds
+        self.stats = {"requests": 0, "retries": 0, "coalesced": 0, "failures": 0, "throttled_seconds": 0.0}
+        self._inflight = {}
+        # All async work runs on one private loop so blocking callers on any thread share
+        # the same bucket and in-flight table
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="gemini-client", daemon=True)
+        self._thread.start()
+        self._bucket = self._run(self._make_bucket(requests_per_minute / 60.0, burst))
+
+    async def _make_bucket(self, rate, capacity):
+        return TokenBucket(rate, capacity)
+
+    def set_rate_limit(self, requests_per_minute):
+        """Changes the sustained rate, e.g. when more processes start sharing the quota."""
+        self._bucket.rate = requests_per_minute / 60.0
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _acquire(self):
+        self.stats["throttled_seconds"] += await self._bucket.acquire()
+
+    async def _call_with_retries(self, prompt, generation_config, safety_settings, deadline):
+        expires = time.monotonic() + deadline
+        attempt = 0
+        while True:
+            await self._acquire()
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError("Gemini request deadline exceeded")
+            timeout = min(self.attempt_timeout_seconds, remaining)
+            self.stats["requests"] += 1
+            try:
+                return await asyncio.wait_for(
+                    self.model.generate_content_async(
+                        prompt,
+                        generation_config=generation_config,
+                        safety_settings=safety_settings,
+                        request_options={"timeout": timeout}
+                    ),
+                    timeout=timeout
+                )
+            except retryable_errors():
+                delay = backoff_delay(attempt)
+                if attempt >= self.max_retries or time.monotonic() + delay >= expires:
+                    self.stats["failures"] += 1
+                    raise
+                self.stats["retries"] += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+            except Exception:
+                self.stats["failures"] += 1
+                raise
+
+    async def generate_content_async(self, prompt, generation_config=None, safety_settings=None, deadline=None):
+        """Awaitable generate_content; concurrent identical requests share one call and its response."""
+        key = _coalesce_key(prompt, generation_config, safety_settings)
+        shared = self._inflight.get(key)
+        if shared is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(shared)
+        task = asyncio.ensure_future(self._call_with_retries(
+            prompt, generation_config, safety_settings, deadline or self.deadline_seconds
+        ))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def generate_content(self, prompt, generation_config=None, safety_settings=None, stream=False, deadline=None):
+        """Blocking generate_content for script and worker threads, with the same limits as the async API."""
+        if stream:
+            return self._open_stream(prompt, generation_config, safety_settings, deadline or self.deadline_seconds)
+        future = asyncio.run_coroutine_threadsafe(
+            self.generate_content_async(prompt, generation_config, safety_settings, deadline), self._loop
+        )
+        return future.result()
+
+    def _open_stream(self, prompt, generation_config, safety_settings, deadline):
+        # Streams are not coalesced; retries only cover opening the stream, before any text is shown
+        expires = time.monotonic() + deadline
+        attempt = 0
+        while True:
+            self._run(self._acquire())
+            self.stats["requests"] += 1
+            timeout = min(self.attempt_timeout_seconds, max(expires - time.monotonic(), 0))
+            try:
+                return self.model.generate_content(
+                    prompt,
+                    generation_config=generation_config,
+                    safety_settings=safety_settings,
+                    stream=True,
+                    request_options={"timeout": timeout}
+                )
+            except retryable_errors():
+                delay = backoff_delay(attempt)
+                if attempt >= self.max_retries or time.monotonic() + delay >= expires:
+                    self.stats["failures"] += 1
+                    raise
+                self.stats["retries"] += 1
+                attempt += 1
+                time.sleep(delay)
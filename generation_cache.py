@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# -------------------- CONFIGURATION --------------------
+
+DEFAULT_CACHE_PATH = os.getenv(
+    "GENERATION_CACHE_PATH",
+    os.path.join(".cache", "generation_cache.sqlite3")
+)
+DEFAULT_MEMORY_ENTRIES = int(os.getenv("GENERATION_CACHE_MEMORY_ENTRIES", 256))
+DEFAULT_DISK_ENTRIES = int(os.getenv("GENERATION_CACHE_DISK_ENTRIES", 10000))
+DEFAULT_TTL_SECONDS = int(os.getenv("GENERATION_CACHE_TTL_SECONDS", 24 * 3600))
+
+# -------------------- CACHE KEYS --------------------
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_value(value):
+    """Canonical form for key hashing: unicode-normalized, whitespace-collapsed strings and sorted mappings.
+
+    Case is preserved because it shows up in the generated letter.
+    """
+    if isinstance(value, dict):
+        return {str(key): normalize_value(item) for key, item in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [normalize_value(item) for item in value]
+    if isinstance(value, str):
+        return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", value)).strip()
+    return value
+
+def make_generation_key(mode, document_type, patient_data, claim_details, config):
+    payload = normalize_value({
+        "mode": mode,
+        "document_type": document_type,
+        "patient": patient_data,
+        "claim": claim_details,
+        "config": config,
+    })
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+# -------------------- TWO-TIER STORE --------------------
+
+class GenerationCache:
+    """Generated letters in an in-memory LRU backed by SQLite, both expiring after ttl_seconds."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, memory_entries=DEFAULT_MEMORY_ENTRIES,
+                 disk_entries=DEFAULT_DISK_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl_seconds = ttl_seconds
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS generations (
+                key TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_accessed ON generations (accessed_at)")
+        self._conn.commit()
+
+    def _remember(self, key, content, created_at):
+        self._memory[key] = (content, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[1] <= self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry[0]
+            self._memory.pop(key, None)
+            row = self._conn.execute(
+                "SELECT content, created_at FROM generations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE generations SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self._remember(key, row[0], row[1])
+            self.disk_hits += 1
+            return row[0]
+
+    def put(self, key, content):
+        now = time.time()
+        with self._lock:
+            self._remember(key, content, now)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generations (key, content, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, content, now, now)
+            )
+            self._conn.execute("DELETE FROM generations WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                """
+                DELETE FROM generations WHERE key IN (
+                    SELECT key FROM generations ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.disk_entries,)
+            )
+            self._conn.commit()
+
+    def invalidate(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+            self._conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            disk_entries = self._conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": disk_entries,
+        }
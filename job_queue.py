@@ -0,0 +1,411 @@
+import argparse
+import atexit
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import suppress
+from docgen_core import (
+    DocGenError, extract_document, generate_letter, get_gemini_client, letter_inputs, remember_letter, render_docx,
+    share_rate_limit
+)
+from telemetry import register_collector
+from upload_spool import UploadTooLarge, iter_chunks
+
+# Durable background jobs without a broker. Jobs live in a SQLite table and are worked
+# by separate processes, one stage at a time: each claim leases a single stage, and its
+# result is checkpointed before the next stage is queued. A worker that dies loses its
+# lease and the stage is retried by another worker; finished stages are never redone.
+# Claims are ordered by priority and capped per stage, so Gemini-bound stages cannot
+# take every worker. The LLM rate limit is split evenly between the app and its workers.
+#
+#     python job_queue.py --workers 4
+
+# -------------------- CONFIGURATION --------------------
+
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", os.path.join(".cache", "jobs.sqlite3"))
+JOB_FILES_DIR = os.getenv("JOB_FILES_DIR", os.path.join(".cache", "jobs"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+# Running stages renew their lease every quarter lease, so a dead worker's stage is retried within a minute
+JOB_LEASE_SECONDS = 60
+JOB_MAX_ATTEMPTS = 3
+JOB_POLL_SECONDS = 0.5
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", 7 * 24 * 3600))
+JOB_STAGES = {
+    "extract": ("extract",),
+    "letter": ("extract", "generate", "render"),
+}
+# Most stages of one kind running at once across all workers
+STAGE_CONCURRENCY = {
+    "extract": int(os.getenv("JOB_EXTRACT_CONCURRENCY", 4)),
+    "generate": int(os.getenv("JOB_GENERATE_CONCURRENCY", 2)),
+    "render": 8,
+}
+ACTIVE_STATUSES = ("queued", "running")
+
+# -------------------- STAGES --------------------
+
+def run_extract(job, files_dir):
+    params = job["params"]
+    extraction = extract_document(job["input_path"], job["file_name"], params.get("document_type", "Other"),
+                                  params.get("offline", False), params.get("smart_window", False),
+                                  params.get("chunked", False), params.get("reuse_duplicates", False))
+    # Later stages only need the fields; the text stays in the extraction cache
+    return {key: value for key, value in extraction.items() if key != "text"}
+
+def run_generate(job, files_dir):
+    params = job["params"]
+    patient_data, claim_details = letter_inputs(job["results"]["extract"]["fields"], params.get("reason", ""))
+    metrics = {}
+    content = generate_letter(params["letter_type"], patient_data, claim_details, params.get("templated", True),
+                              metrics=metrics)
+    remember_letter(job["results"]["extract"]["fields"], params["letter_type"], content)
+    return {"content": content, "mode": metrics["mode"], "cached": metrics.get("cached", False),
+            "patient_name": patient_data["name"]}
+
+def run_render(job, files_dir):
+    letter = job["results"]["generate"]
+    path = os.path.join(files_dir, f"{job['id']}.docx")
+    data = render_docx(letter["content"], job["params"]["letter_type"], letter["patient_name"])
+    with open(path + ".part", "wb") as f:
+        f.write(data)
+    os.replace(path + ".part", path)
+    return {"path": path}
+
+STAGE_RUNNERS = {"extract": run_extract, "generate": run_generate, "render": run_render}
+
+# -------------------- SQLITE QUEUE --------------------
+
+class JobQueue:
+    """Jobs with per-stage checkpoints, shared by every process that opens the same path."""
+
+    def __init__(self, path=JOB_QUEUE_PATH, files_dir=JOB_FILES_DIR, stage_concurrency=STAGE_CONCURRENCY):
+        self.path = path
+        self.files_dir = files_dir
+        self.stage_concurrency = stage_concurrency
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        os.makedirs(files_dir, exist_ok=True)
+        # Autocommit, so claims can take the write lock up front with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                priority INTEGER NOT NULL,
+                file_name TEXT NOT NULL,
+                input_path TEXT NOT NULL,
+                params_json TEXT NOT NULL,
+                results_json TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                worker TEXT,
+                lease_until REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, priority DESC, id)")
+
+    def submit(self, kind, source, file_name, params, priority=0):
+        """Queues a job over a copy of `source` (bytes, path, SpooledUpload or file object); returns its id.
+
+        "extract" jobs take document_type, offline, smart_window, chunked and reuse_duplicates params;
+        "letter" jobs also take letter_type, reason and templated.
+        """
+        if kind not in JOB_STAGES:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if kind == "letter" and not params.get("letter_type"):
+            raise ValueError("Letter jobs need a letter_type")
+        input_path = os.path.join(self.files_dir, f"{uuid.uuid4().hex}{os.path.splitext(file_name)[1].lower()}")
+        with open(input_path, "wb") as f:
+            for chunk in iter_chunks(source):
+                f.write(chunk)
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (kind, status, stage, priority, file_name, input_path, params_json, results_json, "
+                "created_at, updated_at) VALUES (?, 'queued', ?, ?, ?, ?, ?, '{}', ?, ?)",
+                (kind, JOB_STAGES[kind][0], priority, file_name, input_path, json.dumps(params), now, now)
+            )
+        return cursor.lastrowid
+
+    def claim(self, worker):
+        """Leases the next runnable stage to `worker`, or returns None when there is none."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._release_expired(now)
+                running = dict(self._conn.execute(
+                    "SELECT stage, COUNT(*) FROM jobs WHERE status = 'running' GROUP BY stage"
+                ).fetchall())
+                stages = [stage for stage, limit in self.stage_concurrency.items() if running.get(stage, 0) < limit]
+                row = None
+                if stages:
+                    row = self._conn.execute(
+                        f"SELECT id FROM jobs WHERE status = 'queued' AND stage IN ({','.join('?' * len(stages))}) "
+                        "ORDER BY priority DESC, id LIMIT 1",
+                        stages
+                    ).fetchone()
+                if row:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                        "updated_at = ? WHERE id = ?",
+                        (worker, now + JOB_LEASE_SECONDS, now, row[0])
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(row[0]) if row else None
+
+    def _release_expired(self, now):
+        """Requeues stages whose worker stopped renewing the lease, failing them after JOB_MAX_ATTEMPTS."""
+        self._conn.execute(
+            "UPDATE jobs SET status = 'failed', error = 'Worker stopped ' || attempts || ' times', worker = NULL, "
+            "lease_until = NULL, updated_at = ? WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+            (now, now, JOB_MAX_ATTEMPTS)
+        )
+        self._conn.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL, lease_until = NULL, updated_at = ? "
+            "WHERE status = 'running' AND lease_until < ?",
+            (now, now)
+        )
+
+    def renew(self, job_id, worker):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running' AND worker = ?",
+                (time.time() + JOB_LEASE_SECONDS, job_id, worker)
+            )
+
+    def checkpoint(self, job, worker, output):
+        """Stores a finished stage's output and queues the next stage, or marks the job done.
+
+        Ignored when the lease was lost or the job cancelled meanwhile; returns whether it was stored.
+        """
+        results = dict(job["results"], **{job["stage"]: output})
+        stages = JOB_STAGES[job["kind"]]
+        position = stages.index(job["stage"])
+        next_stage = stages[position + 1] if position + 1 < len(stages) else None
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, results_json = ?, attempts = 0, error = NULL, worker = NULL, "
+                "lease_until = NULL, updated_at = ? WHERE id = ? AND status = 'running' AND worker = ?",
+                ("queued" if next_stage else "done", next_stage, json.dumps(results), time.time(), job["id"], worker)
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, job, worker, error, retry=False):
+        """Fails the job, or with `retry` queues the stage again while attempts remain."""
+        status = "queued" if retry and job["attempts"] < JOB_MAX_ATTEMPTS else "failed"
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, worker = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE id = ? AND status = 'running' AND worker = ?",
+                (status, error, time.time(), job["id"], worker)
+            )
+
+    def cancel(self, job_id):
+        """Cancels a queued or running job; a running stage finishes but its result is dropped."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', worker = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'running')",
+                (time.time(), job_id)
+            )
+        return cursor.rowcount == 1
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _job(row) if row else None
+
+    def recent(self, limit=20):
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {_COLUMNS} FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [_job(row) for row in rows]
+
+    def counts(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def purge(self, max_age_seconds=JOB_RETENTION_SECONDS):
+        """Deletes finished jobs older than `max_age_seconds` along with their files."""
+        cutoff = time.time() - max_age_seconds
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, input_path, results_json FROM jobs WHERE status NOT IN ('queued', 'running') "
+                "AND updated_at < ?",
+                (cutoff,)
+            ).fetchall()
+            self._conn.executemany("DELETE FROM jobs WHERE id = ?", [(row[0],) for row in rows])
+        for _, input_path, results_json in rows:
+            for path in (input_path, json.loads(results_json).get("render", {}).get("path")):
+                if path:
+                    # Another worker purging at the same time may have got there first
+                    with suppress(FileNotFoundError):
+                        os.unlink(path)
+        return len(rows)
+
+    def run_next(self, worker):
+        """Claims and runs one stage; returns False when nothing was runnable."""
+        job = self.claim(worker)
+        if job is None:
+            return False
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(JOB_LEASE_SECONDS / 4):
+                self.renew(job["id"], worker)
+
+        threading.Thread(target=heartbeat, daemon=True).start()
+        try:
+            output = STAGE_RUNNERS[job["stage"]](job, self.files_dir)
+        except (DocGenError, UploadTooLarge) as e:
+            # Bad or oversized documents and refused prompts fail the same way on every attempt
+            self.fail(job, worker, str(e))
+        except Exception as e:
+            self.fail(job, worker, f"{type(e).__name__}: {e}", retry=True)
+        else:
+            self.checkpoint(job, worker, output)
+        finally:
+            stop.set()
+        return True
+
+_COLUMNS = ("id, kind, status, stage, priority, file_name, input_path, params_json, results_json, attempts, error, "
+            "created_at, updated_at")
+
+def _job(row):
+    (job_id, kind, status, stage, priority, file_name, input_path, params_json, results_json, attempts, error,
+     created_at, updated_at) = row
+    return {
+        "id": job_id, "kind": kind, "status": status, "stage": stage, "priority": priority, "file_name": file_name,
+        "input_path": input_path, "params": json.loads(params_json), "results": json.loads(results_json),
+        "attempts": attempts, "error": error, "created_at": created_at, "updated_at": updated_at,
+    }
+
+def job_summary(job):
+    """One table row for a job: what it is, where it got to and what went wrong."""
+    return {
+        "job": job["id"],
+        "file": job["file_name"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "stage": job["stage"] or "",
+        "source": job["results"].get("extract", {}).get("source", ""),
+        "error": job["error"] or "",
+        "updated": time.strftime("%H:%M:%S", time.localtime(job["updated_at"])),
+    }
+
+# -------------------- WORKERS --------------------
+
+_queue = None
+_queue_lock = threading.Lock()
+_workers = []
+
+def get_job_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
+
+def _queue_metrics():
+    if _queue is None:
+        return []
+    return [("docgen_jobs", {"status": status}, count) for status, count in _queue.counts().items()]
+
+register_collector(_queue_metrics)
+
+def run_worker(path=JOB_QUEUE_PATH, files_dir=JOB_FILES_DIR, api_key=None, exit_when_idle=False,
+               rate_limit_shares=1):
+    """Works stages from the queue until stopped, or until it is empty with `exit_when_idle`.
+
+    The worker's LLM client gets 1/`rate_limit_shares` of the configured requests per minute.
+    """
+    # SIGTERM exits normally, so the OCR and PDF page pools this worker started are shut down too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    share_rate_limit(rate_limit_shares)
+    queue = JobQueue(path, files_dir)
+    queue.purge()
+    if api_key:
+        get_gemini_client(api_key)
+    worker = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    while True:
+        if not queue.run_next(worker):
+            if exit_when_idle and not any(status in ACTIVE_STATUSES for status in queue.counts()):
+                return
+            time.sleep(JOB_POLL_SECONDS)
+
+def ensure_workers(count=JOB_WORKERS, api_key=None):
+    """Keeps `count` worker processes running for this process's queue; dead workers are replaced.
+
+    Workers stop with the app; their unfinished stages are picked up again once workers run
+    anywhere else on the same queue. They are not daemonic, because the extract stage starts
+    OCR and PDF page pools and daemonic processes cannot have children, so stop_workers is
+    registered to end them at exit. This process and its workers each get an even share of
+    the LLM rate limit.
+    """
+    share_rate_limit(count + 1)
+    with _queue_lock:
+        _workers[:] = [process for process in _workers if process.is_alive()]
+        context = multiprocessing.get_context("spawn")
+        while len(_workers) < count:
+            process = context.Process(target=run_worker,
+                                      args=(JOB_QUEUE_PATH, JOB_FILES_DIR, api_key, False, count + 1),
+                                      name="docgen-job-worker")
+            process.start()
+            _workers.append(process)
+        return list(_workers)
+
+def stop_workers(timeout=10):
+    """Terminates the workers started by ensure_workers and waits for them to exit."""
+    with _queue_lock:
+        workers = list(_workers)
+        _workers.clear()
+    for process in workers:
+        process.terminate()
+    for process in workers:
+        process.join(timeout)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+# Registered after multiprocessing's own exit hook, so it runs first and that hook is not left
+# waiting on workers that never return
+atexit.register(stop_workers)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Work extraction and letter jobs from the job queue.")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS)
+    parser.add_argument("--exit-when-idle", action="store_true", help="Stop once no job is queued or running")
+    args = parser.parse_args(argv)
+    if args.workers <= 1:
+        run_worker(exit_when_idle=args.exit_when_idle)
+        return
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_worker,
+                        args=(JOB_QUEUE_PATH, JOB_FILES_DIR, None, args.exit_when_idle, args.workers))
+        for _ in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import json
+import re
+
+# Tolerant parsing for model output that is almost JSON: code fences, prose around
+# the object, smart or single quotes, trailing commas, Python literals, comments and
+# responses cut off at max_output_tokens.
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$", re.I)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_UNQUOTED_KEY = re.compile(r'([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)(\s*:)')
+_LINE_COMMENT = re.compile(r"^\s*//.*$", re.M)
+_PYTHON_LITERALS = {"None": "null", "True": "true", "False": "false"}
+_KEY_VALUE = re.compile(r'["\']?([A-Za-z_][A-Za-z0-9_]*)["\']?\s*:\s*(?:"((?:[^"\\]|\\.)*)"|\'([^\']*)\'|([^,}\n]+))')
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+
+def _object_span(text):
+    start = text.find("{")
+    if start == -1:
+        return None
+    end = text.rfind("}")
+    return text[start:end + 1] if end > start else text[start:]
+
+def _swap_single_quotes(text):
+    """Turns single-quoted strings into double-quoted ones, leaving apostrophes inside double quotes alone."""
+    result = []
+    in_double = in_single = escaped = False
+    for char in text:
+        if escaped:
+            if char == "'":
+                # \' is not a JSON escape; the quote needs no escaping once strings are double-quoted
+                result.pop()
+            result.append(char)
+            escaped = False
+            continue
+        if char == "\\":
+            result.append(char)
+            escaped = True
+            continue
+        if char == '"' and not in_single:
+            in_double = not in_double
+        elif char == "'" and not in_double:
+            in_single = not in_single
+            char = '"'
+        elif char == '"' and in_single:
+            char = '\\"'
+        result.append(char)
+    return "".join(result)
+
+_COMPLETE_VALUE = r'(?:"(?:[^"\\]|\\.)*"|true|false|null|[\[{].*[\]}])'
+_COMPLETE_MEMBER = re.compile(r'\s*"(?:[^"\\]|\\.)*"\s*:\s*' + _COMPLETE_VALUE + r"\s*", re.S)
+_COMPLETE_ITEM = re.compile(r"\s*" + _COMPLETE_VALUE + r"\s*", re.S)
+
+def _close_truncated(text):
+    """Closes the brackets left open by a cut-off response, dropping the element it was cut off in.
+
+    A value is only kept when it visibly ended: "45 could be "4500" cut short, and a bare number
+    never shows that it is complete, so both are dropped rather than filled in with a wrong value.
+    """
+    stack = []
+    in_string = escaped = False
+    for index, char in enumerate(text):
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == '"':
+            in_string = not in_string
+        elif in_string:
+            continue
+        elif char in "{[":
+            # Closing bracket and where the container's current element starts
+            stack.append(["}" if char == "{" else "]", index + 1])
+        elif char in "}]" and stack:
+            stack.pop()
+        elif char == "," and stack:
+            stack[-1][1] = index + 1
+    if not stack:
+        return text
+    closing, element_start = stack[-1]
+    member = _COMPLETE_MEMBER if closing == "}" else _COMPLETE_ITEM
+    if not member.fullmatch(text[element_start:]):
+        text = text[:element_start]
+    text = re.sub(r",\s*$", "", text.rstrip())
+    return text + "".join(closing for closing, _ in reversed(stack))
+
+def _replace_python_literals(text):
+    return re.sub(r"\b(None|True|False)\b", lambda match: _PYTHON_LITERALS[match.group(1)], text)
+
+def _scrape_pairs(text):
+    """Last resort: collects key/value pairs one by one."""
+    data = {}
+    for match in _KEY_VALUE.finditer(text):
+        key = match.group(1)
+        value = next(group for group in match.groups()[1:] if group is not None).strip()
+        data[key] = value
+    return data or None
+
+def repair_json(response_text):
+    """Parses a JSON object from model output, repairing it if needed.
+
+    Returns (data, repaired) where `repaired` is False when the text parsed as-is
+    and data is None when nothing usable was found.
+    """
+    if not response_text:
+        return None, False
+    text = _FENCE.sub("", response_text.strip().translate(_SMART_QUOTES)).strip()
+    candidate = _object_span(text)
+    if candidate is None:
+        return None, False
+    try:
+        return json.loads(candidate), False
+    except json.JSONDecodeError:
+        pass
+
+    repaired = _LINE_COMMENT.sub("", candidate)
+    repaired = _swap_single_quotes(repaired)
+    repaired = _replace_python_literals(repaired)
+    repaired = _UNQUOTED_KEY.sub(r'\1"\2"\3', repaired)
+    repaired = _close_truncated(repaired)
+    repaired = _TRAILING_COMMA.sub(r"\1", repaired)
+    try:
+        data = json.loads(repaired)
+        return (data, True) if isinstance(data, dict) else (None, False)
+    except json.JSONDecodeError:
+        data = _scrape_pairs(candidate)
+        return data, data is not None
+
+def _split_objects(text):
+    """Yields each top-level {...} span, so one broken item does not spoil the rest."""
+    depth = 0
+    start = None
+    in_string = escaped = False
+    for index, char in enumerate(text):
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == '"':
+            in_string = not in_string
+        elif in_string:
+            continue
+        elif char == "{":
+            if depth == 0:
+                start = index
+            depth += 1
+        elif char == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                yield text[start:index + 1]
+                start = None
+    # An object cut off by the token limit is dropped: its values may be truncated
+
+def repair_json_array(response_text):
+    """Parses a JSON array of objects, repairing items one by one when the whole array does not parse.
+
+    Returns (items, repaired); unusable items are dropped.
+    """
+    if not response_text:
+        return [], False
+    text = _FENCE.sub("", response_text.strip().translate(_SMART_QUOTES)).strip()
+    start = text.find("[")
+    end = text.rfind("]")
+    if start != -1 and end > start:
+        try:
+            items = json.loads(text[start:end + 1])
+            if isinstance(items, list):
+                return [item for item in items if isinstance(item, dict)], False
+        except json.JSONDecodeError:
+            pass
+    items = []
+    for span in _split_objects(text[start + 1:] if start != -1 else text):
+        item, _ = repair_json(span)
+        if item:
+            items.append(item)
+    return items, True
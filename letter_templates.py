@@ -0,0 +1,70 @@
+import os
+
+# Letters are rendered from one Jinja template per document type; the model only
+# writes the narrative slots, while headings, details and closing come from the template.
+# The date is not part of the text: the .docx renderer prints it under the title.
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "letters")
+
+# -------------------- SLOTS --------------------
+
+DEFAULT_SLOTS = {
+    "statement": "One or two sentences stating what this letter requests",
+    "justification": "One paragraph (80-120 words) explaining why the request should be granted",
+    "requested_action": "One or two sentences stating the specific action requested and a response timeline",
+}
+
+SLOT_OVERRIDES = {
+    "Appeal Letter": {
+        "statement": "One or two sentences stating that the patient appeals the claim decision",
+        "justification": "One paragraph (80-120 words) explaining why the decision should be reconsidered",
+    },
+    "Prior Authorization Request": {
+        "statement": "One or two sentences requesting pre-approval for the proposed treatment",
+        "justification": "One paragraph (80-120 words) explaining why the proposed treatment is required",
+    },
+    "Medical Necessity Letter": {
+        "justification": "One paragraph (80-120 words) explaining the medical necessity of the service",
+    },
+    "Coverage Determination Appeal": {
+        "statement": "One or two sentences stating that the patient appeals the coverage determination",
+        "justification": "One paragraph (80-120 words) explaining why the service should be covered under the policy",
+    },
+}
+
+def slot_descriptions(document_type):
+    return dict(DEFAULT_SLOTS, **SLOT_OVERRIDES.get(document_type, {}))
+
+# -------------------- RENDERING --------------------
+
+_environment = None
+
+def get_environment():
+    global _environment
+    if _environment is None:
+        from jinja2 import Environment, FileSystemLoader, StrictUndefined
+
+        _environment = Environment(
+            loader=FileSystemLoader(TEMPLATE_DIR),
+            undefined=StrictUndefined,
+            trim_blocks=True,
+            lstrip_blocks=True,
+            keep_trailing_newline=True,
+        )
+    return _environment
+
+def template_name(document_type):
+    return document_type.lower().replace(" ", "_") + ".txt.j2"
+
+def has_template(document_type):
+    return os.path.exists(os.path.join(TEMPLATE_DIR, template_name(document_type)))
+
+def render_letter(document_type, patient_data, claim_details, slots):
+    """Fills the document type's template with the form data and the model-written slots."""
+    template = get_environment().get_template(template_name(document_type))
+    return template.render(
+        document_type=document_type,
+        patient=patient_data,
+        claim=claim_details,
+        slots=slots,
+    ).strip() + "\n"
@@ -0,0 +1,305 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+
+# Backends behind GeminiClient. Each one exposes the slice of genai.GenerativeModel the
+# pipeline uses: generate_content (optionally streamed) and generate_content_async,
+# returning objects with .text and .candidates[0].finish_reason. Selected with LLM_BACKEND.
+
+# -------------------- CONFIGURATION --------------------
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+
+MOCK_LLM_LATENCY_SECONDS = float(os.getenv("MOCK_LLM_LATENCY_SECONDS", 0.5))
+MOCK_LLM_JITTER_SECONDS = float(os.getenv("MOCK_LLM_JITTER_SECONDS", 0.1))
+MOCK_LLM_ERROR_RATE = float(os.getenv("MOCK_LLM_ERROR_RATE", 0.0))
+MOCK_LLM_SEED = int(os.getenv("MOCK_LLM_SEED", 0))
+MOCK_LLM_RESPONSES_PATH = os.getenv("MOCK_LLM_RESPONSES_PATH")
+MOCK_LLM_REQUESTS_PER_MINUTE = float(os.getenv("MOCK_LLM_REQUESTS_PER_MINUTE", 60000))
+
+LOCAL_LLM_URL = os.getenv("LOCAL_LLM_URL", "http://localhost:11434/v1")
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "llama3.1")
+LOCAL_LLM_REQUESTS_PER_MINUTE = float(os.getenv("LOCAL_LLM_REQUESTS_PER_MINUTE", 6000))
+
+FINISH_STOP = 1
+
+# -------------------- RESPONSES --------------------
+
+class Candidate:
+    def __init__(self, finish_reason=FINISH_STOP):
+        self.finish_reason = finish_reason
+
+class UsageMetadata:
+    def __init__(self, prompt_token_count=0, candidates_token_count=0):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+def estimated_usage(prompt, text):
+    # Roughly four characters per token, close enough for load tests
+    return UsageMetadata(len(prompt) // 4, len(text) // 4)
+
+class LLMResponse:
+    """Stand-in for a genai GenerateContentResponse holding the complete text."""
+
+    def __init__(self, text, finish_reason=FINISH_STOP, usage_metadata=None):
+        self.text = text
+        self.candidates = [Candidate(finish_reason)]
+        self.usage_metadata = usage_metadata
+
+    def __iter__(self):
+        yield self
+
+class StreamedResponse:
+    """Stand-in for a streamed response: iterating yields text chunks, candidates are set once it is exhausted."""
+
+    def __init__(self, chunks, prompt=None):
+        self._chunks = chunks
+        self._prompt = prompt
+        self.text = ""
+        self.candidates = []
+        self.usage_metadata = None
+
+    def __iter__(self):
+        parts = []
+        for chunk in self._chunks:
+            parts.append(chunk)
+            yield LLMResponse(chunk)
+        self.text = "".join(parts)
+        self.candidates = [Candidate()]
+        if self._prompt is not None:
+            self.usage_metadata = estimated_usage(self._prompt, self.text)
+
+def _config_value(generation_config, name):
+    if generation_config is None:
+        return None
+    if isinstance(generation_config, dict):
+        return generation_config.get(name)
+    return getattr(generation_config, name, None)
+
+# -------------------- GEMINI --------------------
+
+def gemini_backend(api_key, model_name, api_endpoint=None):
+    """The real thing: a configured genai.GenerativeModel already has the backend interface."""
+    import google.generativeai as genai  # about a second to import, so only when this backend is chosen
+
+    client_options = {"api_endpoint": api_endpoint} if api_endpoint else None
+    genai.configure(api_key=api_key, client_options=client_options)
+    return genai.GenerativeModel(model_name)
+
+# -------------------- DETERMINISTIC MOCK --------------------
+
+MOCK_FIELDS = {
+    "patient_name": "Asha Verma",
+    "policy_number": "MOCK123456789",
+    "date_of_birth": "1985-04-12",
+    "phone": "+91 98765 43210",
+    "email": "asha.verma@example.com",
+    "address": "12 MG Road, Bengaluru, Karnataka 560001",
+    "diagnosis": "Type 2 diabetes mellitus",
+    "treatment": "Outpatient consultation and HbA1c test",
+    "service_date": "2024-03-05",
+    "provider_name": "City Care Hospital",
+    "claim_amount": "4500",
+    "insurance_company": "Star Health and Allied Insurance",
+}
+
+MOCK_SLOT_TEXT = (
+    "The treatment described above was required for the patient's condition and was provided "
+    "in line with the policy terms. We request that the claim be reviewed and settled."
+)
+
+MOCK_LETTER = """To,
+The Claims Manager
+[Insurance Company Name]
+
+Subject: Request for claim settlement
+
+Dear Sir/Madam,
+
+I am writing to request settlement of the claim described below. The service was provided as
+part of the treatment of the insured patient and is covered under the policy.
+
+Please process the claim at the earliest and let us know if any further documents are required.
+
+Yours faithfully,
+
+[Signature]
+"""
+
+_DOCUMENT_HEADER = re.compile(r"^\s*=== Document (\S+) ===$", re.M)
+_JSON_KEY_LINE = re.compile(r'^\s*"(\w+)":\s*"', re.M)
+
+class MockBackend:
+    """Deterministic offline backend for load tests and benchmarks.
+
+    Output depends only on the prompt and generation config: the response schema (or the
+    JSON structure spelled out in the prompt) decides the shape, canned values fill it.
+    Latency and injected 503 errors come from a generator seeded by seed, prompt and attempt.
+    """
+
+    def __init__(self, latency_seconds=MOCK_LLM_LATENCY_SECONDS, jitter_seconds=MOCK_LLM_JITTER_SECONDS,
+                 error_rate=MOCK_LLM_ERROR_RATE, seed=MOCK_LLM_SEED, responses_path=MOCK_LLM_RESPONSES_PATH):
+        self.latency_seconds = latency_seconds
+        self.jitter_seconds = jitter_seconds
+        self.error_rate = error_rate
+        self.seed = seed
+        self.fields = dict(MOCK_FIELDS)
+        self.slot_text = MOCK_SLOT_TEXT
+        self.letter = MOCK_LETTER
+        if responses_path:
+            with open(responses_path, encoding="utf-8") as f:
+                canned = json.load(f)
+            self.fields.update(canned.get("fields", {}))
+            self.slot_text = canned.get("slot_text", self.slot_text)
+            self.letter = canned.get("letter", self.letter)
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def _draw(self, prompt):
+        """(delay, fail) for this attempt at `prompt`; retries of the same prompt get fresh draws."""
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        with self._lock:
+            attempt = self._attempts.get(digest, 0)
+            self._attempts[digest] = attempt + 1
+        rng = random.Random(f"{self.seed}:{digest}:{attempt}")
+        delay = max(0.0, self.latency_seconds + rng.uniform(-self.jitter_seconds, self.jitter_seconds))
+        return delay, rng.random() < self.error_rate
+
+    def _object(self, keys):
+        return {key: self.fields.get(key, self.slot_text) for key in keys}
+
+    def respond(self, prompt, generation_config=None):
+        schema = _config_value(generation_config, "response_schema")
+        if isinstance(schema, dict) and schema.get("type") == "array":
+            keys = [key for key in schema["items"]["properties"] if key != "document_id"]
+            items = [dict(document_id=document_id, **self._object(keys))
+                     for document_id in _DOCUMENT_HEADER.findall(prompt)]
+            return json.dumps(items, ensure_ascii=False)
+        if isinstance(schema, dict):
+            return json.dumps(self._object(schema["properties"]), ensure_ascii=False)
+        if "JSON" in prompt:
+            return json.dumps(self._object(_JSON_KEY_LINE.findall(prompt)), ensure_ascii=False)
+        return self.letter
+
+    def _fail(self):
+        from google.api_core import exceptions as google_exceptions
+
+        raise google_exceptions.ServiceUnavailable("Injected mock backend error")
+
+    def generate_content(self, prompt, generation_config=None, safety_settings=None, stream=False,
+                         request_options=None):
+        delay, fail = self._draw(prompt)
+        text = self.respond(prompt, generation_config)
+        if not stream:
+            time.sleep(delay)
+            if fail:
+                self._fail()
+            return LLMResponse(text, usage_metadata=estimated_usage(prompt, text))
+        if fail:
+            self._fail()
+
+        def chunks():
+            # Spread the latency over the stream so time to first token stays realistic
+            words = re.findall(r"\S+\s*", text) or [text]
+            size = max(1, len(words) // 8)
+            pieces = ["".join(words[index:index + size]) for index in range(0, len(words), size)]
+            for piece in pieces:
+                time.sleep(delay / len(pieces))
+                yield piece
+        return StreamedResponse(chunks(), prompt)
+
+    async def generate_content_async(self, prompt, generation_config=None, safety_settings=None,
+                                     request_options=None):
+        delay, fail = self._draw(prompt)
+        await asyncio.sleep(delay)
+        if fail:
+            self._fail()
+        text = self.respond(prompt, generation_config)
+        return LLMResponse(text, usage_metadata=estimated_usage(prompt, text))
+
+# -------------------- LOCAL MODEL SERVER --------------------
+
+class LocalServerBackend:
+    """Adapter for a local OpenAI-compatible chat completions server (llama.cpp, Ollama, vLLM)."""
+
+    def __init__(self, url=LOCAL_LLM_URL, model=LOCAL_LLM_MODEL):
+        self.url = url.rstrip("/") + "/chat/completions"
+        self.model = model
+
+    def _payload(self, prompt, generation_config, stream):
+        payload = {"model": self.model, "messages": [{"role": "user", "content": prompt}], "stream": stream}
+        for source, target in (("temperature", "temperature"), ("top_p", "top_p"),
+                               ("max_output_tokens", "max_tokens")):
+            value = _config_value(generation_config, source)
+            if value is not None:
+                payload[target] = value
+        if _config_value(generation_config, "response_mime_type") == "application/json":
+            payload["response_format"] = {"type": "json_object"}
+        return json.dumps(payload).encode("utf-8")
+
+    def _open(self, prompt, generation_config, stream, request_options):
+        timeout = (request_options or {}).get("timeout", 60)
+        request = urllib.request.Request(self.url, data=self._payload(prompt, generation_config, stream),
+                                         headers={"Content-Type": "application/json"})
+        try:
+            return urllib.request.urlopen(request, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            from google.api_core import exceptions as google_exceptions
+
+            # Map onto google exceptions so GeminiClient retries 429 and 5xx as usual
+            raise google_exceptions.from_http_status(e.code, e.read().decode("utf-8", "replace")) from e
+        except urllib.error.URLError as e:
+            raise ConnectionError(str(e.reason)) from e
+
+    def generate_content(self, prompt, generation_config=None, safety_settings=None, stream=False,
+                         request_options=None):
+        response = self._open(prompt, generation_config, stream, request_options)
+        if not stream:
+            with response:
+                body = json.load(response)
+            usage = body.get("usage") or {}
+            return LLMResponse(
+                body["choices"][0]["message"]["content"] or "",
+                usage_metadata=UsageMetadata(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+            )
+
+        def chunks():
+            with response:
+                for line in response:
+                    line = line.decode("utf-8").strip()
+                    if not line.startswith("data:") or line == "data: [DONE]":
+                        continue
+                    delta = json.loads(line[5:])["choices"][0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+        return StreamedResponse(chunks())
+
+    async def generate_content_async(self, prompt, generation_config=None, safety_settings=None,
+                                     request_options=None):
+        return await asyncio.to_thread(self.generate_content, prompt, generation_config, safety_settings,
+                                       False, request_options)
+
+# -------------------- SELECTION --------------------
+
+BACKEND_REQUESTS_PER_MINUTE = {
+    "mock": MOCK_LLM_REQUESTS_PER_MINUTE,
+    "local": LOCAL_LLM_REQUESTS_PER_MINUTE,
+}
+
+def make_backend(name=LLM_BACKEND, api_key=None, model_name=None, api_endpoint=None):
+    """Backend by name: gemini (needs api_key), mock or local."""
+    if name == "gemini":
+        return gemini_backend(api_key, model_name, api_endpoint)
+    if name == "mock":
+        return MockBackend()
+    if name == "local":
+        return LocalServerBackend()
+    raise ValueError(f"Unknown LLM backend: {name}")
@@ -0,0 +1,202 @@
+import os
+import re
+from datetime import datetime
+
+# Rule-based extraction that runs before Gemini. Every field gets a confidence;
+# only fields below LOCAL_CONFIDENCE_THRESHOLD are sent to the model.
+
+# -------------------- CONFIGURATION --------------------
+
+LOCAL_CONFIDENCE_THRESHOLD = float(os.getenv("LOCAL_CONFIDENCE_THRESHOLD", 0.8))
+
+SCHEMA_FIELDS = (
+    "patient_name", "policy_number", "date_of_birth", "phone", "email", "address", "diagnosis",
+    "treatment", "service_date", "provider_name", "claim_amount", "insurance_company",
+)
+
+KNOWN_INSURERS = {
+    "star health": "Star Health and Allied Insurance",
+    "hdfc ergo": "HDFC ERGO General Insurance",
+    "icici lombard": "ICICI Lombard General Insurance",
+    "niva bupa": "Niva Bupa Health Insurance",
+    "max bupa": "Niva Bupa Health Insurance",
+    "care health": "Care Health Insurance",
+    "religare": "Care Health Insurance",
+    "bajaj allianz": "Bajaj Allianz General Insurance",
+    "tata aig": "Tata AIG General Insurance",
+    "new india assurance": "The New India Assurance Company",
+    "united india": "United India Insurance Company",
+    "national insurance": "National Insurance Company",
+    "oriental insurance": "The Oriental Insurance Company",
+    "aditya birla": "Aditya Birla Health Insurance",
+    "manipal cigna": "ManipalCigna Health Insurance",
+    "sbi general": "SBI General Insurance",
+}
+
+# -------------------- PATTERNS --------------------
+
+_DATE = r"(\d{1,2}[/\-.]\d{1,2}[/\-.]\d{2,4}|\d{4}-\d{2}-\d{2}|\d{1,2}[ \-][A-Za-z]{3,9}[ \-,]+\d{4})"
+_LABEL_SEPARATOR = r"\s*[:\-.]?\s*"
+
+EMAIL_PATTERN = re.compile(r"[\w.+\-]+@[\w\-]+(?:\.[\w\-]+)+")
+PHONE_LABELLED_PATTERN = re.compile(
+    r"(?:phone|mobile|mob|tel|contact)(?:\s*no)?" + _LABEL_SEPARATOR + r"(\+?[\d][\d \-]{8,15}\d)", re.I
+)
+PHONE_PATTERN = re.compile(r"(?<!\d)(?:\+91[ \-]?|0)?[6-9]\d{4}[ \-]?\d{5}(?!\d)")
+DOB_PATTERN = re.compile(r"(?:date of birth|d\.?o\.?b\.?|birth date)" + _LABEL_SEPARATOR + _DATE, re.I)
+SERVICE_DATE_PATTERN = re.compile(
+    r"(?:date of service|service date|date of admission|admission date|date of treatment|bill date)"
+    + _LABEL_SEPARATOR + _DATE, re.I
+)
+# UHID and IP numbers are hospital IDs, not policy numbers, so they are not labels here
+POLICY_PATTERN = re.compile(
+    r"(?:policy\s*(?:no|number|#)|member\s*id|card\s*no|tpa\s*id)" + _LABEL_SEPARATOR
+    + r"([A-Z0-9][A-Z0-9/\-]{5,24})", re.I
+)
+# Labels that follow the name on the same line of a form ("Name: Rajesh Kumar Age: 45")
+_NEXT_LABEL = (
+    r"(?:age|sex|gender|date\b|d\.?o\.?b\b|birth|uhid|ip\s*no|mrn|reg(?:istration)?\b|policy|member|card|"
+    r"mobile|phone|tel|contact|address|ward|bed|room|relation|email|doctor|consultant)\b"
+)
+# Name words are separated by single spaces, so a column gap or a following label ends the name;
+# the rest of the line is captured to tell a name alone on its line from one followed by more text
+NAME_PATTERN = re.compile(
+    r"(?:patient\s*name|name of (?:the )?patient|insured\s*name|member\s*name)" + _LABEL_SEPARATOR
+    + r"([A-Za-z][A-Za-z.']*(?: (?!" + _NEXT_LABEL + r")[A-Za-z][A-Za-z.']*){0,5})([^\n]*)", re.I
+)
+AMOUNT_PATTERN = re.compile(
+    r"\b(?:grand\s*total|net\s*payable|total\s*amount|amount\s*claimed|claim\s*amount|total)\b"
+    + _LABEL_SEPARATOR + r"(?:₹|rs\.?|inr)?\s*([\d,]+(?:\.\d{1,2})?)", re.I
+)
+PROVIDER_PATTERN = re.compile(
+    r"^.*\b(?:hospital|clinic|medical cent(?:re|er)|nursing home|healthcare)\b.*$", re.I | re.M
+)
+ADDRESS_PATTERN = re.compile(r"address" + _LABEL_SEPARATOR + r"(.{10,150})", re.I)
+DIAGNOSIS_PATTERN = re.compile(r"(?:diagnosis|final diagnosis|condition)" + _LABEL_SEPARATOR + r"(.{3,150})", re.I)
+TREATMENT_PATTERN = re.compile(
+    r"(?:treatment|procedure|surgery|operation)(?:\s*done)?" + _LABEL_SEPARATOR + r"(.{3,150})", re.I
+)
+
+# -------------------- HELPERS --------------------
+
+def normalize_date(value):
+    """Converts common day-first date spellings to YYYY-MM-DD."""
+    value = re.sub(r"[\s,]+", " ", value.strip())
+    for date_format in ("%d/%m/%Y", "%d/%m/%y", "%d-%m-%Y", "%d-%m-%y", "%d.%m.%Y", "%Y-%m-%d",
+                        "%d %b %Y", "%d %B %Y", "%d-%b-%Y", "%d-%B-%Y"):
+        try:
+            return datetime.strptime(value, date_format).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+def _clean_phone(value):
+    digits = re.sub(r"\D", "", value)
+    return digits[-10:] if len(digits) >= 10 else None
+
+# -------------------- RULES --------------------
+
+def _find_phone(text):
+    match = PHONE_LABELLED_PATTERN.search(text)
+    if match and _clean_phone(match.group(1)):
+        return _clean_phone(match.group(1)), 0.9
+    numbers = {_clean_phone(match.group(0)) for match in PHONE_PATTERN.finditer(text)}
+    numbers.discard(None)
+    if len(numbers) == 1:
+        return numbers.pop(), 0.85
+    if numbers:
+        return sorted(numbers)[0], 0.5
+    return None, 0.0
+
+def _find_email(text):
+    match = EMAIL_PATTERN.search(text)
+    return (match.group(0), 0.95) if match else (None, 0.0)
+
+def _find_date(pattern, text, confidence):
+    match = pattern.search(text)
+    if not match:
+        return None, 0.0
+    value = normalize_date(match.group(1))
+    return (value, confidence) if value else (None, 0.0)
+
+def _find_policy(text):
+    match = POLICY_PATTERN.search(text)
+    return (match.group(1).upper(), 0.85) if match else (None, 0.0)
+
+def _find_name(text):
+    match = NAME_PATTERN.search(text)
+    if not match:
+        return None, 0.0
+    name = match.group(1).strip(" .")
+    if len(name) < 3:
+        return None, 0.0
+    # Only a name that ends its line is trusted; anything after it may be part of the name or a label
+    return name.title(), 0.8 if not match.group(2).strip() else 0.6
+
+def _find_amount(text):
+    # Totals are usually printed last, so the final labelled amount wins
+    matches = [match.group(1).replace(",", "") for match in AMOUNT_PATTERN.finditer(text)]
+    matches = [value for value in matches if value.strip(".")]
+    if not matches:
+        return None, 0.0
+    return matches[-1], 0.85 if len(set(matches)) == 1 else 0.75
+
+def _find_insurer(text):
+    lowered = text.lower()
+    for keyword, insurer in KNOWN_INSURERS.items():
+        if keyword in lowered:
+            return insurer, 0.9
+    return None, 0.0
+
+def _find_provider(text):
+    match = PROVIDER_PATTERN.search(text)
+    if not match:
+        return None, 0.0
+    return " ".join(match.group(0).split())[:120], 0.6
+
+def _find_labelled(pattern, text, confidence):
+    match = pattern.search(text)
+    if not match:
+        return None, 0.0
+    value = match.group(1).split("\n")[0].strip(" .,:")
+    return (value, confidence) if value else (None, 0.0)
+
+FIELD_RULES = {
+    "patient_name": _find_name,
+    "policy_number": _find_policy,
+    "date_of_birth": lambda text: _find_date(DOB_PATTERN, text, 0.9),
+    "phone": _find_phone,
+    "email": _find_email,
+    "address": lambda text: _find_labelled(ADDRESS_PATTERN, text, 0.6),
+    # Free-text fields are kept as a fallback but never trusted enough to skip Gemini
+    "diagnosis": lambda text: _find_labelled(DIAGNOSIS_PATTERN, text, 0.5),
+    "treatment": lambda text: _find_labelled(TREATMENT_PATTERN, text, 0.5),
+    "service_date": lambda text: _find_date(SERVICE_DATE_PATTERN, text, 0.85),
+    "provider_name": _find_provider,
+    "claim_amount": _find_amount,
+    "insurance_company": _find_insurer,
+}
+
+# -------------------- ENTRY POINTS --------------------
+
+def pre_extract_fields(document_text):
+    """Returns (fields, confidences) for the full extraction schema; unfound fields are "Not found"."""
+    fields = {}
+    confidences = {}
+    for field in SCHEMA_FIELDS:
+        value, confidence = FIELD_RULES[field](document_text or "")
+        fields[field] = value if value else "Not found"
+        confidences[field] = round(confidence, 3)
+    return fields, confidences
+
+def missing_fields(confidences, threshold=LOCAL_CONFIDENCE_THRESHOLD):
+    return [field for field in SCHEMA_FIELDS if confidences.get(field, 0.0) < threshold]
+
+def merge_fields(local_fields, llm_fields, requested):
+    """Takes the model's answer for requested fields, keeping the local guess when the model found nothing."""
+    merged = dict(local_fields)
+    for field in requested:
+        value = (llm_fields or {}).get(field)
+        if value and value != "Not found":
+            merged[field] = value
+    return merged
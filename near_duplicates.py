@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Rescans of the same card or bill differ byte for byte but read as nearly the same
+# text. Each document's text gets a MinHash signature over character shingles; LSH
+# bands of the signature are indexed in SQLite, so a lookup only compares against the
+# few stored documents that share a band, however many are stored.
+
+# -------------------- CONFIGURATION --------------------
+
+DEFAULT_INDEX_PATH = os.getenv(
+    "NEAR_DUPLICATE_INDEX_PATH",
+    os.path.join(".cache", "near_duplicates.sqlite3")
+)
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", 0.75))
+DEFAULT_MAX_ENTRIES = int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", 500_000))
+# 20 bands of 6 rows: documents at 0.75 similarity share a band 98% of the time, at 0.5 only 27%
+NUM_PERMUTATIONS = 120
+BANDS = 20
+SHINGLE_CHARS = 4
+# Short shingles keep one OCR misread from changing too many of them; the prefix bounds the cost
+SIGNATURE_TEXT_LIMIT = 4000
+MIN_SHINGLES = 20
+
+_permutations = None
+
+# -------------------- SIGNATURES --------------------
+
+def permutations():
+    """Multiply-shift hash parameters: h -> ((a * h + b) mod 2^64) >> 32, with odd a. Seeded, so
+    signatures stay comparable across processes; numpy is imported here on first use."""
+    global _permutations
+    if _permutations is None:
+        import numpy as np
+
+        rng = np.random.default_rng(20240601)
+        a = rng.integers(0, 1 << 63, NUM_PERMUTATIONS, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        _permutations = (a, rng.integers(0, 1 << 63, NUM_PERMUTATIONS, dtype=np.uint64))
+    return _permutations
+
+def normalize_text(text):
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))[:SIGNATURE_TEXT_LIMIT]
+
+def shingle_hashes(text):
+    import numpy as np
+
+    normalized = normalize_text(text)
+    shingles = {normalized[start:start + SHINGLE_CHARS] for start in range(len(normalized) - SHINGLE_CHARS + 1)}
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big") for shingle in shingles],
+        dtype=np.uint64
+    )
+
+def minhash(text):
+    """MinHash signature as uint32s, or None for text too short to compare."""
+    import numpy as np
+
+    hashes = shingle_hashes(text)
+    if len(hashes) < MIN_SHINGLES:
+        return None
+    a, b = permutations()
+    with np.errstate(over="ignore"):
+        permuted = (a[:, None] * hashes[None, :] + b[:, None]) >> np.uint64(32)
+    return permuted.min(axis=1).astype(np.uint32)
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity of the two documents' shingle sets."""
+    return float((signature == other).sum()) / len(signature)
+
+def band_keys(signature):
+    rows = len(signature) // BANDS
+    keys = []
+    for band in range(BANDS):
+        digest = hashlib.blake2b(signature[band * rows:(band + 1) * rows].tobytes(), digest_size=8,
+                                 salt=band.to_bytes(8, "big")).digest()
+        keys.append(int.from_bytes(digest, "big", signed=True))
+    return keys
+
+# -------------------- SQLITE INDEX --------------------
+
+class NearDuplicateIndex:
+    """Stored extraction results looked up by text similarity rather than by exact file hash."""
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, threshold=NEAR_DUPLICATE_THRESHOLD, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                document_type TEXT NOT NULL,
+                file_name TEXT,
+                signature BLOB NOT NULL,
+                extracted_json TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS bands (
+                band_key INTEGER NOT NULL,
+                document_id INTEGER NOT NULL,
+                PRIMARY KEY (band_key, document_id)
+            ) WITHOUT ROWID
+        """)
+        self._conn.commit()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def find(self, document_text, document_type):
+        """The most similar stored document of the same type at or above the threshold, or None.
+
+        Returns {"document_id", "file_name", "similarity", "fields"}. A miss is counted here; a match
+        only counts once the caller accepts it with record_hit or turns it down with record_rejection.
+        """
+        import numpy as np
+
+        signature = minhash(document_text)
+        if signature is None:
+            return None
+        keys = band_keys(signature)
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT id, file_name, signature, extracted_json FROM documents
+                WHERE document_type = ? AND id IN (
+                    SELECT DISTINCT document_id FROM bands WHERE band_key IN ({",".join("?" * len(keys))})
+                )
+                """,
+                (document_type, *keys)
+            ).fetchall()
+        best = None
+        for document_id, file_name, stored, extracted_json in rows:
+            score = similarity(signature, np.frombuffer(stored, dtype=signature.dtype))
+            if score >= self.threshold and (best is None or score > best["similarity"]):
+                best = {"document_id": document_id, "file_name": file_name, "similarity": round(score, 3),
+                        "fields": json.loads(extracted_json)}
+        if best is None:
+            with self._lock:
+                self.misses += 1
+        return best
+
+    def record_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def record_rejection(self):
+        """A similar document that was not reused, e.g. another patient's bill on the same template."""
+        with self._lock:
+            self.misses += 1
+            self.rejected += 1
+
+    def add(self, document_text, document_type, extracted_data, file_name=None):
+        """Indexes a document's extraction result; returns its id, or None for text too short to index."""
+        signature = minhash(document_text)
+        if signature is None or not extracted_data:
+            return None
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO documents (document_type, file_name, signature, extracted_json, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (document_type, file_name, signature.tobytes(), json.dumps(extracted_data), time.time())
+            )
+            document_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO bands (band_key, document_id) VALUES (?, ?)",
+                [(key, document_id) for key in band_keys(signature)]
+            )
+            self._entries += 1
+            self._evict()
+            self._conn.commit()
+        return document_id
+
+    def _evict(self):
+        excess = self._entries - self.max_entries
+        if excess <= 0:
+            return
+        # Evict an extra 1% at a time; clearing the bands is a scan, so it should not happen on every add
+        excess += self.max_entries // 100
+        oldest = self._conn.execute("SELECT id FROM documents ORDER BY id LIMIT ?", (excess,)).fetchall()
+        self._conn.executemany("DELETE FROM documents WHERE id = ?", oldest)
+        self._conn.execute("DELETE FROM bands WHERE document_id <= ?", (oldest[-1][0],))
+        self._entries -= len(oldest)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM documents")
+            self._conn.execute("DELETE FROM bands")
+            self._conn.commit()
+            self._entries = 0
+            self.hits = 0
+            self.misses = 0
+            self.rejected = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "rejected": self.rejected,
+                "entries": self._entries,
+            }
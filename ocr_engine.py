@@ -0,0 +1,179 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from upload_spool import UploadTooLarge, open_source
+
+# -------------------- CONFIGURATION --------------------
+
+TARGET_DPI = int(os.getenv("OCR_TARGET_DPI", 300))
+OCR_LANGUAGES = os.getenv("OCR_LANGUAGES", "eng")
+OCR_POOL_WORKERS = int(os.getenv("OCR_POOL_WORKERS", min(os.cpu_count() or 1, 4)))
+# Decoded size ceiling; JPEGs are first decoded at reduced scale, anything else this large is refused
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 50_000_000))
+
+# Page segmentation mode (psm) and physical size per uploaded document type.
+# long_side_in is the length of the document's long edge in inches and sets the
+# pixel size the image is scaled down to for TARGET_DPI.
+OCR_PROFILES = {
+    "Insurance Card": {"psm": 11, "long_side_in": 3.375, "binarize": True, "auto_rotate": True},
+    "Medical Record": {"psm": 3, "long_side_in": 11.0, "binarize": True, "auto_rotate": False},
+    "Previous Claim": {"psm": 4, "long_side_in": 11.0, "binarize": True, "auto_rotate": False},
+    "Medical Bill": {"psm": 4, "long_side_in": 11.0, "binarize": True, "auto_rotate": False},
+    "Other": {"psm": 3, "long_side_in": 11.0, "binarize": False, "auto_rotate": False},
+}
+
+def get_profile(document_type):
+    return OCR_PROFILES.get(document_type, OCR_PROFILES["Other"])
+
+# -------------------- PREPROCESSING --------------------
+
+def _otsu_threshold(histogram):
+    """Grey level that best separates the ink and paper peaks of a 256-bin histogram."""
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+    background_count = 0
+    background_sum = 0
+    best_threshold = 127
+    best_variance = 0.0
+    for level, count in enumerate(histogram):
+        background_count += count
+        if background_count == 0:
+            continue
+        foreground_count = total - background_count
+        if foreground_count == 0:
+            break
+        background_sum += level * count
+        background_mean = background_sum / background_count
+        foreground_mean = (weighted_total - background_sum) / foreground_count
+        variance = background_count * foreground_count * (background_mean - foreground_mean) ** 2
+        if variance > best_variance:
+            best_variance = variance
+            best_threshold = level
+    return best_threshold
+
+def _auto_rotate(image):
+    import pytesseract
+
+    try:
+        osd = pytesseract.image_to_osd(image, output_type=pytesseract.Output.DICT)
+    except pytesseract.TesseractError:
+        # OSD needs a minimum amount of text; leave sparse images as they are
+        return image
+    rotate = osd.get("rotate", 0)
+    return image.rotate(-rotate, expand=True) if rotate else image
+
+def target_side(profile):
+    return int(profile["long_side_in"] * TARGET_DPI)
+
+def open_image(image_file, profile):
+    """Opens an image without decoding it yet, refusing ones over MAX_IMAGE_PIXELS."""
+    from PIL import Image
+
+    image = Image.open(image_file)
+    if image.format == "JPEG":
+        # Let the JPEG decoder skip detail we are about to throw away
+        side = target_side(profile)
+        image.draft("L", (side, side))
+    if image.width * image.height > MAX_IMAGE_PIXELS:
+        raise UploadTooLarge(f"Image is {image.width}x{image.height} pixels, over the {MAX_IMAGE_PIXELS:,} pixel limit")
+    return image
+
+def preprocess_image(image, profile):
+    """Orients, greyscales, scales to TARGET_DPI and optionally binarizes an image for Tesseract."""
+    from PIL import Image, ImageOps
+
+    side = target_side(profile)
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("L")
+    if max(image.size) > side:
+        image.thumbnail((side, side), Image.LANCZOS)
+    image = ImageOps.autocontrast(image)
+    if profile["auto_rotate"]:
+        image = _auto_rotate(image)
+    if profile["binarize"]:
+        threshold = _otsu_threshold(image.histogram())
+        image = image.point(lambda level: 255 if level > threshold else 0)
+    return image
+
+# -------------------- OCR --------------------
+
+def tesseract_config(profile):
+    return f"--oem 1 --psm {profile['psm']}"
+
+# pytesseract starts a tesseract process and loads its models for every image. When the
+# optional tesserocr package is installed, libtesseract is called in-process instead and
+# each thread keeps one loaded engine per (languages, psm), so pool workers pay that once.
+_engines = threading.local()
+
+def _tesserocr_engine(lang, psm):
+    """A loaded tesserocr engine for this thread, or None when tesserocr is not installed."""
+    try:
+        from tesserocr import OEM, PyTessBaseAPI
+    except ImportError:
+        return None
+    engines = _engines.__dict__.setdefault("by_config", {})
+    if (lang, psm) not in engines:
+        engines[(lang, psm)] = PyTessBaseAPI(lang=lang, psm=psm, oem=OEM.LSTM_ONLY)
+    return engines[(lang, psm)]
+
+def ocr_image(image_file, document_type="Other", lang=OCR_LANGUAGES):
+    """OCRs a file path, file-like object or PIL image with the tuning profile for `document_type`."""
+    # pytesseract pulls in pandas when it is installed; that is paid by the first OCR, not by startup
+    import pytesseract
+    from PIL import Image
+
+    profile = get_profile(document_type)
+    image = image_file if isinstance(image_file, Image.Image) else open_image(image_file, profile)
+    image = preprocess_image(image, profile)
+    engine = _tesserocr_engine(lang, profile["psm"])
+    if engine is not None:
+        engine.SetImage(image)
+        return engine.GetUTF8Text()
+    return pytesseract.image_to_string(image, lang=lang, config=tesseract_config(profile))
+
+def _ocr_source(image_source, document_type, lang):
+    with open_source(image_source) as image_file:
+        return ocr_image(image_file, document_type, lang)
+
+# -------------------- WORKER POOL --------------------
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_ocr_pool():
+    """Process pool kept alive across requests so workers start warm.
+
+    Workers are spawned rather than forked: the Streamlit and uvicorn processes are threaded, and a
+    forked child can inherit locks held by other threads.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=OCR_POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            atexit.register(_pool.shutdown, wait=False)
+        return _pool
+
+def _call(function, *args):
+    """Runs `function` in a pool worker. pytesseract's TesseractNotFoundError cannot be unpickled, and
+    an exception that fails to unpickle in the parent breaks the whole pool, so it is re-raised as text."""
+    import pytesseract
+
+    try:
+        return function(*args)
+    except pytesseract.TesseractNotFoundError as e:
+        raise RuntimeError(str(e)) from None
+
+def submit(function, *args):
+    """Runs a module-level function of picklable arguments on the pool."""
+    return get_ocr_pool().submit(_call, function, *args)
+
+def submit_ocr(image_source, document_type="Other", lang=OCR_LANGUAGES):
+    """OCRs image bytes or an image file path on the pool."""
+    return submit(_ocr_source, image_source, document_type, lang)
+
+def ocr_many(images, document_type="Other", lang=OCR_LANGUAGES):
+    """OCRs a list of image byte strings or paths on the pool, preserving order."""
+    futures = [submit_ocr(image_source, document_type, lang) for image_source in images]
+    return [future.result() for future in futures]
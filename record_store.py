@@ -0,0 +1,354 @@
+import difflib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from local_extractor import normalize_date
+
+# Patients seen before, so a returning patient's form can be filled from a search box
+# instead of a new upload. One row per patient (policy number plus name) holds the
+# latest known value of every extracted field; generated letters hang off it. Names,
+# policy numbers and insurers are indexed with an FTS5 trigram tokenizer, which gives
+# substring and prefix matches directly and typo-tolerant ones by ranking on shared
+# trigrams; policy numbers, names and birth dates also have plain B-tree indexes.
+
+# -------------------- CONFIGURATION --------------------
+
+RECORD_STORE_PATH = os.getenv("RECORD_STORE_PATH", os.path.join(".cache", "records.sqlite3"))
+RECORD_STORE_ENABLED = os.getenv("RECORD_STORE_ENABLED", "1") == "1"
+RECORD_RETENTION_DAYS = int(os.getenv("RECORD_RETENTION_DAYS", 365))
+RECORD_MAX_PATIENTS = int(os.getenv("RECORD_MAX_PATIENTS", 200_000))
+LETTERS_PER_PATIENT = int(os.getenv("RECORD_LETTERS_PER_PATIENT", 20))
+FUZZY_THRESHOLD = 0.6
+FUZZY_CANDIDATES = 50
+# Retention is enforced on open and then every this many writes
+RETENTION_CHECK_WRITES = 100
+
+# -------------------- KEYS --------------------
+
+def _known(value):
+    return value.strip() if isinstance(value, str) and value.strip() and value != "Not found" else ""
+
+def policy_key(value):
+    return re.sub(r"[^A-Z0-9]", "", value.upper())
+
+def name_key(value):
+    return " ".join(value.casefold().split())
+
+def _prefix_range(key):
+    """Bounds of the keys starting with `key`, for an index range scan."""
+    return key, key[:-1] + chr(ord(key[-1]) + 1)
+
+def _fts_phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+# -------------------- SQLITE STORE --------------------
+
+class RecordStore:
+    """Past extractions and letters, looked up by policy number, name, birth date or insurer."""
+
+    def __init__(self, path=RECORD_STORE_PATH, retention_days=RECORD_RETENTION_DAYS,
+                 max_patients=RECORD_MAX_PATIENTS):
+        self.path = path
+        self.retention_days = retention_days
+        self.max_patients = max_patients
+        self._writes = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS patients (
+                id INTEGER PRIMARY KEY,
+                policy_number TEXT NOT NULL,
+                policy_key TEXT NOT NULL,
+                patient_name TEXT NOT NULL,
+                name_key TEXT NOT NULL,
+                date_of_birth TEXT NOT NULL,
+                insurer TEXT NOT NULL,
+                fields_json TEXT NOT NULL,
+                file_name TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS patients_by_policy ON patients (policy_key, name_key);
+            CREATE INDEX IF NOT EXISTS patients_by_name ON patients (name_key);
+            CREATE INDEX IF NOT EXISTS patients_by_birth_date ON patients (date_of_birth);
+            CREATE INDEX IF NOT EXISTS patients_by_update ON patients (updated_at);
+            CREATE TABLE IF NOT EXISTS letters (
+                id INTEGER PRIMARY KEY,
+                patient_id INTEGER NOT NULL REFERENCES patients (id) ON DELETE CASCADE,
+                letter_type TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                UNIQUE (patient_id, created_at, letter_type)
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+                patient_name, policy_key, insurer, content='patients', content_rowid='id', tokenize='trigram'
+            );
+            CREATE TRIGGER IF NOT EXISTS patients_fts_insert AFTER INSERT ON patients BEGIN
+                INSERT INTO patients_fts (rowid, patient_name, policy_key, insurer)
+                VALUES (new.id, new.patient_name, new.policy_key, new.insurer);
+            END;
+            CREATE TRIGGER IF NOT EXISTS patients_fts_delete AFTER DELETE ON patients BEGIN
+                INSERT INTO patients_fts (patients_fts, rowid, patient_name, policy_key, insurer)
+                VALUES ('delete', old.id, old.patient_name, old.policy_key, old.insurer);
+            END;
+            CREATE TRIGGER IF NOT EXISTS patients_fts_update AFTER UPDATE ON patients BEGIN
+                INSERT INTO patients_fts (patients_fts, rowid, patient_name, policy_key, insurer)
+                VALUES ('delete', old.id, old.patient_name, old.policy_key, old.insurer);
+                INSERT INTO patients_fts (rowid, patient_name, policy_key, insurer)
+                VALUES (new.id, new.patient_name, new.policy_key, new.insurer);
+            END;
+        """)
+        with self._lock:
+            self._enforce_retention()
+            self._conn.commit()
+
+    # ---- writes ----
+
+    def _upsert(self, fields, file_name, now):
+        """Merges `fields` into the patient they name and returns its id, or None if they name no one."""
+        name = _known(fields.get("patient_name"))
+        policy = _known(fields.get("policy_number"))
+        if not name and not policy:
+            return None
+        date_of_birth = _known(fields.get("date_of_birth"))
+        date_of_birth = normalize_date(date_of_birth) or date_of_birth
+        if policy:
+            row = self._conn.execute(
+                "SELECT id, fields_json FROM patients WHERE policy_key = ? AND (? = '' OR name_key IN (?, '')) "
+                "ORDER BY name_key DESC, updated_at DESC LIMIT 1",
+                (policy_key(policy), name_key(name), name_key(name))
+            ).fetchone()
+        else:
+            # Without a policy number, only a known name with a matching (or unknown) birth date is the same patient
+            row = self._conn.execute(
+                "SELECT id, fields_json FROM patients WHERE name_key = ? AND date_of_birth IN (?, '') "
+                "ORDER BY updated_at DESC LIMIT 1",
+                (name_key(name), date_of_birth)
+            ).fetchone()
+        known = {field: value for field, value in fields.items() if _known(value)}
+        if date_of_birth:
+            known["date_of_birth"] = date_of_birth
+        merged = dict(json.loads(row[1]), **known) if row else known
+        values = (
+            merged.get("policy_number", ""), policy_key(merged.get("policy_number", "")),
+            merged.get("patient_name", ""), name_key(merged.get("patient_name", "")),
+            merged.get("date_of_birth", ""), merged.get("insurance_company", ""), json.dumps(merged),
+        )
+        if row:
+            self._conn.execute(
+                "UPDATE patients SET policy_number = ?, policy_key = ?, patient_name = ?, name_key = ?, "
+                "date_of_birth = ?, insurer = ?, fields_json = ?, file_name = COALESCE(?, file_name), "
+                "updated_at = ? WHERE id = ?",
+                (*values, file_name, now, row[0])
+            )
+            return row[0]
+        cursor = self._conn.execute(
+            "INSERT INTO patients (policy_number, policy_key, patient_name, name_key, date_of_birth, insurer, "
+            "fields_json, file_name, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (*values, file_name, now, now)
+        )
+        return cursor.lastrowid
+
+    def _add_letter(self, patient_id, letter_type, content, created_at):
+        self._conn.execute(
+            "INSERT OR IGNORE INTO letters (patient_id, letter_type, content, created_at) VALUES (?, ?, ?, ?)",
+            (patient_id, letter_type, content, created_at)
+        )
+        self._conn.execute(
+            "DELETE FROM letters WHERE patient_id = ? AND id NOT IN "
+            "(SELECT id FROM letters WHERE patient_id = ? ORDER BY created_at DESC LIMIT ?)",
+            (patient_id, patient_id, LETTERS_PER_PATIENT)
+        )
+
+    def _wrote(self):
+        self._writes += 1
+        if self._writes % RETENTION_CHECK_WRITES == 0:
+            self._enforce_retention()
+        self._conn.commit()
+
+    def save_extraction(self, fields, file_name=None):
+        """Stores an extraction's fields under its patient; returns the patient id or None."""
+        with self._lock:
+            patient_id = self._upsert(fields, file_name, time.time())
+            self._wrote()
+        return patient_id
+
+    def save_letter(self, fields, letter_type, content):
+        """Stores a generated letter under the patient `fields` name, updating their fields too."""
+        now = time.time()
+        with self._lock:
+            patient_id = self._upsert(fields, None, now)
+            if patient_id is not None:
+                self._add_letter(patient_id, letter_type, content, now)
+            self._wrote()
+        return patient_id
+
+    def delete(self, patient_id):
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM patients WHERE id = ?", (patient_id,))
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+    def _enforce_retention(self):
+        """Drops patients not updated for retention_days, then the least recently updated past max_patients."""
+        if self.retention_days:
+            self._conn.execute("DELETE FROM patients WHERE updated_at < ?",
+                               (time.time() - self.retention_days * 86400,))
+        excess = self._conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0] - self.max_patients
+        if self.max_patients and excess > 0:
+            self._conn.execute(
+                "DELETE FROM patients WHERE id IN (SELECT id FROM patients ORDER BY updated_at LIMIT ?)", (excess,)
+            )
+
+    # ---- lookups ----
+
+    def search(self, query, limit=10):
+        """Patients matching `query` as a birth date, a policy number or name prefix, a substring of a
+        name, policy number or insurer, or failing those a near spelling of one.
+
+        Returns up to `limit` summaries, best match first: {"id", "patient_name", "policy_number",
+        "date_of_birth", "insurer", "updated_at", "match"}.
+        """
+        query = query.strip()
+        if len(query) < 2:
+            return []
+        found = {}
+
+        def add(rows, match, rank):
+            for row in rows:
+                if row[0] not in found or found[row[0]][0] > rank:
+                    found[row[0]] = (rank, match, row)
+
+        columns = "id, patient_name, policy_number, date_of_birth, insurer, updated_at"
+        with self._lock:
+            date_of_birth = normalize_date(query)
+            if date_of_birth:
+                add(self._conn.execute(f"SELECT {columns} FROM patients WHERE date_of_birth = ? LIMIT ?",
+                                       (date_of_birth, limit)), "date of birth", 0)
+            key = policy_key(query)
+            if key:
+                add(self._conn.execute(
+                    f"SELECT {columns} FROM patients WHERE policy_key >= ? AND policy_key < ? LIMIT ?",
+                    (*_prefix_range(key), limit)
+                ), "policy number", 0 if any(character.isdigit() for character in key) else 1)
+            add(self._conn.execute(
+                f"SELECT {columns} FROM patients WHERE name_key >= ? AND name_key < ? LIMIT ?",
+                (*_prefix_range(name_key(query)), limit)
+            ), "name", 1)
+            if len(found) < limit and len(query) >= 3:
+                # Trigram phrases match anywhere in the column, so this also covers surname and infix searches
+                terms = {_fts_phrase(query)} | ({_fts_phrase(key)} if len(key) >= 3 else set())
+                add(self._fts(columns, " OR ".join(terms), limit), "contains", 2)
+            if len(found) < limit and len(query) >= 3:
+                self._add_fuzzy(query, columns, limit, add)
+        ranked = sorted(found.values(), key=lambda item: (item[0], -item[2][5]))[:limit]
+        return [
+            {"id": row[0], "patient_name": row[1], "policy_number": row[2], "date_of_birth": row[3],
+             "insurer": row[4], "updated_at": row[5], "match": match}
+            for _, match, row in ranked
+        ]
+
+    def _fts(self, columns, expression, limit):
+        return self._conn.execute(
+            f"SELECT {columns} FROM patients WHERE id IN "
+            "(SELECT rowid FROM patients_fts WHERE patients_fts MATCH ? ORDER BY rank LIMIT ?)",
+            (expression, limit)
+        ).fetchall()
+
+    def _add_fuzzy(self, query, columns, limit, add):
+        """Ranks candidates sharing any trigram with the query by spelling similarity."""
+        lowered = name_key(query)
+        trigrams = {lowered[start:start + 3] for start in range(len(lowered) - 2)}
+        trigrams = [_fts_phrase(trigram) for trigram in trigrams if trigram.strip() == trigram]
+        if not trigrams:
+            return
+        scored = []
+        for row in self._fts(columns, " OR ".join(trigrams), FUZZY_CANDIDATES):
+            # Compared whole, word by word and cut to the query's length, so "rajsh" is close to "Rajesh Kumar"
+            spellings = set()
+            for value in (row[1], row[2], row[4]):
+                value = name_key(value)
+                spellings.update([value, value[:len(lowered)], *value.split()])
+            score = max(difflib.SequenceMatcher(None, lowered, spelling).ratio() for spelling in spellings if spelling)
+            if score >= FUZZY_THRESHOLD:
+                scored.append((score, row))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        add([row for _, row in scored[:limit]], "similar", 3)
+
+    def get(self, patient_id):
+        """A patient's stored fields and letters, newest letter first, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fields_json, file_name, created_at, updated_at FROM patients WHERE id = ?", (patient_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            letters = self._conn.execute(
+                "SELECT letter_type, content, created_at FROM letters WHERE patient_id = ? ORDER BY created_at DESC",
+                (patient_id,)
+            ).fetchall()
+        return {
+            "id": patient_id, "fields": json.loads(row[0]), "file_name": row[1], "created_at": row[2],
+            "updated_at": row[3],
+            "letters": [{"letter_type": letter_type, "content": content, "created_at": created_at}
+                        for letter_type, content, created_at in letters],
+        }
+
+    # ---- bulk import and export ----
+
+    def export_lines(self):
+        """Every patient with their letters as JSON lines, oldest first."""
+        with self._lock:
+            ids = [row[0] for row in self._conn.execute("SELECT id FROM patients ORDER BY id")]
+        for patient_id in ids:
+            record = self.get(patient_id)
+            if record:
+                del record["id"]
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+
+    def import_lines(self, lines):
+        """Loads export_lines() output in one transaction; returns the number of patients imported.
+
+        Records merge into existing patients as new extractions would, and letters already present are skipped.
+        """
+        count = 0
+        with self._lock:
+            try:
+                for line in lines:
+                    if isinstance(line, bytes):
+                        line = line.decode("utf-8")
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    patient_id = self._upsert(record["fields"], record.get("file_name"),
+                                              record.get("updated_at") or time.time())
+                    if patient_id is None:
+                        continue
+                    for letter in record.get("letters", []):
+                        self._add_letter(patient_id, letter["letter_type"], letter["content"], letter["created_at"])
+                    count += 1
+                self._enforce_retention()
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return count
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM patients")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            patients = self._conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0]
+            letters = self._conn.execute("SELECT COUNT(*) FROM letters").fetchone()[0]
+        return {"patients": patients, "letters": letters, "retention_days": self.retention_days}
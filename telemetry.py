@@ -0,0 +1,203 @@
+import contextvars
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+# Lightweight instrumentation: span timers feed latency histograms and, inside a
+# trace, a per-request waterfall; counters and collectors cover tokens, caches and
+# retries. Everything renders as Prometheus text. When opentelemetry is installed,
+# spans are mirrored to its tracer so any configured exporter picks them up.
+
+# -------------------- CONFIGURATION --------------------
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_collectors = []
+_current_trace = contextvars.ContextVar("docgen_trace", default=None)
+_depth = contextvars.ContextVar("docgen_span_depth", default=0)
+_tracer = otel_trace.get_tracer("docgen") if otel_trace else None
+
+# -------------------- METRICS --------------------
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def increment(name, value=1, **labels):
+    with _lock:
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, seconds, **labels):
+    with _lock:
+        key = _key(name, labels)
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][index] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+def register_collector(collector):
+    """`collector()` returns (name, labels, value) samples read at scrape time, e.g. cache hit rates.
+
+    Names ending in _total are exposed as counters, the rest as gauges.
+    """
+    _collectors.append(collector)
+
+def record_usage(response, stage):
+    """Adds a Gemini response's usage_metadata token counts to the token counters."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    increment("docgen_llm_tokens_total", prompt_tokens, stage=stage, kind="prompt")
+    increment("docgen_llm_tokens_total", output_tokens, stage=stage, kind="output")
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.tokens[stage] = trace.tokens.get(stage, 0) + prompt_tokens + output_tokens
+
+# -------------------- SPANS AND TRACES --------------------
+
+class Trace:
+    """Spans recorded while handling one request, with start offsets for a waterfall."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = []
+        self.tokens = {}
+        self.duration = None
+
+    def add(self, name, started, duration, error=None, depth=0):
+        self.spans.append({
+            "span": name,
+            "depth": depth,
+            "start_ms": round(1000 * (started - self.started), 2),
+            "duration_ms": round(1000 * duration, 2),
+            "error": error,
+        })
+
+@contextmanager
+def start_trace(name):
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+    try:
+        with span(name):
+            yield trace
+    finally:
+        trace.duration = time.perf_counter() - trace.started
+        _current_trace.reset(token)
+
+@contextmanager
+def span(name, **attributes):
+    """Times a block into docgen_span_duration_seconds and the current trace; errors are counted and re-raised."""
+    started = time.perf_counter()
+    depth = _depth.get()
+    depth_token = _depth.set(depth + 1)
+    otel_span = _tracer.start_as_current_span(name, attributes=attributes) if _tracer else None
+    error = None
+    try:
+        if otel_span is not None:
+            with otel_span:
+                yield
+        else:
+            yield
+    except Exception as e:
+        error = type(e).__name__
+        increment("docgen_span_errors_total", span=name, error=error)
+        raise
+    finally:
+        _depth.reset(depth_token)
+        duration = time.perf_counter() - started
+        observe("docgen_span_duration_seconds", duration, span=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, started, duration, error, depth)
+
+def traced(name=None):
+    """Decorator form of span(), named after the function by default."""
+    def decorate(function):
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+# -------------------- EXPOSITION --------------------
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        histograms = {key: dict(value, buckets=list(value["buckets"])) for key, value in _histograms.items()}
+        counters = dict(_counters)
+    typed = set()
+    for (name, labels), histogram in sorted(histograms.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+            lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {count}")
+        lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+        lines.append(f"{name}_sum{_labels(labels)} {histogram['sum']:.6f}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram['count']}")
+    for (name, labels), value in sorted(counters.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_labels(labels)} {value}")
+    samples = []
+    for collector in _collectors:
+        samples.extend(collector())
+    for name, labels, value in sorted(samples, key=lambda sample: (sample[0], sorted(sample[1].items()))):
+        if name not in typed:
+            lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+            typed.add(name)
+        lines.append(f"{name}{_labels(sorted(labels.items()))} {value}")
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serves /metrics on `port` from a daemon thread, for processes without their own HTTP server."""
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,19 @@
+import os
+import sys
+import tempfile
+
+# The modules live flat at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Caches and stores read their paths when first imported; keep every test run off the real .cache
+_cache_dir = tempfile.mkdtemp(prefix="docgen-tests-")
+for _name, _value in {
+    "LLM_BACKEND": "mock",
+    "MOCK_LLM_LATENCY_SECONDS": "0",
+    "MOCK_LLM_JITTER_SECONDS": "0",
+    "RECORD_STORE_ENABLED": "0",
+    "EXTRACTION_CACHE_PATH": os.path.join(_cache_dir, "extraction.sqlite3"),
+    "GENERATION_CACHE_PATH": os.path.join(_cache_dir, "generation.sqlite3"),
+    "NEAR_DUPLICATE_INDEX_PATH": os.path.join(_cache_dir, "near_duplicates.sqlite3"),
+}.items():
+    os.environ.setdefault(_name, _value)
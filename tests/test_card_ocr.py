@@ -0,0 +1,18 @@
+from card_ocr import extract_card_fields
+
+def lines(*texts):
+    return [{"text": text, "confidence": 0.95, "box": (0.05, 0.1 * index, 0.9, 0.1 * index + 0.08)}
+            for index, text in enumerate(texts, start=1)]
+
+def test_hospital_uhid_is_not_read_as_the_policy_number():
+    fields, _, template = extract_card_fields(lines("UHID No: 7788990", "Policy No: SH-2024-889911",
+                                                    "Name: Rajesh Kumar"))
+    assert template == "generic"
+    assert fields["policy_number"] == "SH-2024-889911"
+
+def test_icici_lombard_uhid_is_the_member_id():
+    fields, _, template = extract_card_fields(lines("ICICI Lombard Health Card", "UHID: ILHC7788990",
+                                                    "Name: Rajesh Kumar"))
+    assert template == "icici_lombard"
+    assert fields["policy_number"] == "ILHC7788990"
+    assert fields["insurance_company"] == "ICICI Lombard General Insurance"
@@ -0,0 +1,31 @@
+from chunked_extraction import merge_chunk_fields, split_into_chunks
+
+def test_chunks_respect_budget_and_overlap():
+    text = "\n".join(f"line {number:04d}" for number in range(400))
+    chunks = split_into_chunks(text, max_tokens=100, overlap_lines=2)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 400 for chunk in chunks)
+    assert chunks[1].splitlines()[:2] == chunks[0].splitlines()[-2:]
+
+def test_majority_wins_and_spellings_count_together():
+    merged, agreement = merge_chunk_fields(
+        [("a", {"policy_number": "sh-123 456"}), ("b", {"policy_number": "SH123456"}), ("c", {"policy_number": "X9"})],
+        ["policy_number", "patient_name"],
+    )
+    assert merged == {"policy_number": "sh-123 456", "patient_name": "Not found"}
+    assert agreement["policy_number"] == round(2 / 3, 3)
+
+def test_total_line_beats_other_amounts():
+    merged, _ = merge_chunk_fields(
+        [("Room rent 1,200", {"claim_amount": "1200"}), ("Grand Total: 4,500", {"claim_amount": "4500"}),
+         ("Pharmacy 1,200", {"claim_amount": "1200"})],
+        ["claim_amount"],
+    )
+    assert merged["claim_amount"] == "4500"
+
+def test_non_string_values_are_voted_as_text():
+    merged, _ = merge_chunk_fields(
+        [("Total: 4500", {"claim_amount": 4500, "policy_number": 12345678}), ("b", None)],
+        ["claim_amount", "policy_number"],
+    )
+    assert merged == {"claim_amount": "4500", "policy_number": "12345678"}
@@ -0,0 +1,52 @@
+import io
+import zipfile
+from docx_renderer import PAGE_BREAK, parse_blocks, render_letter_docx, render_merged_docx, render_zip
+from letter_templates import render_letter, slot_descriptions
+
+PATIENT = {"name": "Rajesh Kumar", "policy_number": "SH-2024-889911", "dob": "1972-03-05", "contact": ""}
+CLAIM = {"service_date": "2024-03-12", "diagnosis": "Appendicitis", "treatment": "Appendectomy",
+         "amount": "₹4,500.00", "reason": "Emergency surgery"}
+
+def part(docx, name="word/document.xml"):
+    with zipfile.ZipFile(io.BytesIO(docx)) as archive:
+        return archive.read(name).decode("utf-8")
+
+def test_parse_blocks_splits_headings_lists_and_paragraphs():
+    content = "# Claim\nDear Sir,\nplease see below.\n\n- Bill\n2. Report\n---\nThanks"
+    assert parse_blocks(content) == [
+        ("Heading1", ["Claim"]),
+        (None, ["Dear Sir,", "please see below."]),
+        ("ListBullet", ["Bill"]),
+        ("ListNumber", ["Report"]),
+        (None, ["Thanks"]),
+    ]
+
+def test_templated_letter_has_one_date_and_opens_in_word():
+    from docx import Document
+
+    letter_type = "Insurance Claim Letter"
+    slots = {slot: f"{slot} text." for slot in slot_descriptions(letter_type)}
+    docx = render_letter_docx(render_letter(letter_type, PATIENT, CLAIM, slots), letter_type, "Rajesh Kumar")
+    assert part(docx).count("Date:") == 1
+    paragraphs = [paragraph.text for paragraph in Document(io.BytesIO(docx)).paragraphs]
+    assert paragraphs[0] == letter_type
+    assert any("Rajesh Kumar" in text for text in paragraphs)
+
+def test_letter_text_is_escaped_and_marked_up():
+    docx = render_letter_docx("**Total** R&D <fee> C:\\1 *net*\x07", "Appeal", "A & B")
+    document = part(docx)
+    assert "<w:b/>" in document and "<w:i/>" in document
+    assert "R&amp;D &lt;fee&gt; C:\\1" in document
+    assert "\x07" not in document
+    assert "Appeal - A &amp; B" in part(docx, "word/header1.xml")
+
+def test_merged_letters_start_on_new_pages():
+    letters = [("First letter.", "Appeal", "A"), ("Second letter.", "Appeal", "B"), ("Third.", "Appeal", "C")]
+    assert part(render_merged_docx(letters)).count(PAGE_BREAK) == 2
+
+def test_zip_names_are_unique():
+    letters = [("One.", "Appeal", "Rajesh Kumar"), ("Two.", "Appeal", "Rajesh Kumar")]
+    with zipfile.ZipFile(io.BytesIO(render_zip(letters))) as archive:
+        names = archive.namelist()
+    assert len(set(names)) == 2
+    assert names[1].endswith("_2.docx")
@@ -0,0 +1,53 @@
+import time
+import pytest
+from generation_cache import GenerationCache, make_generation_key
+
+PATIENT = {"name": "Rajesh Kumar", "policy_number": "SH-2024-889911"}
+CLAIM = {"amount": "₹4,500.00", "diagnosis": "Appendicitis"}
+
+def key(patient=PATIENT, claim=CLAIM, mode="template"):
+    return make_generation_key(mode, "Insurance Claim Letter", patient, claim, {"temperature": 0.2})
+
+@pytest.fixture
+def cache(tmp_path):
+    return GenerationCache(str(tmp_path / "generation.sqlite3"), memory_entries=2, disk_entries=3, ttl_seconds=60)
+
+def test_keys_ignore_whitespace_unicode_form_and_order():
+    reordered = {"policy_number": "SH-2024-889911", "name": "Rajesh  Kumar "}
+    assert key(reordered, {"diagnosis": "Appendicitis", "amount": "₹4,500.00"}) == key()
+    # NFKC folds the full-width digit
+    assert key(claim={**CLAIM, "amount": "₹４,500.00"}) == key()
+
+def test_keys_change_with_content_case_and_mode():
+    assert key(claim={**CLAIM, "amount": "₹5,500.00"}) != key()
+    assert key({**PATIENT, "name": "RAJESH KUMAR"}) != key()
+    assert key(mode="full") != key()
+
+def test_memory_tier_is_lru_and_disk_tier_serves_evicted_entries(cache):
+    for name in ("a", "b", "c"):
+        cache.put(name, f"letter {name}")
+    assert cache.get("a") == "letter a"
+    assert cache.get("c") == "letter c"
+    stats = cache.stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["memory_entries"]) == (1, 1, 2)
+
+def test_disk_tier_keeps_the_most_recently_used(cache):
+    for name in ("a", "b", "c", "d"):
+        cache.put(name, f"letter {name}")
+    assert cache.stats()["disk_entries"] == 3
+    reopened = GenerationCache(cache.path, disk_entries=3, ttl_seconds=60)
+    assert reopened.get("a") is None
+    assert reopened.get("d") == "letter d"
+
+def test_entries_expire_after_the_ttl(cache, monkeypatch):
+    cache.put("a", "letter a")
+    later = time.time() + 61
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert cache.get("a") is None
+    assert cache.stats()["misses"] == 1
+
+def test_invalidate_drops_both_tiers(cache):
+    cache.put("a", "letter a")
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    assert GenerationCache(cache.path).get("a") is None
@@ -0,0 +1,135 @@
+import time
+import pytest
+import job_queue
+from job_queue import JOB_MAX_ATTEMPTS, JobQueue
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), str(tmp_path / "files"),
+                    stage_concurrency={"extract": 1, "generate": 1, "render": 1})
+
+def expire_lease(queue, job_id):
+    queue._conn.execute("UPDATE jobs SET lease_until = 0 WHERE id = ?", (job_id,))
+
+def test_stages_run_in_order_and_are_checkpointed(queue):
+    job_id = queue.submit("letter", b"%PDF", "a.pdf", {"letter_type": "Appeal Letter"})
+    for stage in ("extract", "generate", "render"):
+        job = queue.claim("w1")
+        assert (job["id"], job["stage"]) == (job_id, stage)
+        assert queue.checkpoint(job, "w1", {"stage": stage})
+    job = queue.get(job_id)
+    assert job["status"] == "done"
+    assert set(job["results"]) == {"extract", "generate", "render"}
+
+def test_retryable_failures_requeue_until_attempts_run_out(queue):
+    job_id = queue.submit("extract", b"%PDF", "a.pdf", {})
+    for attempt in range(1, JOB_MAX_ATTEMPTS + 1):
+        job = queue.claim("w1")
+        assert job["attempts"] == attempt
+        queue.fail(job, "w1", "timeout", retry=True)
+    assert queue.get(job_id)["status"] == "failed"
+    assert queue.claim("w1") is None
+
+def test_permanent_failure_is_not_retried(queue):
+    job_id = queue.submit("extract", b"%PDF", "a.pdf", {})
+    queue.fail(queue.claim("w1"), "w1", "No text found in the document")
+    assert queue.get(job_id)["status"] == "failed"
+
+def test_expired_lease_is_taken_over_and_late_checkpoint_dropped(queue):
+    job_id = queue.submit("extract", b"%PDF", "a.pdf", {})
+    stale = queue.claim("dead")
+    assert queue.claim("w2") is None  # extract concurrency is 1 and the lease is live
+    expire_lease(queue, job_id)
+    job = queue.claim("w2")
+    assert (job["id"], job["attempts"]) == (job_id, 2)
+    assert not queue.checkpoint(stale, "dead", {"fields": {}})
+    assert queue.checkpoint(job, "w2", {"fields": {}})
+    assert queue.get(job_id)["status"] == "done"
+
+def test_worker_dying_every_attempt_fails_the_job(queue):
+    job_id = queue.submit("extract", b"%PDF", "a.pdf", {})
+    for _ in range(JOB_MAX_ATTEMPTS):
+        assert queue.claim("dead")["id"] == job_id
+        expire_lease(queue, job_id)
+    assert queue.claim("w2") is None
+    job = queue.get(job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == f"Worker stopped {JOB_MAX_ATTEMPTS} times"
+
+def test_higher_priority_is_claimed_first(queue):
+    queue.submit("extract", b"%PDF", "low.pdf", {})
+    urgent = queue.submit("extract", b"%PDF", "urgent.pdf", {}, priority=5)
+    assert queue.claim("w1")["id"] == urgent
+
+def test_run_next_does_not_retry_document_errors(queue, monkeypatch):
+    def bad_document(job, files_dir):
+        raise job_queue.DocGenError("No text found in the document")
+
+    monkeypatch.setitem(job_queue.STAGE_RUNNERS, "extract", bad_document)
+    job_id = queue.submit("extract", b"%PDF", "a.pdf", {})
+    assert queue.run_next("w1")
+    job = queue.get(job_id)
+    assert (job["status"], job["error"]) == ("failed", "No text found in the document")
+
+@pytest.fixture
+def worker_env(tmp_path, monkeypatch):
+    """Queue and cache paths for spawned workers, which read them from the environment."""
+    paths = {
+        "JOB_QUEUE_PATH": str(tmp_path / "jobs.sqlite3"),
+        "JOB_FILES_DIR": str(tmp_path / "files"),
+        "EXTRACTION_CACHE_PATH": str(tmp_path / "extraction.sqlite3"),
+        "NEAR_DUPLICATE_INDEX_PATH": str(tmp_path / "near_duplicates.sqlite3"),
+        "RECORD_STORE_ENABLED": "0",
+        "LLM_BACKEND": "mock",
+        # Enough to take the process-pool path for PDFs of PARALLEL_PAGE_THRESHOLD pages or more
+        "PDF_PAGE_WORKERS": "2",
+    }
+    for name, value in paths.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(job_queue, "JOB_QUEUE_PATH", paths["JOB_QUEUE_PATH"])
+    monkeypatch.setattr(job_queue, "JOB_FILES_DIR", paths["JOB_FILES_DIR"])
+    yield JobQueue(paths["JOB_QUEUE_PATH"], paths["JOB_FILES_DIR"])
+    job_queue.stop_workers()
+
+def test_worker_extracts_a_large_pdf_with_a_page_pool(worker_env):
+    from benchmarks.corpus import text_pdf
+    from text_extraction import PARALLEL_PAGE_THRESHOLD
+
+    pages = [["Patient Name: Rajesh Kumar", f"Page {number} of the discharge summary"]
+             for number in range(PARALLEL_PAGE_THRESHOLD + 4)]
+    job_id = worker_env.submit("extract", text_pdf(pages), "summary.pdf", {"offline": True, "chunked": True})
+    job_queue.ensure_workers(1)
+    deadline = time.time() + 120
+    while worker_env.get(job_id)["status"] in job_queue.ACTIVE_STATUSES and time.time() < deadline:
+        time.sleep(0.2)
+    job = worker_env.get(job_id)
+    assert (job["status"], job["error"]) == ("done", None)
+    assert job["results"]["extract"]["fields"]["patient_name"] == "Rajesh Kumar"
+
+def test_workers_and_app_split_the_rate_limit(monkeypatch):
+    import docgen_core
+
+    started = []
+
+    class FakeProcess:
+        def __init__(self, target, args, name):
+            self.args = args
+
+        def start(self):
+            started.append(self.args)
+
+        def is_alive(self):
+            return True
+
+    context = type("Context", (), {"Process": FakeProcess})
+    monkeypatch.setattr(job_queue.multiprocessing, "get_context", lambda method: context)
+    monkeypatch.setattr(job_queue, "_workers", [])
+    client = docgen_core.get_gemini_client()
+    full_rate = docgen_core.BACKEND_REQUESTS_PER_MINUTE["mock"] / 60.0
+    try:
+        job_queue.ensure_workers(2)
+        assert [args[-1] for args in started] == [3, 3]
+        assert client._bucket.rate == pytest.approx(full_rate / 3)
+    finally:
+        docgen_core.share_rate_limit(1)
+    assert client._bucket.rate == pytest.approx(full_rate)
@@ -0,0 +1,43 @@
+import pytest
+from json_repair import repair_json, repair_json_array
+
+def test_clean_json_is_not_marked_repaired():
+    assert repair_json('{"patient_name": "A"}') == ({"patient_name": "A"}, False)
+
+@pytest.mark.parametrize("text", [
+    '```json\n{"patient_name": "A", "policy_number": "P1",}\n```',
+    "{'patient_name': 'A', 'policy_number': 'P1'}",
+    '{"patient_name": "A", "policy_number": "P1"',
+    'Here you go: {patient_name: "A", policy_number: "P1"} hope it helps',
+])
+def test_common_breakage_is_repaired(text):
+    data, repaired = repair_json(text)
+    assert data == {"patient_name": "A", "policy_number": "P1"}
+    assert repaired
+
+def test_non_json_returns_none():
+    assert repair_json("no braces here") == (None, False)
+    assert repair_json("") == (None, False)
+
+def test_array_items_are_repaired_one_by_one():
+    items, repaired = repair_json_array('[{"document_id": "1", "a": "x"}, {"document_id": "2", "a": "y",}, {"docu')
+    assert [item["document_id"] for item in items] == ["1", "2"]
+    assert repaired
+    assert repair_json_array('[{"document_id": "1"}]') == ([{"document_id": "1"}], False)
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"patient_name": "A", "claim_amount": "45', {"patient_name": "A"}),
+    ('{"patient_name": "A", "claim_amount": 45', {"patient_name": "A"}),
+    ('{"patient_name": "A", "claim_amount":', {"patient_name": "A"}),
+    ('{"patient_name": "A", "claim', {"patient_name": "A"}),
+    ('{"patient_name": "A", "policy_number": "P1",', {"patient_name": "A", "policy_number": "P1"}),
+    ('{"patient_name": "A", "address": {"city": "Pune", "pin": "4110',
+     {"patient_name": "A", "address": {"city": "Pune"}}),
+])
+def test_value_cut_off_by_the_token_limit_is_dropped(text, expected):
+    assert repair_json(text) == (expected, True)
+
+def test_cut_off_only_field_is_not_recovered_by_line_parsing():
+    from docgen_core import parse_extraction_response
+
+    assert parse_extraction_response('{"claim_amount": "45') == {}
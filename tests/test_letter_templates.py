@@ -0,0 +1,39 @@
+import docgen_core
+from docgen_core import LETTER_TYPES, generate_templated_content, get_generation_cache, generation_cache_key
+from letter_templates import has_template, render_letter, slot_descriptions
+
+PATIENT = {"name": "Rajesh Kumar", "policy_number": "SH-2024-889911", "dob": "1972-03-05", "contact": ""}
+SLOTS = {"statement": "Statement.", "justification": "Justification.", "requested_action": "Action."}
+
+def claim(amount):
+    return {"service_date": "2024-03-12", "diagnosis": "Appendicitis", "treatment": "Appendectomy",
+            "amount": amount, "reason": "Emergency surgery"}
+
+def test_every_letter_type_renders_without_a_date_line():
+    # The .docx renderer prints the date under the title
+    for letter_type in LETTER_TYPES:
+        if has_template(letter_type):
+            slots = {slot: f"{slot} text." for slot in slot_descriptions(letter_type)}
+            content = render_letter(letter_type, PATIENT, claim("₹4,500.00"), slots)
+            assert not any(line.startswith("Date:") for line in content.splitlines())
+            assert "Rajesh Kumar" in content
+
+def test_unknown_amount_is_left_out_of_the_subject():
+    for letter_type in ("Insurance Claim Letter", "Reimbursement Claim"):
+        subject = next(line for line in render_letter(letter_type, PATIENT, claim("Not specified"), SLOTS).splitlines()
+                       if line.startswith("Subject:"))
+        assert "Not specified" not in subject
+        subject = next(line for line in render_letter(letter_type, PATIENT, claim("₹4,500.00"), SLOTS).splitlines()
+                       if line.startswith("Subject:"))
+        assert "₹4,500.00" in subject
+
+def test_cached_letters_are_not_reused_across_prompt_versions(monkeypatch):
+    letter_type = "Insurance Claim Letter"
+    key = generation_cache_key("template", letter_type, PATIENT, claim("₹4,500.00"),
+                               docgen_core.SLOT_GENERATION_PARAMS)
+    get_generation_cache().put(key, "Date: yesterday's layout\n")
+    assert generate_templated_content(letter_type, PATIENT, claim("₹4,500.00")) == "Date: yesterday's layout\n"
+    monkeypatch.setattr(docgen_core, "GENERATION_PROMPT_VERSION", docgen_core.GENERATION_PROMPT_VERSION + "-next")
+    content = generate_templated_content(letter_type, PATIENT, claim("₹4,500.00"))
+    assert content != "Date: yesterday's layout\n"
+    assert "Subject: Claim for Reimbursement of ₹4,500.00" in content
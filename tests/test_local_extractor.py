@@ -0,0 +1,54 @@
+import pytest
+from local_extractor import LOCAL_CONFIDENCE_THRESHOLD, missing_fields, normalize_date, pre_extract_fields
+
+def field(text, name):
+    fields, confidences = pre_extract_fields(text)
+    return fields[name], confidences[name]
+
+@pytest.mark.parametrize("text, name", [
+    ("Patient Name: Rajesh Kumar Age: 45", "Rajesh Kumar"),
+    ("Patient Name: Sunita Devi Date Of Birth: 01/02/1980", "Sunita Devi"),
+    ("Patient Name: Mr. Anil Sharma UHID: 1234567", "Mr. Anil Sharma"),
+    ("Patient Name: Rajesh Kumar    Ward 4", "Rajesh Kumar"),
+])
+def test_name_stops_at_next_label_and_is_not_trusted(text, name):
+    value, confidence = field(text, "patient_name")
+    assert value == name
+    assert confidence < LOCAL_CONFIDENCE_THRESHOLD
+
+def test_name_alone_on_its_line_is_trusted():
+    value, confidence = field("Name of the patient - SMT. KAMLA BAI\nAge: 61", "patient_name")
+    assert value == "Smt. Kamla Bai"
+    assert confidence >= LOCAL_CONFIDENCE_THRESHOLD
+    assert "patient_name" not in missing_fields(pre_extract_fields("Patient Name: Kamla Bai\n")[1])
+
+def test_subtotal_is_not_a_total():
+    assert field("Subtotal: 500\n", "claim_amount") == ("Not found", 0.0)
+    assert field("Subtotal: 500\nGrand Total: Rs. 1,700.50\n", "claim_amount")[0] == "1700.50"
+
+def test_uhid_is_not_a_policy_number():
+    assert field("UHID: 12345678\n", "policy_number") == ("Not found", 0.0)
+    assert field("UHID: 12345678\nPolicy No: sh-2024/889911\n", "policy_number")[0] == "SH-2024/889911"
+
+def test_dates_and_contacts():
+    text = "DOB: 05-Mar-1972\nMobile: +91 98765 43210\nEmail: a.b@example.com\n"
+    assert field(text, "date_of_birth")[0] == "1972-03-05"
+    assert field(text, "phone")[0] == "9876543210"
+    assert field(text, "email")[0] == "a.b@example.com"
+    assert normalize_date("31/12/99") == "1999-12-31"
+    assert normalize_date("not a date") is None
+
+def test_cached_extractions_are_not_reused_across_prompt_versions(monkeypatch):
+    import docgen_core
+    from benchmarks.corpus import text_pdf
+    from extraction_cache import make_cache_key
+
+    upload = text_pdf([["Patient Name: Rajesh Kumar", "Age: 45"]])
+    stale = {"patient_name": "Rajesh Kumar Age"}
+    monkeypatch.setattr(docgen_core, "EXTRACTION_PROMPT_VERSION", "old")
+    docgen_core.get_extraction_cache().put(make_cache_key(upload, "Other", "old", ""), "", stale)
+    assert docgen_core.extract_document(upload, "a.pdf", offline=True)["fields"] == stale
+    monkeypatch.setattr(docgen_core, "EXTRACTION_PROMPT_VERSION", "new")
+    extraction = docgen_core.extract_document(upload, "a.pdf", offline=True)
+    assert extraction["source"] != "cache"
+    assert extraction["fields"]["patient_name"] == "Rajesh Kumar"
@@ -0,0 +1,81 @@
+import pytest
+import docgen_core
+from near_duplicates import NearDuplicateIndex, similarity, minhash
+
+BILL = """CITY CARE HOSPITAL, PUNE
+FINAL BILL
+Patient Name: Rajesh Kumar
+Policy No: SH-2024-889911
+Date of Admission: 12/03/2024
+Room rent 3 days 4,500.00
+Consultation charges 1,200.00
+Pharmacy and consumables 2,340.00
+Laboratory investigations 1,850.00
+Nursing charges 900.00
+Diet and dietician charges 650.00
+Medical equipment and oxygen 1,100.00
+Bed side procedures 500.00
+Registration and admission charges 300.00
+Grand Total: 9,890.00
+Payments received against this bill are subject to realisation. All disputes are subject to Pune
+jurisdiction only. This is a computer generated bill and needs no signature. Please retain this bill
+for your insurance claim and present it with the discharge summary and all investigation reports.
+"""
+
+@pytest.fixture
+def index(tmp_path):
+    return NearDuplicateIndex(str(tmp_path / "near_duplicates.sqlite3"), threshold=0.75)
+
+def rescan(text):
+    """The same bill read again, with the kind of differences OCR introduces."""
+    return text.replace("Consultation", "Consu1tation").replace("9,890.00", "9,890.0O") + "Page 1 of 1\n"
+
+def test_rescan_is_found_and_other_documents_are_not(index):
+    index.add(BILL, "Medical Bill", {"patient_name": "Rajesh Kumar"}, "first.pdf")
+    found = index.find(rescan(BILL), "Medical Bill")
+    assert found["file_name"] == "first.pdf"
+    assert found["similarity"] >= 0.75
+    assert index.find(rescan(BILL), "Insurance Card") is None
+    assert index.find("Discharge summary for an unrelated patient with a long different history " * 3,
+                      "Medical Bill") is None
+    # Only misses are counted by find; a match counts once the caller accepts or rejects it
+    assert index.stats()["hits"] == 0
+    assert index.stats()["misses"] == 2
+
+def test_threshold_is_respected(tmp_path):
+    strict = NearDuplicateIndex(str(tmp_path / "strict.sqlite3"), threshold=1.0)
+    strict.add(BILL, "Medical Bill", {"patient_name": "Rajesh Kumar"})
+    assert strict.find(rescan(BILL), "Medical Bill") is None
+    assert strict.find(BILL, "Medical Bill")["similarity"] == 1.0
+
+def test_short_text_is_not_indexed(index):
+    assert minhash("too short") is None
+    assert index.add("too short", "Medical Bill", {"patient_name": "A"}) is None
+    assert similarity(minhash(BILL), minhash(BILL)) == 1.0
+
+# index_extraction keys entries by document type and extraction variant, hence "Medical Bill|" below
+@pytest.fixture
+def core_index(index, monkeypatch):
+    monkeypatch.setattr(docgen_core, "get_duplicate_index", lambda: index)
+    return index
+
+def test_matching_identity_is_reused(core_index):
+    docgen_core.index_extraction(BILL, "Medical Bill", {"patient_name": "Rajesh Kumar",
+                                                        "policy_number": "SH-2024-889911"})
+    assert docgen_core.find_near_duplicate(rescan(BILL), "Medical Bill") is not None
+    assert core_index.stats()["hits"] == 1
+
+def test_different_patient_on_same_template_is_rejected(core_index):
+    docgen_core.index_extraction(BILL, "Medical Bill", {"patient_name": "Rajesh Kumar",
+                                                        "policy_number": "SH-2024-889911"})
+    other = rescan(BILL).replace("Rajesh Kumar", "Sunita Devi")
+    assert core_index.find(other, "Medical Bill|") is not None
+    assert docgen_core.find_near_duplicate(other, "Medical Bill") is None
+    stats = core_index.stats()
+    assert (stats["hits"], stats["rejected"]) == (0, 1)
+
+def test_match_without_any_identity_read_is_rejected(core_index):
+    anonymous = BILL.replace("Patient Name: Rajesh Kumar\n", "").replace("Policy No: SH-2024-889911\n", "")
+    docgen_core.index_extraction(anonymous, "Medical Bill", {"patient_name": "Rajesh Kumar"})
+    assert core_index.find(rescan(anonymous), "Medical Bill|") is not None
+    assert docgen_core.find_near_duplicate(rescan(anonymous), "Medical Bill") is None
@@ -0,0 +1,58 @@
+import io
+import shutil
+import pytest
+import ocr_engine
+from ocr_engine import get_profile, ocr_many, preprocess_image, submit, submit_ocr, target_side
+from upload_spool import UploadTooLarge
+
+def png(width, height, color=255):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("L", (width, height), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def test_otsu_threshold_falls_between_ink_and_paper():
+    histogram = [0] * 256
+    histogram[30] = 400
+    histogram[220] = 1600
+    assert 30 <= ocr_engine._otsu_threshold(histogram) < 220
+
+def test_preprocessing_scales_to_the_profile_and_binarizes():
+    from PIL import Image
+
+    profile = get_profile("Medical Bill")
+    image = Image.new("RGB", (6000, 4000), "white")
+    image.paste((40, 40, 40), (100, 100, 2000, 400))
+    result = preprocess_image(image, profile)
+    assert max(result.size) == target_side(profile)
+    assert {level for level, count in enumerate(result.histogram()) if count} <= {0, 255}
+
+def test_unknown_document_types_use_the_default_profile():
+    assert get_profile("Discharge Summary") is ocr_engine.OCR_PROFILES["Other"]
+
+def test_oversized_images_are_refused(monkeypatch):
+    monkeypatch.setattr(ocr_engine, "MAX_IMAGE_PIXELS", 100)
+    with pytest.raises(UploadTooLarge):
+        ocr_engine.open_image(io.BytesIO(png(20, 20)), get_profile("Other"))
+
+@pytest.mark.skipif(shutil.which("tesseract") is not None, reason="tesseract is installed")
+def test_pool_survives_a_missing_tesseract():
+    with pytest.raises(RuntimeError):
+        submit_ocr(png(200, 100)).result(timeout=60)
+    # The failure came back as a plain error, so the pool is still usable
+    assert submit(target_side, get_profile("Other")).result(timeout=60) == target_side(get_profile("Other"))
+
+@pytest.mark.skipif(shutil.which("tesseract") is None, reason="tesseract is not installed")
+def test_pool_ocrs_images_in_order():
+    from PIL import Image, ImageDraw
+
+    pages = []
+    for word in ("ALPHA", "BRAVO"):
+        image = Image.new("L", (1200, 300), 255)
+        ImageDraw.Draw(image).text((50, 100), word, fill=0, font_size=120)
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        pages.append(buffer.getvalue())
+    texts = ocr_many(pages)
+    assert "ALPHA" in texts[0] and "BRAVO" in texts[1]
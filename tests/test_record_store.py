@@ -0,0 +1,45 @@
+import pytest
+from record_store import RecordStore
+
+@pytest.fixture
+def store(tmp_path):
+    store = RecordStore(str(tmp_path / "records.sqlite3"))
+    store.save_extraction({"patient_name": "Rajesh Kumar", "policy_number": "SH-2024-889911",
+                           "date_of_birth": "05/03/1972", "insurance_company": "Star Health and Allied Insurance"})
+    store.save_extraction({"patient_name": "Sunita Devi", "policy_number": "HD/77/001234",
+                           "date_of_birth": "1980-02-01", "insurance_company": "HDFC ERGO General Insurance"})
+    return store
+
+def names(results):
+    return [result["patient_name"] for result in results]
+
+@pytest.mark.parametrize("query, match", [
+    ("raj", "name"),
+    ("SH2024", "policy number"),
+    ("sh-2024-88", "policy number"),
+    ("05-03-1972", "date of birth"),
+    ("kumar", "contains"),
+    ("star health", "contains"),
+    ("rajsh", "similar"),
+])
+def test_search_finds_the_patient(store, query, match):
+    results = store.search(query)
+    assert names(results)[:1] == ["Rajesh Kumar"]
+    assert results[0]["match"] == match
+
+def test_search_ignores_unrelated_and_short_queries(store):
+    assert store.search("zzzzzz") == []
+    assert store.search("r") == []
+
+def test_extractions_of_one_patient_are_merged(store):
+    store.save_extraction({"policy_number": "SH 2024 889911", "phone": "9876543210"})
+    results = store.search("rajesh")
+    assert len(results) == 1
+    record = store.get(results[0]["id"])
+    assert record["fields"]["phone"] == "9876543210"
+    assert record["fields"]["date_of_birth"] == "1972-03-05"
+
+def test_letters_are_kept_with_the_patient(store):
+    store.save_letter({"patient_name": "Sunita Devi", "policy_number": "HD/77/001234"}, "Appeal Letter", "Dear Sir")
+    record = store.get(store.search("sunita")[0]["id"])
+    assert [letter["letter_type"] for letter in record["letters"]] == ["Appeal Letter"]
@@ -0,0 +1,157 @@
+import io
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from ocr_engine import ocr_image
+from upload_spool import open_source, portable_source
+
+# Streamlit-free text extraction so the same code can run in worker processes
+
+PDF_EXTENSIONS = (".pdf",)
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+SUPPORTED_EXTENSIONS = PDF_EXTENSIONS + IMAGE_EXTENSIONS
+
+PDF_PAGE_WORKERS = int(os.getenv("PDF_PAGE_WORKERS", min(os.cpu_count() or 1, 4)))
+PARALLEL_PAGE_THRESHOLD = 8  # below this, process startup costs more than it saves
+PAGES_PER_TASK = 4
+
+# -------------------- PDF --------------------
+
+def _ocr_page_images(page, document_type):
+    """OCRs the images embedded in a page that has no text layer (scanned pages)."""
+    try:
+        images = page.images
+    except Exception:
+        return ""
+    parts = []
+    for embedded in images:
+        page_text = ocr_image(io.BytesIO(embedded.data), document_type)
+        if page_text.strip():
+            parts.append(page_text)
+    return "\n".join(parts)
+
+def _page_text(page, ocr_fallback, document_type):
+    page_text = page.extract_text() or ""
+    if page_text.strip() or not ocr_fallback:
+        return page_text
+    return _ocr_page_images(page, document_type)
+
+def _extract_page_range(pdf_source, page_numbers, ocr_fallback, document_type):
+    from PyPDF2 import PdfReader
+
+    with open_source(pdf_source) as stream:
+        pdf_reader = PdfReader(stream)
+        return [_page_text(pdf_reader.pages[number], ocr_fallback, document_type) for number in page_numbers]
+
+def iter_pdf_pages(pdf_file, max_pages=None, ocr_fallback=True, workers=PDF_PAGE_WORKERS, document_type="Other"):
+    """Lazily yields page texts in order; parallel reads are submitted in waves so consumers can stop early.
+
+    `pdf_file` is bytes, a path, a SpooledUpload or a file-like object; files on disk are memory-mapped
+    and parallel workers get the path rather than a copy of the document.
+    """
+    from PyPDF2 import PdfReader
+
+    with open_source(pdf_file) as stream:
+        pdf_reader = PdfReader(stream)
+        page_count = len(pdf_reader.pages)
+        if max_pages:
+            page_count = min(page_count, max_pages)
+        if workers <= 1 or page_count < PARALLEL_PAGE_THRESHOLD:
+            for number in range(page_count):
+                yield _page_text(pdf_reader.pages[number], ocr_fallback, document_type)
+            return
+    pdf_source = portable_source(pdf_file)
+    wave_size = workers * PAGES_PER_TASK
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for wave_start in range(0, page_count, wave_size):
+            wave_end = min(wave_start + wave_size, page_count)
+            futures = [
+                pool.submit(_extract_page_range, pdf_source,
+                            range(start, min(start + PAGES_PER_TASK, wave_end)), ocr_fallback, document_type)
+                for start in range(wave_start, wave_end, PAGES_PER_TASK)
+            ]
+            for future in futures:
+                yield from future.result()
+
+def take_text(pages, max_chars=None):
+    """Pulls pages from an iterator until `max_chars` have been collected, then stops reading."""
+    page_texts = []
+    collected = 0
+    with closing(pages):
+        for page_text in pages:
+            if not page_text:
+                continue
+            page_texts.append(page_text)
+            collected += len(page_text) + 1
+            if max_chars and collected >= max_chars:
+                break
+    return "".join(page_text + "\n" for page_text in page_texts)
+
+def read_pdf_text(pdf_file, max_chars=None, max_pages=None, ocr_fallback=True, workers=PDF_PAGE_WORKERS,
+                  smart_window=False, document_type="Other"):
+    """Extracts page text, OCRing image-only pages and stopping once `max_chars` have been collected."""
+    if smart_window and max_chars:
+        scan_pages = min(max_pages or SMART_WINDOW_SCAN_PAGES, SMART_WINDOW_SCAN_PAGES)
+        pages = iter_pdf_pages(pdf_file, scan_pages, ocr_fallback, workers, document_type)
+        return select_smart_window(pages, max_chars)
+    return take_text(iter_pdf_pages(pdf_file, max_pages, ocr_fallback, workers, document_type), max_chars)
+
+# -------------------- SMART WINDOW --------------------
+
+# Terms that show up near the fields the extraction prompt asks for
+FIELD_KEYWORDS = (
+    "patient", "name", "policy", "member", "insured", "dob", "birth", "diagnosis", "icd",
+    "condition", "treatment", "procedure", "service", "admission", "discharge", "provider",
+    "hospital", "doctor", "insurance", "insurer", "claim", "amount", "total", "bill", "₹", "rs",
+    "phone", "mobile", "email", "address",
+)
+SMART_WINDOW_SCAN_PAGES = int(os.getenv("SMART_WINDOW_SCAN_PAGES", 60))
+_WORD_PATTERN = re.compile(r"[\w₹]+", re.UNICODE)
+
+def keyword_density(page_text, keywords=FIELD_KEYWORDS):
+    words = _WORD_PATTERN.findall(page_text.lower())
+    if not words:
+        return 0.0
+    keyword_set = set(keywords)
+    return sum(1 for word in words if word in keyword_set) / len(words)
+
+def select_smart_window(pages, max_chars, keywords=FIELD_KEYWORDS):
+    """Fills the budget with the pages densest in field keywords, keeping them in document order.
+
+    The first page is always kept since it usually carries the patient and policy header.
+    """
+    with closing(pages):
+        page_texts = [page_text for page_text in pages if page_text and page_text.strip()]
+    if not page_texts:
+        return ""
+    ranked = sorted(range(1, len(page_texts)),
+                    key=lambda index: keyword_density(page_texts[index], keywords), reverse=True)
+    selected = []
+    collected = 0
+    for index in [0] + ranked:
+        if collected >= max_chars:
+            break
+        selected.append(index)
+        collected += len(page_texts[index]) + 1
+    return "".join(page_texts[index] + "\n" for index in sorted(selected))
+
+# -------------------- IMAGES --------------------
+
+def read_image_text(image_file, document_type="Other"):
+    return ocr_image(image_file, document_type)
+
+# -------------------- DISPATCH --------------------
+
+def is_pdf(file_name):
+    return os.path.splitext(file_name)[1].lower() in PDF_EXTENSIONS
+
+def extract_text_from_source(source, file_name, max_chars=None, smart_window=False, document_type="Other"):
+    """Picks the PDF or OCR path from the file extension; safe to submit to a process pool with
+    bytes or a file path as the source."""
+    if is_pdf(file_name):
+        # Already running inside a worker process, so pages are read serially
+        return read_pdf_text(source, max_chars=max_chars, workers=1, smart_window=smart_window,
+                             document_type=document_type)
+    with open_source(source) as image_file:
+        return read_image_text(image_file, document_type)
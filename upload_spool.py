@@ -0,0 +1,129 @@
+import io
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+
+# Uploads are copied in chunks into memory up to UPLOAD_SPOOL_BYTES and into a named
+# temp file beyond that. Spilled files are memory-mapped for PDF parsing and handed
+# to worker processes by path, so a 100 MB scan is never pickled or held as one bytes
+# object per stage.
+#
+# Everything that reads documents accepts a "source": bytes, a file path, a
+# SpooledUpload or a seekable file-like object.
+
+# -------------------- CONFIGURATION --------------------
+
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", 8 * 1024 * 1024))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 100 * 1024 * 1024))
+CHUNK_BYTES = 1024 * 1024
+
+class UploadTooLarge(ValueError):
+    pass
+
+# -------------------- SPOOLING --------------------
+
+class SpooledUpload:
+    """An upload held in memory while small and in a named temp file once it passes `spool_bytes`."""
+
+    def __init__(self, name="upload", spool_bytes=UPLOAD_SPOOL_BYTES):
+        self.name = name
+        self.size = 0
+        self.path = None
+        self._spool_bytes = spool_bytes
+        self._buffer = io.BytesIO()
+        self._file = None
+
+    def write(self, data):
+        if self._file is None and self.size + len(data) > self._spool_bytes:
+            self._file = tempfile.NamedTemporaryFile(prefix="docgen-upload-", delete=False)
+            self.path = self._file.name
+            self._file.write(self._buffer.getbuffer())
+            self._buffer = None
+        (self._file or self._buffer).write(data)
+        self.size += len(data)
+
+    def finish(self):
+        if self._file is not None:
+            self._file.close()
+        return self
+
+    def source(self):
+        """What to hand a worker process: the temp file path once spilled, otherwise the bytes."""
+        return self.path or self._buffer.getvalue()
+
+    def close(self):
+        if self.path:
+            os.unlink(self.path)
+            self.path = None
+        self._buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def spool_upload(stream, name="upload", limit=MAX_UPLOAD_BYTES, spool_bytes=UPLOAD_SPOOL_BYTES):
+    """Copies a file-like object into a SpooledUpload, raising UploadTooLarge past `limit` bytes."""
+    upload = SpooledUpload(name, spool_bytes)
+    try:
+        while True:
+            chunk = stream.read(CHUNK_BYTES)
+            if not chunk:
+                break
+            if limit and upload.size + len(chunk) > limit:
+                raise UploadTooLarge(f"{name} is larger than the {limit / (1024 * 1024):.3g} MB upload limit")
+            upload.write(chunk)
+    except BaseException:
+        upload.finish().close()
+        raise
+    return upload.finish()
+
+# -------------------- READING SOURCES --------------------
+
+def portable_source(source):
+    """A picklable form of `source` for process pools: a path where there is one, otherwise bytes."""
+    if isinstance(source, SpooledUpload):
+        return source.source()
+    if isinstance(source, (bytes, str)):
+        return source
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    source.seek(0)
+    return source.read()
+
+@contextmanager
+def open_source(source):
+    """A seekable binary stream over `source`; files on disk are memory-mapped rather than read."""
+    if isinstance(source, SpooledUpload):
+        source = source.source()
+    if isinstance(source, bytes):
+        yield io.BytesIO(source)
+    elif isinstance(source, str):
+        with open(source, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield io.BytesIO()
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+    else:
+        source.seek(0)
+        yield source
+
+def iter_chunks(source, chunk_size=CHUNK_BYTES):
+    with open_source(source) as stream:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def source_size(source):
+    if isinstance(source, SpooledUpload):
+        return source.size
+    if isinstance(source, bytes):
+        return len(source)
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    return source.seek(0, io.SEEK_END)
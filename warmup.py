@@ -0,0 +1,105 @@
+import argparse
+import io
+import os
+import re
+import subprocess
+import sys
+import time
+from docgen_core import get_duplicate_index, get_extraction_cache, get_gemini_client, get_generation_cache
+from docx_renderer import get_base
+from letter_templates import get_environment
+from near_duplicates import permutations
+from ocr_engine import OCR_POOL_WORKERS, ocr_many
+from telemetry import span
+
+# Heavy libraries (genai, pytesseract, PyPDF2, python-docx, numpy) are imported on the
+# first path that needs them, so importing the app is cheap. warm_up() walks those paths
+# once with throwaway inputs before a replica takes traffic, so the first request does
+# not pay for imports, OCR worker start-up or building the base .docx.
+#
+#     python warmup.py                  # warm up and print the time each step took
+#     python warmup.py --import-profile # slowest imports of docgen_core, from -X importtime
+
+# -------------------- CONFIGURATION --------------------
+
+WARM_UP = os.getenv("DOCGEN_WARM_UP", "0") == "1"
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+# -------------------- WARM-UP --------------------
+
+def _blank_png():
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("L", (120, 40), 255).save(buffer, "PNG")
+    return buffer.getvalue()
+
+def _read_pdf():
+    from PyPDF2 import PdfReader, PdfWriter
+
+    buffer = io.BytesIO()
+    writer = PdfWriter()
+    writer.add_blank_page(width=72, height=72)
+    writer.write(buffer)
+    return len(PdfReader(buffer).pages)
+
+WARM_UP_STEPS = (
+    ("caches", lambda: (get_extraction_cache(), get_generation_cache(), get_duplicate_index(), permutations())),
+    ("pdf", _read_pdf),
+    # One tiny image per pool worker so every OCR process is started and has imported pytesseract
+    ("ocr", lambda: ocr_many([_blank_png()] * OCR_POOL_WORKERS)),
+    ("docx", get_base),
+    ("templates", get_environment),
+)
+
+def warm_up(api_key=None):
+    """Runs every warm-up step and returns {step: seconds}, or the error for steps that failed.
+
+    A failed step is reported rather than raised; the request that needs it will raise properly.
+    """
+    timings = {}
+    steps = (("gemini", lambda: get_gemini_client(api_key)),) + WARM_UP_STEPS
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            with span(f"warm_up.{name}"):
+                step()
+        except Exception as e:
+            timings[name] = f"{type(e).__name__}: {e}"
+        else:
+            timings[name] = round(time.perf_counter() - started, 3)
+    return timings
+
+# -------------------- IMPORT PROFILE --------------------
+
+def import_profile(module="docgen_core", top=20):
+    """The `top` slowest imports of a fresh `import module`, as (name, self_us, cumulative_us)
+    rows sorted by cumulative time."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((f"{'  ' * (len(indent) // 2)}{name}", int(self_us), int(cumulative_us)))
+    return sorted(rows, key=lambda row: row[2], reverse=True)[:top]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Warm up the pipeline, or profile its import time.")
+    parser.add_argument("--import-profile", action="store_true", help="Print the slowest imports instead")
+    parser.add_argument("--module", default="docgen_core", help="Module to profile with --import-profile")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args(argv)
+    if args.import_profile:
+        print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+        for name, self_us, cumulative_us in import_profile(args.module, args.top):
+            print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {name}")
+        return
+    for name, outcome in warm_up().items():
+        print(f"{name:>10}  {outcome if isinstance(outcome, str) else f'{outcome:.3f}s'}")
+
+if __name__ == "__main__":
+    main()